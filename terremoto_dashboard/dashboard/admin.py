@@ -1,6 +1,36 @@
 from django.contrib import admin
-from .models import IncidentSummary
+from .models import IncidentSummary, Bridge, Hospital, Shelter, ServiceStatus, Job, SyncPeer
 
 @admin.register(IncidentSummary)
 class IncidentSummaryAdmin(admin.ModelAdmin):
-    list_display = ('created_at','population','fatalities','hospital_operational_pct')
+    list_display = ('id','name','created_at','population','fatalities','hospital_operational_pct')
+
+@admin.register(Bridge)
+class BridgeAdmin(admin.ModelAdmin):
+    list_display = ('name','incident','status','lat','lng')
+    list_filter = ('incident','status')
+
+@admin.register(Hospital)
+class HospitalAdmin(admin.ModelAdmin):
+    list_display = ('name','incident','total_beds','available_beds','operational')
+    list_filter = ('incident',)
+
+@admin.register(Shelter)
+class ShelterAdmin(admin.ModelAdmin):
+    list_display = ('name','incident','capacity','occupants')
+    list_filter = ('incident',)
+
+@admin.register(ServiceStatus)
+class ServiceStatusAdmin(admin.ModelAdmin):
+    list_display = ('name','incident','status','updated_at')
+    list_filter = ('incident',)
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id','kind','status','progress','created_at','finished_at')
+    list_filter = ('kind','status')
+
+@admin.register(SyncPeer)
+class SyncPeerAdmin(admin.ModelAdmin):
+    list_display = ('node','incident','acked','received','updated_at')
+    list_filter = ('incident',)
@@ -0,0 +1,83 @@
+"""
+Consultas de las vistas asíncronas (servidas por malvinas/asgi.py).
+
+api_summary y api_metrics son asíncronas; el resto de las vistas son sync.
+El ORM asíncrono de Django (aget(), afirst(), async for) corre cada consulta
+con sync_to_async(thread_sensitive=True): todas las de un request pasan en
+fila por el mismo hilo, y juntarlas con asyncio.gather no las superpone. Bajo
+ASGI, acá cada función va con thread_sensitive=False a un hilo del pool, con
+sus propias conexiones: con SQLite en WAL los lectores no se bloquean entre sí
+y sqlite3 suelta el GIL mientras corre la consulta, así que las consultas
+independientes de un request avanzan a la vez y ningún request ocupa un hilo
+mientras espera. Los hilos del pool duran lo que el proceso: sus conexiones se
+reusan según CONN_MAX_AGE, como las de un worker WSGI.
+
+Bajo WSGI (y con el cliente de test de Django) la vista asíncrona corre
+mientras el hilo del worker la espera bloqueado: las funciones corren en ese
+hilo, una tras otra, con sus conexiones y su transacción (en los tests, la de
+TestCase, que otra conexión no vería).
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections, connections
+
+
+def _pooled(func, args):
+    def call():
+        # los hilos del pool no reciben request_started: conexiones vencidas o con errores se cierran acá
+        close_old_connections()
+        return func(*args)
+    return call
+
+
+async def run(request, func, *args):
+    """func(*args) en un hilo del pool (bajo WSGI, en el del request)."""
+    if not isinstance(request, ASGIRequest):
+        return await sync_to_async(func)(*args)
+    return await sync_to_async(_pooled(func, args), thread_sensitive=False)()
+
+
+async def gather(request, *funcs):
+    """Corre a la vez funciones sin argumentos (p. ej. functools.partial) y devuelve sus resultados en orden."""
+    if not isinstance(request, ASGIRequest):
+        return await sync_to_async(lambda: [func() for func in funcs])()
+    return await asyncio.gather(*(sync_to_async(_pooled(func, ()), thread_sensitive=False)() for func in funcs))
+
+
+def streaming(request, iterator):
+    """
+    Contenido para un StreamingHttpResponse. Bajo ASGI Django juntaría un
+    iterador sync entero en memoria antes de enviarlo: se
+    lo recorre desde un único hilo (el cursor queda en la conexión que lo
+    abrió) y los bloques salen a medida que se leen. Bajo WSGI queda igual.
+    """
+    if not isinstance(request, ASGIRequest):
+        return iterator
+    return _iterate(iterator)
+
+
+def _close(iterator):
+    close = getattr(iterator, 'close', None)
+    if close is not None:
+        close()
+    connections.close_all()
+
+
+async def _iterate(iterator):
+    done = object()
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dashboard-stream')
+    try:
+        while True:
+            # la medición del request (ver perf.py) va en el contexto de cada bloque
+            chunk = await loop.run_in_executor(executor, contextvars.copy_context().run, next, iterator, done)
+            if chunk is done:
+                break
+            yield chunk
+    finally:
+        await loop.run_in_executor(executor, _close, iterator)
+        executor.shutdown(wait=False)
@@ -0,0 +1,229 @@
+"""
+Asignación de demanda (personas afectadas o heridos) a refugios y hospitales.
+
+La demanda son puntos (lat, lng, personas). Para cada punto se buscan los K
+establecimientos más cercanos con lugar libre —con scipy.spatial.cKDTree si
+está instalado, o por bloques con NumPy— y se asigna en orden de distancia
+creciente hasta agotar la capacidad (greedy). La demanda que queda sin cubrir
+se reintenta contra los establecimientos que todavía tienen lugar.
+
+Las distancias se calculan sobre vectores unitarios 3D: la cuerda es monótona
+con la distancia sobre la esfera y se convierte a metros (igual que haversine).
+"""
+import time
+
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # scipy es opcional: sin él se usa el cálculo por bloques
+    cKDTree = None
+
+from .models import EPICENTER, Hospital, Shelter
+from .spatial import EARTH_RADIUS_M
+
+KINDS = ('shelters', 'hospitals')
+DEFAULT_K = 8
+DEFAULT_CLUSTERS = 50
+MAX_ROUNDS = 6
+MAX_DEMAND_POINTS = 200_000
+# núcleos de la demanda estimada: cada uno es un punto de demanda más
+MAX_CLUSTERS = 10_000
+# filas de demanda por bloque en el cálculo sin KD-tree (~BLOCK x establecimientos floats)
+BLOCK = 1024
+
+
+class AllocationError(ValueError):
+    """Demanda o parámetros inválidos."""
+
+
+def unit_vectors(lat, lng):
+    lat, lng = np.radians(lat), np.radians(lng)
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)))
+
+
+def chord_to_m(chord):
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.clip(chord / 2, 0.0, 1.0))
+
+
+def facilities(incident_id, kind):
+    """(ids, lat, lng, lugares libres) de los establecimientos del incidente como arrays."""
+    if kind == 'shelters':
+        qs = Shelter.objects.filter(incident_id=incident_id)
+        rows = list(qs.values_list('id', 'lat', 'lng', 'capacity', 'occupants'))
+        data = np.array(rows, dtype=float).reshape(-1, 5)
+        free = np.maximum(data[:, 3] - data[:, 4], 0)
+    elif kind == 'hospitals':
+        qs = Hospital.objects.filter(incident_id=incident_id)
+        rows = list(qs.values_list('id', 'lat', 'lng', 'available_beds', 'operational'))
+        data = np.array(rows, dtype=float).reshape(-1, 5)
+        # un hospital no operativo no recibe pacientes
+        free = np.where(data[:, 4] > 0, np.maximum(data[:, 3], 0), 0)
+    else:
+        raise AllocationError(f"kind debe ser uno de: {', '.join(KINDS)}")
+    return data[:, 0].astype(np.int64), data[:, 1], data[:, 2], free.astype(np.int64)
+
+
+def parse_demand(rows):
+    """
+    Demanda como lista de {"lat", "lng", "people"} o de [lat, lng, people].
+    Devuelve (lat, lng, people) como arrays.
+    """
+    if not isinstance(rows, list) or not rows:
+        raise AllocationError("demand debe ser una lista no vacía")
+    if len(rows) > MAX_DEMAND_POINTS:
+        raise AllocationError(f"demand admite hasta {MAX_DEMAND_POINTS} puntos")
+    try:
+        if isinstance(rows[0], dict):
+            rows = [(row['lat'], row['lng'], row['people']) for row in rows]
+        data = np.array(rows, dtype=float)
+    except (KeyError, TypeError, ValueError):
+        raise AllocationError("cada punto de demand necesita lat, lng y people numéricos")
+    if data.ndim != 2 or data.shape[1] != 3 or not np.isfinite(data).all():
+        raise AllocationError("cada punto de demand necesita lat, lng y people numéricos")
+    lat, lng, people = data[:, 0], data[:, 1], data[:, 2]
+    if (np.abs(lat) > 90).any() or (np.abs(lng) > 180).any() or (people < 0).any():
+        raise AllocationError("demand tiene coordenadas fuera de rango o people negativo")
+    return lat, lng, np.rint(people).astype(np.int64)
+
+
+def check_clusters(clusters):
+    if not 1 <= clusters <= MAX_CLUSTERS:
+        raise AllocationError(f"clusters debe estar entre 1 y {MAX_CLUSTERS}")
+    return clusters
+
+
+def default_demand(summary, kind, clusters=DEFAULT_CLUSTERS, seed=0):
+    """
+    Demanda estimada a partir del resumen: quienes necesitan albergue (refugios)
+    o los heridos graves (hospitales), repartidos en `clusters` núcleos
+    alrededor del epicentro. Reproducible para una misma semilla.
+    """
+    check_clusters(clusters)
+    if kind == 'shelters':
+        total = (summary.shelter_needed_min + summary.shelter_needed_max) // 2
+    else:
+        total = summary.avg_injured_severe()
+    rng = np.random.default_rng(seed)
+    lat = EPICENTER['lat'] + rng.normal(0, 0.01, clusters)
+    lng = EPICENTER['lng'] + rng.normal(0, 0.01, clusters)
+    people = rng.multinomial(max(int(total), 0), rng.dirichlet(np.ones(clusters)))
+    return lat, lng, people.astype(np.int64)
+
+
+def nearest(points, targets, k):
+    """
+    Los k vecinos más cercanos de cada punto (vectores unitarios), ordenados.
+    Devuelve (distancias en metros, índices en `targets`), ambos de forma (n, k).
+    """
+    k = min(k, len(targets))
+    if cKDTree is not None:
+        chord, idx = cKDTree(targets).query(points, k=k)
+        return chord_to_m(chord.reshape(len(points), k)), idx.reshape(len(points), k)
+    # el ranking se hace en float32 sobre vectores centrados (el error de
+    # redondeo escala con la extensión de los datos, no con el radio terrestre);
+    # las distancias de los k elegidos se recalculan en float64
+    center = targets.mean(axis=0)
+    targets32 = (targets - center).astype(np.float32)
+    norms32 = (targets32 * targets32).sum(axis=1)
+    dist = np.empty((len(points), k))
+    idx = np.empty((len(points), k), dtype=np.intp)
+    for start in range(0, len(points), BLOCK):
+        block = points[start:start + BLOCK]
+        # |a - b|² - |a|² = |b|² - 2 a·b: alcanza para ordenar por fila
+        sq = norms32 - 2 * ((block - center).astype(np.float32) @ targets32.T)
+        if k < len(targets):
+            part = np.argpartition(sq, k - 1, axis=1)[:, :k]
+        else:
+            part = np.broadcast_to(np.arange(k), (len(block), k))
+        chord = np.linalg.norm(block[:, None, :] - targets[part], axis=2)
+        order = np.argsort(chord, axis=1)
+        idx[start:start + len(block)] = np.take_along_axis(part, order, axis=1)
+        dist[start:start + len(block)] = chord_to_m(np.take_along_axis(chord, order, axis=1))
+    return dist, idx
+
+
+def allocate(demand, facility_data, k=DEFAULT_K):
+    """
+    Asigna la demanda (lat, lng, people) a los establecimientos (ids, lat, lng,
+    libres). Devuelve (asignaciones, sin cubrir, libres al final) donde cada
+    asignación es (índice de demanda, índice de establecimiento, personas, metros).
+    """
+    d_lat, d_lng, people = demand
+    _, f_lat, f_lng, free = facility_data
+    d_xyz, f_xyz = unit_vectors(d_lat, d_lng), unit_vectors(f_lat, f_lng)
+    remaining = people.tolist()
+    room = free.tolist()
+    assignments = []
+    active = np.flatnonzero(people > 0)
+    for _ in range(MAX_ROUNDS):
+        open_ = np.flatnonzero(np.asarray(room) > 0)
+        if not len(active) or not len(open_):
+            break
+        dist, local = nearest(d_xyz[active], f_xyz[open_], k)
+        candidates = open_[local].ravel()
+        owners = np.repeat(active, local.shape[1])
+        dist = dist.ravel()
+        order = np.argsort(dist, kind='stable')
+        # el reparto depende de la capacidad que va quedando: este lazo es secuencial
+        for d, f, meters in zip(owners[order].tolist(), candidates[order].tolist(), dist[order].tolist()):
+            need = remaining[d]
+            if not need or not room[f]:
+                continue
+            amount = min(need, room[f])
+            remaining[d] -= amount
+            room[f] -= amount
+            assignments.append((d, f, amount, meters))
+        active = np.flatnonzero(np.asarray(remaining) > 0)
+        k *= 4
+    return assignments, np.asarray(remaining, dtype=np.int64), np.asarray(room, dtype=np.int64)
+
+
+def run(incident_id, kind, demand=None, k=DEFAULT_K, clusters=DEFAULT_CLUSTERS, detail=False, summary=None):
+    """
+    Corre la asignación contra los establecimientos del incidente y arma el
+    resultado serializable que devuelven la API y el comando. Sin `demand` la
+    demanda se estima desde `summary`.
+    """
+    if kind not in KINDS:
+        raise AllocationError(f"kind debe ser uno de: {', '.join(KINDS)}")
+    if k < 1:
+        raise AllocationError("k debe ser positivo")
+    check_clusters(clusters)
+    start = time.perf_counter()
+    if demand is None:
+        demand = default_demand(summary, kind, clusters)
+    facility_data = facilities(incident_id, kind)
+    ids, _, _, free = facility_data
+    assignments, unmet, free_after = allocate(demand, facility_data, k)
+
+    people = demand[2]
+    assigned = np.zeros(len(ids), dtype=np.int64)
+    distances = np.array([a[3] for a in assignments])
+    amounts = np.array([a[2] for a in assignments], dtype=np.int64)
+    if assignments:
+        np.add.at(assigned, [a[1] for a in assignments], amounts)
+    total_assigned = int(amounts.sum()) if assignments else 0
+    result = {
+        "kind": kind,
+        "engine": "kdtree" if cKDTree is not None else "numpy",
+        "demand_points": int(len(people)),
+        "demand": int(people.sum()),
+        "assigned": total_assigned,
+        "unmet": int(unmet.sum()),
+        "capacity_free": int(free.sum()),
+        "mean_distance_m": round(float((distances * amounts).sum() / total_assigned), 1) if total_assigned else None,
+        "max_distance_m": round(float(distances.max()), 1) if assignments else None,
+        "facilities": [
+            {"id": int(ids[i]), "assigned": int(assigned[i]), "free_after": int(free_after[i])}
+            for i in np.flatnonzero(assigned)
+        ],
+    }
+    if detail:
+        result["assignments"] = [
+            {"demand": d, "facility": int(ids[f]), "people": amount, "distance_m": round(meters, 1)}
+            for d, f, amount, meters in assignments
+        ]
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
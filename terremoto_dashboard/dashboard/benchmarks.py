@@ -0,0 +1,151 @@
+"""
+Benchmarks de la API a distintas escalas de datos.
+
+Cada escala carga un escenario sintético (scenario.generate) y mide, con el
+cliente de test de Django y en el mismo proceso, latencia, cantidad de
+consultas SQL y tamaño de respuesta de cada endpoint. Lo usan el comando
+`benchmark_api` (resultados en JSON para comparar entre commits) y los tests
+que verifican que la cantidad de consultas no crece con los datos.
+"""
+import statistics
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from . import changes, clusters, incidents, perf, roads, scenario, snapshot
+from .models import EPICENTER
+
+SCALES = {
+    'tiny': dict(shelters=3, hospitals=2, bridges=2, metric_points=20),
+    'small': dict(shelters=100, hospitals=20, bridges=50, metric_points=10_000),
+    'medium': dict(shelters=1_000, hospitals=200, bridges=500, metric_points=100_000),
+    'large': dict(shelters=10_000, hospitals=2_000, bridges=5_000, metric_points=1_000_000),
+}
+
+
+def _request(method, path, data=None, prepare=None, **headers):
+    def run(client):
+        if prepare:
+            prepare()
+        return getattr(client, method)(path, data, headers=headers)
+    return run
+
+
+def _idle_delta(client):
+    """Cliente al día con el feed de cambios: el delta vuelve vacío."""
+    cursor = client.get('/api/delta/').json()['cursor']
+    return _request('get', '/api/delta/', {'since': cursor})
+
+
+def _warm_summary(client):
+    """Cliente que ya tiene el ETag vigente de /api/summary/."""
+    etag = client.get('/api/summary/')['ETag']
+    return _request('get', '/api/summary/', **{'If-None-Match': etag})
+
+
+def _summary_as_of(client):
+    """Resumen en un momento pasado: un checkpoint más los cambios posteriores (ver history.py)."""
+    changes.checkpoint(incidents.resolve())
+    return _request('get', '/api/summary/', {'as_of': timezone.now().isoformat()})
+
+
+def _clusters(z, **params):
+    """Tesela de zoom z sobre el epicentro, con la pirámide ya armada."""
+    x, y = clusters.tile_for(EPICENTER['lat'], EPICENTER['lng'], z)
+    clusters.pyramid(incidents.resolve())
+    return _request('get', f'/api/clusters/{z}/{x}/{y}/', params)
+
+
+# (endpoint, variante) -> fábrica que recibe el cliente y devuelve la función a medir
+CASES = {
+    ('dashboard_view', 'default'): lambda client: _request('get', '/'),
+    ('api_summary', 'cold'): lambda client: _request('get', '/api/summary/', prepare=snapshot.clear_local_snapshot),
+    ('api_summary', 'not_modified'): _warm_summary,
+    ('api_summary', 'as_of'): _summary_as_of,
+    ('api_metrics', 'full'): lambda client: _request('get', '/api/metrics/'),
+    ('api_metrics', 'points=500'): lambda client: _request('get', '/api/metrics/', {'points': 500}),
+    ('api_metrics', 'binary'): lambda client: _request('get', '/api/metrics/', {'format': 'binary', 'delta': 1}),
+    ('api_clusters', 'z8'): lambda client: _clusters(8),
+    ('api_clusters', 'z8 mvt'): lambda client: _clusters(8, format='mvt'),
+    ('api_allocation', 'shelters'): lambda client: _request('get', '/api/allocation/', {'kind': 'shelters'}),
+    ('api_delta', 'idle'): _idle_delta,
+    ('api_simulate', 'default'): lambda client: _request('post', '/api/simulate/'),
+}
+
+
+def local_cache():
+    """
+    override_settings con un cache 'dashboard' en memoria del proceso. El cache
+    configurado es compartido con los servidores en marcha: una corrida sobre
+    una base descartable no debe vaciarlo ni dejar ahí ids de incidentes que en
+    la base real no existen (o son otros).
+    """
+    return override_settings(CACHES={
+        **settings.CACHES,
+        'dashboard': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'dashboard-local'},
+    })
+
+
+def reset_data():
+    call_command('flush', interactive=False, verbosity=0)
+    # flush no dispara señales y reusa los ids: versiones e incidentes cacheados
+    # quedan viejos. Se corre bajo local_cache(): se vacía el cache propio, no el compartido
+    caches['dashboard'].clear()
+    snapshot.clear_local_snapshot()
+    roads.reset()
+    clusters.reset()
+
+
+def seed(sizes, seed=0):
+    reset_data()
+    counts = scenario.load(scenario.generate(seed=seed, **sizes))
+    # se mide el estado estable: el incidente actual ya está resuelto en el cache
+    incidents.resolve()
+    return counts
+
+
+# las tareas en segundo plano se ejecutan en línea: se mide su costo completo
+@override_settings(DASHBOARD_JOB_WORKERS=0)
+def measure(case, repeat=5):
+    """Ejecuta un caso `repeat` veces; devuelve latencias, consultas y bytes de la última respuesta."""
+    client = Client()
+    run = CASES[case](client)
+    timings, queries = [], []
+    response = None
+    for _ in range(repeat):
+        # cuenta las consultas de todas las conexiones y de todos los hilos del
+        # request, también las de las vistas asíncronas (ver perf.py y aio.py)
+        with perf.instrument(perf.RequestStats('benchmark')) as stats:
+            start = time.perf_counter()
+            response = run(client)
+            body = b''.join(response.streaming_content) if response.streaming else response.content
+            timings.append((time.perf_counter() - start) * 1000)
+        queries.append(stats.queries)
+    return {
+        "endpoint": case[0],
+        "variant": case[1],
+        "status": response.status_code,
+        "repeat": repeat,
+        "min_ms": round(min(timings), 3),
+        "p50_ms": round(statistics.median(timings), 3),
+        "max_ms": round(max(timings), 3),
+        "queries": max(queries),
+        "bytes": len(body),
+    }
+
+
+def run_scale(name, sizes, repeat=5, cases=None):
+    start = time.perf_counter()
+    seed(sizes)
+    seed_seconds = time.perf_counter() - start
+    results = []
+    for case in cases or CASES:
+        result = measure(case, repeat)
+        result.update(scale=name, sizes=sizes)
+        results.append(result)
+    return {"scale": name, "sizes": sizes, "seed_seconds": round(seed_seconds, 3), "results": results}
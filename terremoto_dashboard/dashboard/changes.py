@@ -0,0 +1,295 @@
+"""
+Feed incremental de cambios, por incidente.
+
+Cada alta, modificación o baja del resumen o de un recurso deja una fila en
+ResourceChange; los MetricPoint son solo-inserción y se siguen por su id. El
+cursor que recibe el cliente es "<último id de MetricPoint>.<último id de
+ResourceChange>" y con él /api/delta/ devuelve únicamente lo nuevo. Los ids
+son globales y cada feed filtra por su incidente, con los índices (incident, id)
+de las FK.
+
+Cada cambio guarda además los valores de los campos del objeto después del
+cambio, y cada DASHBOARD_HISTORY_CHECKPOINT_EVERY ids del registro se encola
+una tarea 'checkpoint' (ver jobs.py) que guarda el estado completo de los
+incidentes que cambiaron: con eso history.py reconstruye el estado en un
+momento pasado. El request que registró el cambio no lee ese estado.
+
+Los borrados de MetricPoint (compactación, reemplazo de proyecciones,
+recarga de escenarios) dejan un ResourceChange METRICS con las series
+afectadas; el delta las lista en "reset_metrics" para que el cliente las
+vuelva a pedir enteras.
+"""
+import datetime
+import functools
+import json
+import uuid
+import zlib
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import (
+    EPICENTER, IncidentSummary, Bridge, Hospital, Shelter, ServiceStatus, MetricPoint, ResourceChange, ChangeCheckpoint,
+)
+from . import serializers, snapshot
+from .timeseries import IsoTimestamp
+
+# clave en el payload -> modelo
+TRACKED = {
+    'summary': IncidentSummary,
+    'bridges': Bridge,
+    'hospitals': Hospital,
+    'shelters': Shelter,
+    'services': ServiceStatus,
+}
+MODEL_KEYS = {model: key for key, model in TRACKED.items()}
+
+# tope de MetricPoint por delta; si se alcanza, "more" indica que hay que
+# volver a pedir con el cursor nuevo
+MAX_DELTA_POINTS = 20000
+
+
+# filas por consulta al leer los valores de objetos cambiados
+READ_CHUNK = 500
+
+
+class CursorError(ValueError):
+    """Cursor mal formado."""
+
+
+def fields(model):
+    """Campos que se guardan con cada cambio: todos salvo el id, el incidente y la celda (se deriva de lat/lng)."""
+    return [f.attname for f in model._meta.concrete_fields if f.attname not in ('id', 'incident_id', 'cell')]
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def values_of(instance):
+    """Valores de los campos de `instance` como se guardan en ResourceChange.data."""
+    return {name: _encode(getattr(instance, name)) for name in fields(type(instance))}
+
+
+def _values(qs):
+    names = fields(qs.model)
+    return {row[0]: dict(zip(names, map(_encode, row[1:]))) for row in qs.values_list('pk', *names)}
+
+
+def read_values(model, ids):
+    """{pk: valores} de las filas `ids` de `model`, leídas de la base."""
+    ids = list(ids)
+    found = {}
+    for start in range(0, len(ids), READ_CHUNK):
+        found.update(_values(model.objects.filter(pk__in=ids[start:start + READ_CHUNK])))
+    return found
+
+
+def record(incident_id, model, ids, deleted=False, origin='', at=None, values=None):
+    """
+    Registra cambios sobre `ids` de `model` en el incidente e invalida el
+    snapshot de su resumen. Lo usan las señales de save/delete y las rutas
+    masivas (bulk_create, update()) que no disparan señales. Los cambios
+    importados de otro nodo pasan su `origin` y, en `at`, {pk: momento del
+    cambio original} (ver sync.py). `values` ({pk: values_of(obj)}) evita
+    releer las filas; sin él se leen de la base, ya modificadas.
+    """
+    key = MODEL_KEYS[model]
+    now = timezone.now()
+    at = at or {}
+    if deleted:
+        values = {}
+    elif values is None:
+        values = read_values(model, ids)
+    created = ResourceChange.objects.bulk_create(
+        ResourceChange(incident_id=incident_id, model=key, object_id=pk, deleted=deleted, origin=origin,
+                       created_at=at.get(pk, now), data=values.get(pk))
+        for pk in ids
+    )
+    # se invalida al confirmar la transacción: si se invalidara antes, otro
+    # request podría reconstruir el snapshot con datos todavía no confirmados
+    transaction.on_commit(functools.partial(snapshot.bump_version, incident_id))
+    _schedule_checkpoints(created)
+
+
+def checkpoint_every():
+    return getattr(settings, 'DASHBOARD_HISTORY_CHECKPOINT_EVERY', 1000)
+
+
+def _schedule_checkpoints(created):
+    every = checkpoint_every()
+    # sin RETURNING (SQLite < 3.35) bulk_create no devuelve ids: quedan los del comando checkpoint_changes
+    if not every or not created or created[-1].pk is None:
+        return
+    first, last = created[0].pk, created[-1].pk
+    if last // every > (first - 1) // every:
+        # los ids cruzaron un múltiplo de `every`: tarea de checkpoint de los
+        # incidentes que cambiaron desde el múltiplo anterior, encolada una vez
+        # confirmado el lote (robust: si falla, el cambio ya está guardado y el
+        # próximo, o el comando checkpoint_changes, lo toma)
+        since = (last // every - 1) * every
+        transaction.on_commit(functools.partial(_submit_checkpoint, since), robust=True)
+
+
+def _submit_checkpoint(since):
+    from . import jobs  # jobs importa projection, que importa scenario y este módulo
+    jobs.submit('checkpoint', {"since": since})
+
+
+def table_state(incident_id, models=None):
+    """
+    {clave: {pk: valores}} del incidente según las tablas. `models` (por
+    defecto TRACKED) permite pasar los modelos históricos de una migración.
+    """
+    state = {}
+    for key, model in (models or TRACKED).items():
+        scope = {'pk': incident_id} if key == 'summary' else {'incident_id': incident_id}
+        state[key] = _values(model.objects.filter(**scope))
+    return state
+
+
+def pack_state(state):
+    rows = {key: [[pk, values] for pk, values in objects.items()] for key, objects in state.items()}
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode())
+
+
+def unpack_state(raw):
+    rows = json.loads(zlib.decompress(raw))
+    return {key: {pk: values for pk, values in objects} for key, objects in rows.items()}
+
+
+def checkpoint(incident_id):
+    """
+    Guarda el estado del incidente hasta su último cambio si hubo cambios desde
+    el checkpoint anterior. Devuelve el ChangeCheckpoint nuevo o None.
+    """
+    # en una transacción: con SQLite (IMMEDIATE) nadie escribe entre la lectura
+    # del último cambio y la de las tablas
+    with transaction.atomic():
+        last = ResourceChange.objects.filter(incident_id=incident_id).aggregate(m=Max('id'))['m']
+        previous = ChangeCheckpoint.objects.filter(incident_id=incident_id).aggregate(m=Max('change_id'))['m']
+        if last is None or (previous is not None and previous >= last):
+            return None
+        return ChangeCheckpoint.objects.create(
+            incident_id=incident_id, change_id=last, state=pack_state(table_state(incident_id)),
+        )
+
+
+def checkpoint_changed(since=0):
+    """Checkpoint de cada incidente con cambios de id mayor a `since`; devuelve cuántos se guardaron."""
+    incident_ids = (
+        ResourceChange.objects.filter(id__gt=since).order_by().values_list('incident_id', flat=True).distinct()
+    )
+    return sum(checkpoint(incident_id) is not None for incident_id in list(incident_ids))
+
+
+def format_cursor(metric_id, change_id):
+    return f'{metric_id}.{change_id}'
+
+
+def parse_cursor(raw):
+    try:
+        metric_id, change_id = (int(part) for part in raw.split('.'))
+    except ValueError:
+        raise CursorError("cursor inválido: se espera '<metric_id>.<change_id>'")
+    if metric_id < 0 or change_id < 0:
+        raise CursorError("cursor inválido: los ids no pueden ser negativos")
+    return metric_id, change_id
+
+
+def current_cursor():
+    metric_id = MetricPoint.objects.aggregate(m=Max('id'))['m'] or 0
+    change_id = ResourceChange.objects.aggregate(m=Max('id'))['m'] or 0
+    return metric_id, change_id
+
+
+def _metric_groups(qs):
+    groups = {}
+    for metric, ts, value in qs.order_by('id').annotate(iso=IsoTimestamp('timestamp')).values_list('metric', 'iso', 'value'):
+        groups.setdefault(metric, []).append({"timestamp": ts, "value": value})
+    return groups
+
+
+def _summary(incident_id):
+    summary = IncidentSummary.objects.filter(pk=incident_id).first()
+    return summary.to_dict() if summary else None
+
+
+def full_state(incident_id, include_metrics=True):
+    """Estado completo del incidente más el cursor desde el cual seguir pidiendo deltas."""
+    # el cursor se lee antes que los datos: un recurso modificado en el medio
+    # vuelve a llegar en el próximo delta (reemplazar por id es idempotente) y
+    # los MetricPoint se limitan al id del cursor para no duplicarse
+    metric_id, change_id = current_cursor()
+    data = {
+        "cursor": format_cursor(metric_id, change_id),
+        "reset": True,
+        "coords": EPICENTER,
+        "summary": _summary(incident_id),
+    }
+    if include_metrics:
+        data["metrics"] = _metric_groups(MetricPoint.objects.filter(incident_id=incident_id, id__lte=metric_id))
+    for key, model in TRACKED.items():
+        if key != 'summary':
+            data[key] = serializers.rows(model.objects.filter(incident_id=incident_id))
+    return data
+
+
+def delta_since(incident_id, metric_id, change_id):
+    """Solo lo agregado o modificado en el incidente después del cursor."""
+    data = {"reset": False}
+
+    points = list(
+        MetricPoint.objects.filter(incident_id=incident_id, id__gt=metric_id).order_by('id')
+        .annotate(iso=IsoTimestamp('timestamp'))
+        .values_list('id', 'metric', 'iso', 'value')[:MAX_DELTA_POINTS]
+    )
+    if len(points) == MAX_DELTA_POINTS:
+        data["more"] = True
+    if points:
+        metric_id = points[-1][0]
+        groups = {}
+        for _, metric, ts, value in points:
+            groups.setdefault(metric, []).append({"timestamp": ts, "value": value})
+        data["metrics"] = groups
+
+    changed = {}
+    resets = []
+    for pk, key, object_id in (
+        ResourceChange.objects.filter(incident_id=incident_id, id__gt=change_id).order_by('id')
+        .values_list('id', 'model', 'object_id')
+    ):
+        if key == ResourceChange.METRICS:
+            resets.append(pk)
+        else:
+            changed.setdefault(key, set()).add(object_id)
+        change_id = pk
+    if resets:
+        # solo se leen los datos cuando hubo borrados: el delta sin novedades sigue en dos consultas
+        reset = set()
+        for names in ResourceChange.objects.filter(pk__in=resets).values_list('data', flat=True):
+            reset.update(names or ())
+        data["reset_metrics"] = sorted(reset)
+
+    deleted = {}
+    for key, ids in changed.items():
+        model = TRACKED[key]
+        if key == 'summary':
+            data["summary"] = _summary(incident_id)
+            continue
+        rows = serializers.rows(model.objects.filter(incident_id=incident_id, pk__in=ids))
+        data[key] = rows
+        missing = sorted(ids - {row["id"] for row in rows})
+        if missing:
+            deleted[key] = missing
+    if deleted:
+        data["deleted"] = deleted
+
+    data["cursor"] = format_cursor(metric_id, change_id)
+    return data
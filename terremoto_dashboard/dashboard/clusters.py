@@ -0,0 +1,333 @@
+"""
+Agrupamiento de recursos en el servidor, por tesela.
+
+Para cada tesela z/x/y el mapa recibe grupos ya agregados (cantidad,
+capacidad, ocupantes y camas sumados, peor estado de puente) en lugar de un
+marcador por recurso; pasado MAX_ZOOM recibe los recursos sueltos.
+
+Cada tesela se divide en GRID x GRID celdas y los recursos de un tipo que caen
+en la misma celda forman un grupo. Las celdas de un zoom son exactamente
+cuatro del siguiente (un quadtree), así que la pirámide se arma desde el nivel
+más fino plegando hacia arriba, como los agregados de rollups.py.
+
+Todo lo que guarda un grupo se puede restar (sumas, cantidad por estado de
+puente, suma de ids: con un solo recurso es su id), así que un cambio leído
+de ResourceChange se aplica quitando el aporte viejo del recurso y sumando el
+nuevo en cada zoom, sin rearmar la pirámide. Las pirámides se guardan por
+proceso y por incidente, como las redes de roads.py.
+
+Además de JSON, las teselas se pueden pedir como Mapbox Vector Tiles
+(?format=mvt), con una capa por tipo de recurso.
+"""
+import math
+import struct
+import threading
+
+from django.db.models import Max
+
+from . import serializers
+from .models import Bridge, Hospital, ResourceChange, Shelter
+
+MAX_ZOOM = 16
+# celdas por lado de tesela: con teselas de 256 px, grupos de 64 px
+GRID = 4
+EXTENT = 4096
+MODELS = {'bridges': Bridge, 'hospitals': Hospital, 'shelters': Shelter}
+# campos que se suman en cada grupo, por tipo
+SUMMED = {
+    'bridges': (),
+    'hospitals': ('total_beds', 'available_beds', 'operational'),
+    'shelters': ('capacity', 'occupants'),
+}
+# de peor a mejor
+BRIDGE_STATUSES = ('derribado', 'parcialmente', 'ok')
+FORMATS = {'json': 'application/json', 'mvt': 'application/vnd.mapbox-vector-tile'}
+
+# posiciones en la lista de un grupo; después vienen los campos de SUMMED
+COUNT, LAT, LNG, IDS, STATUSES = range(5)
+
+
+class ClusterError(ValueError):
+    """Tesela o formato inválidos."""
+
+
+def negotiate(request):
+    """?format=json|mvt, o el Accept; por defecto 'json'."""
+    fmt = request.GET.get('format')
+    if fmt:
+        if fmt not in FORMATS:
+            raise ClusterError(f"format debe ser uno de: {', '.join(FORMATS)}")
+        return fmt
+    return 'mvt' if FORMATS['mvt'] in request.headers.get('Accept', '') else 'json'
+
+
+def _world(lat, lng):
+    """Coordenadas Web Mercator en [0, 1)."""
+    lat = max(min(lat, 85.0511), -85.0511)
+    wx = (lng + 180.0) / 360.0
+    wy = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0
+    return min(max(wx, 0.0), 1.0 - 1e-12), min(max(wy, 0.0), 1.0 - 1e-12)
+
+
+def tile_for(lat, lng, z):
+    """(x, y) de la tesela de zoom z que contiene el punto."""
+    wx, wy = _world(lat, lng)
+    return int(wx * (1 << z)), int(wy * (1 << z))
+
+
+def _finest_cell(lat, lng):
+    n = (1 << MAX_ZOOM) * GRID
+    wx, wy = _world(lat, lng)
+    return int(wx * n), int(wy * n)
+
+
+def _new(kind):
+    return [0, 0.0, 0.0, 0, {}] + [0] * len(SUMMED[kind])
+
+
+def _add(agg, kind, row, sign):
+    agg[COUNT] += sign
+    agg[LAT] += sign * row['lat']
+    agg[LNG] += sign * row['lng']
+    agg[IDS] += sign * row['id']
+    if kind == 'bridges':
+        statuses = agg[STATUSES]
+        statuses[row['status']] = statuses.get(row['status'], 0) + sign
+        if not statuses[row['status']]:
+            del statuses[row['status']]
+    for i, field in enumerate(SUMMED[kind], start=STATUSES + 1):
+        agg[i] += sign * int(row[field])
+
+
+def _merge(into, agg):
+    for i in (COUNT, LAT, LNG, IDS, *range(STATUSES + 1, len(agg))):
+        into[i] += agg[i]
+    for status, n in agg[STATUSES].items():
+        into[STATUSES][status] = into[STATUSES].get(status, 0) + n
+
+
+class Pyramid:
+    """Grupos de todos los zooms de un incidente, y los recursos sueltos por celda del nivel más fino."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.records = {}
+        self.members = {}
+        self.levels = [{} for _ in range(MAX_ZOOM + 1)]
+
+    @classmethod
+    def build(cls, incident_id, cursor):
+        pyramid = cls(cursor)
+        finest = pyramid.levels[MAX_ZOOM]
+        for kind, model in MODELS.items():
+            for row in serializers.rows(model.objects.filter(incident_id=incident_id)):
+                cx, cy = _finest_cell(row['lat'], row['lng'])
+                pyramid.records[kind, row['id']] = (row, cx, cy)
+                pyramid.members.setdefault((kind, cx, cy), set()).add(row['id'])
+                agg = finest.get((kind, cx, cy))
+                if agg is None:
+                    agg = finest[kind, cx, cy] = _new(kind)
+                _add(agg, kind, row, 1)
+        for z in range(MAX_ZOOM - 1, -1, -1):
+            finer, level = pyramid.levels[z + 1], pyramid.levels[z]
+            for (kind, cx, cy), agg in finer.items():
+                into = level.get((kind, cx >> 1, cy >> 1))
+                if into is None:
+                    level[kind, cx >> 1, cy >> 1] = [*agg[:STATUSES], dict(agg[STATUSES]), *agg[STATUSES + 1:]]
+                else:
+                    _merge(into, agg)
+        return pyramid
+
+    def _apply(self, kind, row, cx, cy, sign):
+        for z in range(MAX_ZOOM, -1, -1):
+            shift = MAX_ZOOM - z
+            key = (kind, cx >> shift, cy >> shift)
+            level = self.levels[z]
+            agg = level.get(key)
+            if agg is None:
+                agg = level[key] = _new(kind)
+            _add(agg, kind, row, sign)
+            if not agg[COUNT]:
+                del level[key]
+
+    def remove(self, kind, pk):
+        record = self.records.pop((kind, pk), None)
+        if record is None:
+            return
+        row, cx, cy = record
+        self._apply(kind, row, cx, cy, -1)
+        cell = self.members[kind, cx, cy]
+        cell.discard(pk)
+        if not cell:
+            del self.members[kind, cx, cy]
+
+    def put(self, kind, row):
+        self.remove(kind, row['id'])
+        cx, cy = _finest_cell(row['lat'], row['lng'])
+        self.records[kind, row['id']] = (row, cx, cy)
+        self.members.setdefault((kind, cx, cy), set()).add(row['id'])
+        self._apply(kind, row, cx, cy, 1)
+
+    def _feature(self, kind, agg):
+        count = agg[COUNT]
+        if count == 1:
+            # un solo recurso: la suma de ids es su id
+            return {"type": kind, "count": 1, **self.records[kind, agg[IDS]][0]}
+        feature = {"type": kind, "count": count, "lat": agg[LAT] / count, "lng": agg[LNG] / count}
+        for i, field in enumerate(SUMMED[kind], start=STATUSES + 1):
+            feature[field] = agg[i]
+        if kind == 'bridges':
+            feature['status'] = next(s for s in (*BRIDGE_STATUSES, *agg[STATUSES]) if agg[STATUSES].get(s))
+            feature['statuses'] = dict(agg[STATUSES])
+        return feature
+
+    def tile(self, z, x, y, kinds):
+        """Grupos (o recursos sueltos, pasado MAX_ZOOM) de la tesela, como dicts."""
+        features = []
+        if z <= MAX_ZOOM:
+            level = self.levels[z]
+            for kind in kinds:
+                for cx in range(x * GRID, (x + 1) * GRID):
+                    for cy in range(y * GRID, (y + 1) * GRID):
+                        agg = level.get((kind, cx, cy))
+                        if agg is not None:
+                            features.append(self._feature(kind, agg))
+            return features
+        # pasado MAX_ZOOM la tesela cubre parte de unas pocas celdas del nivel más fino
+        shift = z - MAX_ZOOM
+        n = 1 << z
+        for kind in kinds:
+            for cx in range((x * GRID) >> shift, (((x + 1) * GRID - 1) >> shift) + 1):
+                for cy in range((y * GRID) >> shift, (((y + 1) * GRID - 1) >> shift) + 1):
+                    for pk in self.members.get((kind, cx, cy), ()):
+                        row = self.records[kind, pk][0]
+                        wx, wy = _world(row['lat'], row['lng'])
+                        if int(wx * n) == x and int(wy * n) == y:
+                            features.append({"type": kind, "count": 1, **row})
+        return features
+
+
+# pirámides por proceso: por incidente, la pirámide y el cursor de ResourceChange
+_lock = threading.RLock()
+_state = {}
+
+
+def reset():
+    with _lock:
+        _state.clear()
+
+
+def _sync(incident_id, pyramid):
+    changed = list(
+        ResourceChange.objects.filter(incident_id=incident_id, id__gt=pyramid.cursor, model__in=MODELS)
+        .values_list('id', 'model', 'object_id', 'deleted').order_by('id')
+    )
+    if not changed:
+        return
+    pyramid.cursor = changed[-1][0]
+    # último cambio de cada recurso: los borrados no hace falta releerlos
+    touched = {(kind, pk): deleted for _, kind, pk, deleted in changed}
+    for kind, model in MODELS.items():
+        pks = [pk for (k, pk), deleted in touched.items() if k == kind and not deleted]
+        rows = {row['id']: row for row in serializers.rows(model.objects.filter(pk__in=pks))} if pks else {}
+        for (k, pk), deleted in touched.items():
+            if k != kind:
+                continue
+            if pk in rows:
+                pyramid.put(kind, rows[pk])
+            else:
+                pyramid.remove(kind, pk)
+
+
+def pyramid(incident_id):
+    """Pirámide del incidente, al día con los últimos cambios de recursos."""
+    with _lock:
+        current = _state.get(incident_id)
+        if current is None:
+            # el cursor se toma antes de leer los recursos para no perder cambios
+            cursor = ResourceChange.objects.aggregate(m=Max('id'))['m'] or 0
+            current = _state[incident_id] = Pyramid.build(incident_id, cursor)
+        else:
+            _sync(incident_id, current)
+        return current
+
+
+def tile(incident_id, z, x, y, kinds=tuple(MODELS)):
+    """(features, cursor) de la tesela z/x/y del incidente."""
+    if not (0 <= z <= 30 and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        raise ClusterError("tesela fuera de rango")
+    with _lock:
+        current = pyramid(incident_id)
+        return current.tile(z, x, y, kinds), current.cursor
+
+
+# --- Mapbox Vector Tiles --------------------------------------------------
+# https://github.com/mapbox/vector-tile-spec/tree/master/2.1 (protobuf a mano:
+# solo hacen falta varints, campos de largo variable y valores double/sint)
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number, payload):
+    """Campo de largo variable (wire type 2)."""
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _packed(number, values):
+    return _field(number, b''.join(_varint(v) for v in values))
+
+
+def _value(value):
+    if isinstance(value, bool):
+        return _varint(7 << 3) + _varint(int(value))
+    if isinstance(value, int):
+        return _varint(6 << 3) + _varint(_zigzag(value))
+    if isinstance(value, float):
+        return _varint(3 << 3 | 1) + struct.pack('<d', value)
+    return _field(1, str(value).encode())
+
+
+def encode_mvt(features, z, x, y):
+    """Una capa por tipo de recurso; cada grupo o recurso es un punto con sus campos como atributos."""
+    n = 1 << z
+    layers = {}
+    for feature in features:
+        layers.setdefault(feature['type'], []).append(feature)
+    body = []
+    for name, items in layers.items():
+        keys, values = {}, {}
+        encoded = []
+        for feature in items:
+            tags = []
+            for key, value in feature.items():
+                if key in ('type', 'lat', 'lng', 'statuses') or value is None:
+                    continue
+                tags.append(keys.setdefault(key, len(keys)))
+                tags.append(values.setdefault((type(value), value), len(values)))
+            wx, wy = _world(feature['lat'], feature['lng'])
+            px = int(round((wx * n - x) * EXTENT))
+            py = int(round((wy * n - y) * EXTENT))
+            parts = [_packed(2, tags), _varint(3 << 3) + _varint(1), _packed(4, [9, _zigzag(px), _zigzag(py)])]
+            if feature['count'] == 1:
+                parts.insert(0, _varint(1 << 3) + _varint(feature['id']))
+            encoded.append(_field(2, b''.join(parts)))
+        layer = [_varint(15 << 3) + _varint(2), _field(1, name.encode()), *encoded]
+        layer += [_field(3, key.encode()) for key in keys]
+        layer += [_field(4, _value(value)) for _, value in values]
+        layer.append(_varint(5 << 3) + _varint(EXTENT))
+        body.append(_field(3, b''.join(layer)))
+    return b''.join(body)
@@ -0,0 +1,68 @@
+import asyncio
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+
+from . import incidents
+from .relay import group_name, merge_delta, point_count, relay
+
+
+class IncidentConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Un socket por dashboard suscripto a /ws/incidents/<id>/.
+
+    Los deltas que llegan mientras el cliente todavía no terminó de recibir el
+    anterior se fusionan en uno solo (coalescing). Si lo pendiente supera
+    DASHBOARD_WS_MAX_PENDING_POINTS, se descarta y se manda un "resync" para que
+    el cliente se ponga al día con /api/delta/ (back-pressure).
+    """
+
+    async def connect(self):
+        self.incident_id = int(self.scope['url_route']['kwargs']['incident_id'])
+        self.group = None
+        self.pending = None
+        self.sender = None
+        try:
+            await database_sync_to_async(incidents.resolve)(self.incident_id)
+        except incidents.IncidentNotFound:
+            await self.close()
+            return
+        self.group = group_name(self.incident_id)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+        cursor = await relay.subscribe(self.incident_id)
+        await self.send_json({"type": "hello", "incident": self.incident_id, "cursor": cursor})
+
+    async def disconnect(self, code):
+        if self.group is None:
+            return
+        relay.unsubscribe(self.incident_id)
+        await self.channel_layer.group_discard(self.group, self.channel_name)
+        if self.sender is not None:
+            self.sender.cancel()
+
+    async def receive_json(self, content, **kwargs):
+        # canal solo de salida; se acepta un ping para mantener viva la conexión
+        if content.get("type") == "ping":
+            await self.send_json({"type": "pong"})
+
+    async def incident_delta(self, event):
+        delta = event["delta"]
+        if self.pending is None:
+            self.pending = delta
+        elif self.pending.get("type") == "resync":
+            self.pending["cursor"] = delta["cursor"]
+        else:
+            self.pending = merge_delta(self.pending, delta)
+            limit = getattr(settings, 'DASHBOARD_WS_MAX_PENDING_POINTS', 5000)
+            if point_count(self.pending) > limit:
+                self.pending = {"type": "resync", "cursor": delta["cursor"]}
+        if self.sender is None or self.sender.done():
+            self.sender = asyncio.ensure_future(self._flush())
+
+    async def _flush(self):
+        while self.pending is not None:
+            message, self.pending = self.pending, None
+            message.setdefault("type", "delta")
+            await self.send_json(message)
@@ -0,0 +1,78 @@
+"""
+Estado de un incidente en un momento pasado (?as_of= en /api/summary/ y
+/api/resources/), para la revisión posterior de la respuesta.
+
+Cada ResourceChange guarda los valores de los campos del objeto después del
+cambio y changes.py guarda checkpoints con el estado completo del incidente
+(ver DASHBOARD_HISTORY_CHECKPOINT_EVERY). El estado en T es el del último
+checkpoint tomado hasta T más los cambios con momento <= T, en orden de id,
+hasta el checkpoint siguiente: una consulta lee un checkpoint y a lo sumo los
+cambios entre dos checkpoints, lleve el incidente horas o semanas.
+
+Los cambios importados de otro nodo (sync.py) conservan su momento original;
+uno que llegó tarde se ve desde el último checkpoint tomado antes de su
+llegada. Los incidentes anteriores a este registro tienen historia desde el
+checkpoint que dejó la migración 0010.
+"""
+from .models import ChangeCheckpoint, ResourceChange
+from . import changes, spatial, timeseries
+
+
+class HistoryUnavailable(LookupError):
+    """No hay datos para reconstruir el estado en ese momento."""
+
+
+def parse_as_of(raw):
+    """?as_of=<ISO 8601 | epoch> a datetime (UTC si no trae zona)."""
+    return timeseries.parse_time(raw, 'as_of')
+
+
+def state_as_of(incident_id, at):
+    """{clave: {pk: valores}} del incidente en el momento `at`, como lo guarda changes.table_state()."""
+    base = (
+        ChangeCheckpoint.objects.filter(incident_id=incident_id, taken_at__lte=at)
+        .order_by('-taken_at', '-id').values_list('change_id', 'state').first()
+    )
+    following = (
+        ChangeCheckpoint.objects.filter(incident_id=incident_id, taken_at__gt=at)
+        .order_by('taken_at', 'id').values_list('change_id', flat=True).first()
+    )
+    if base is None:
+        start, state = 0, {key: {} for key in changes.TRACKED}
+    else:
+        start, state = base[0], changes.unpack_state(base[1])
+    replay = ResourceChange.objects.filter(
+        incident_id=incident_id, model__in=list(changes.TRACKED), id__gt=start, created_at__lte=at,
+    )
+    if following is not None:
+        replay = replay.filter(id__lte=following)
+    for key, pk, deleted, data in replay.order_by('id').values_list('model', 'object_id', 'deleted', 'data'):
+        if deleted:
+            state[key].pop(pk, None)
+        elif data is None:
+            # registrado antes de que los cambios guardaran valores
+            raise HistoryUnavailable(f"no hay historia del incidente {incident_id} para {at.isoformat()}")
+        else:
+            state[key][pk] = data
+    return state
+
+
+def _instance(model, pk, values):
+    # sin guardar: solo para to_dict()
+    return model(pk=pk, **{name: model._meta.get_field(name).to_python(value) for name, value in values.items()})
+
+
+def instance(state, key, pk):
+    """El objeto `pk` en el estado, como instancia sin guardar; None si no existía."""
+    values = state[key].get(pk)
+    return None if values is None else _instance(changes.TRACKED[key], pk, values)
+
+
+def rows(state, key):
+    """Los objetos de `key` como las filas de serializers.rows(), ordenados por id."""
+    model = changes.TRACKED[key]
+    return [_instance(model, pk, values).to_dict() for pk, values in sorted(state[key].items())]
+
+
+def rows_in_bbox(state, key, south, west, north, east):
+    return [row for row in rows(state, key) if spatial.contains(south, west, north, east, row['lat'], row['lng'])]
@@ -0,0 +1,87 @@
+"""
+Resolución del incidente de cada request.
+
+Recursos, métricas y cambios pertenecen a un IncidentSummary. Las rutas
+/api/incidents/<id>/... trabajan sobre ese incidente y las rutas sin id
+(/api/summary/, /api/metrics/, ...) sobre el incidente actual, el creado más
+recientemente.
+
+Las dos resoluciones (cuál es el actual, si un id existe) se guardan en el
+cache 'dashboard', compartido entre procesos, y se invalidan por señales al
+crear o borrar un incidente (ver signals.py): en el camino caliente no cuestan
+ninguna consulta. Si el cache quedara apuntando a un incidente que ya no está
+(p. ej. uno creado en una transacción que después se revirtió), get() lo
+detecta al leer la fila y vuelve a resolver.
+"""
+from django.core.cache import caches
+from django.http import Http404
+
+from .models import IncidentSummary
+
+CURRENT_KEY = 'dashboard:incident:current'
+
+
+class IncidentNotFound(ValueError):
+    """No existe un incidente con ese id."""
+
+
+def _cache():
+    return caches['dashboard']
+
+
+def _exists_key(incident_id):
+    return f'dashboard:incident:{incident_id}:exists'
+
+
+def current_id(create=True):
+    """Id del incidente actual; si no hay ninguno se crea (o None con create=False)."""
+    incident_id = _cache().get(CURRENT_KEY)
+    if incident_id is None:
+        # usa el índice de created_at: no depende de cuántos incidentes haya
+        incident_id = IncidentSummary.objects.order_by('-created_at').values_list('id', flat=True).first()
+        if incident_id is None:
+            if not create:
+                return None
+            incident_id = IncidentSummary.objects.create().pk
+        _cache().set_many({CURRENT_KEY: incident_id, _exists_key(incident_id): True}, timeout=None)
+    return incident_id
+
+
+def resolve(incident_id=None):
+    """Id del incidente pedido (el actual si es None). IncidentNotFound si no existe."""
+    if incident_id is None:
+        return current_id()
+    incident_id = int(incident_id)
+    key = _exists_key(incident_id)
+    if not _cache().get(key):
+        if not IncidentSummary.objects.filter(pk=incident_id).exists():
+            raise IncidentNotFound(f"no existe el incidente {incident_id}")
+        _cache().set(key, True, timeout=None)
+    return incident_id
+
+
+def resolve_or_404(incident_id=None):
+    try:
+        return resolve(incident_id)
+    except IncidentNotFound as exc:
+        raise Http404(str(exc))
+
+
+def get(incident_id=None):
+    """El IncidentSummary pedido (el actual si es None), en una consulta."""
+    pk = current_id() if incident_id is None else int(incident_id)
+    incident = IncidentSummary.objects.filter(pk=pk).first()
+    if incident is None:
+        forget(pk)
+        if incident_id is not None:
+            raise IncidentNotFound(f"no existe el incidente {incident_id}")
+        incident = IncidentSummary.objects.get(pk=current_id())
+    return incident
+
+
+def forget(incident_id=None):
+    """Invalida lo cacheado del incidente (y cuál es el actual)."""
+    keys = [CURRENT_KEY]
+    if incident_id is not None:
+        keys.append(_exists_key(incident_id))
+    _cache().delete_many(keys)
@@ -0,0 +1,176 @@
+"""
+Ingesta masiva de MetricPoint desde feeds de campo (sensores, censos).
+
+Formatos aceptados, una fila por línea:
+  - ndjson: {"timestamp": "...", "metric": "...", "value": 1.0, "note": "..."}
+  - csv:    encabezado con timestamp,metric,value[,note]
+
+Los puntos se cargan en un incidente. Las filas se validan a medida que se
+leen y se escriben por lotes, cada uno en su propia transacción. La memoria usada depende del tamaño del lote y no
+del tamaño del archivo.
+"""
+import codecs
+import csv
+import datetime
+import json
+import math
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import rollups
+from .models import MetricPoint
+
+FORMATS = ('ndjson', 'csv')
+# Content-Type aceptado por la API -> formato. Ninguno es un tipo "simple" de CORS:
+# un formulario de otro sitio no puede mandarlos sin preflight
+CONTENT_TYPES = {'application/x-ndjson': 'ndjson', 'text/csv': 'csv'}
+DEFAULT_BATCH_SIZE = 5000
+MAX_ERRORS_PER_BATCH = 10
+METRIC_MAX_LENGTH = MetricPoint._meta.get_field('metric').max_length
+
+
+class RowError(ValueError):
+    """Fila inválida; el mensaje se informa en el resultado del lote."""
+
+
+def _from_epoch(raw, seconds):
+    try:
+        return datetime.datetime.fromtimestamp(seconds, tz=datetime.timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        # nan, inf o fuera del rango de datetime (1e20)
+        raise RowError(f"timestamp inválido: {raw!r}")
+
+
+def parse_timestamp(raw):
+    if isinstance(raw, (int, float)) and not isinstance(raw, bool):
+        return _from_epoch(raw, raw)
+    if not isinstance(raw, str) or not raw:
+        raise RowError("timestamp requerido")
+    try:
+        value = datetime.datetime.fromisoformat(raw)
+    except ValueError:
+        try:
+            seconds = float(raw)
+        except ValueError:
+            raise RowError(f"timestamp inválido: {raw!r}")
+        return _from_epoch(raw, seconds)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def build_point(row):
+    """Valida un dict con timestamp/metric/value/note y devuelve la tupla a insertar."""
+    if not isinstance(row, dict):
+        raise RowError("se esperaba un objeto")
+    metric = row.get('metric')
+    if not isinstance(metric, str) or not metric.strip():
+        raise RowError("metric requerido")
+    metric = metric.strip()
+    if len(metric) > METRIC_MAX_LENGTH:
+        raise RowError(f"metric supera {METRIC_MAX_LENGTH} caracteres")
+    try:
+        value = float(row.get('value'))
+    except (TypeError, ValueError):
+        raise RowError(f"value inválido: {row.get('value')!r}")
+    if not math.isfinite(value):
+        raise RowError("value debe ser finito")
+    note = row.get('note') or ''
+    return (parse_timestamp(row.get('timestamp')), metric, value, str(note))
+
+
+def _ndjson_rows(lines):
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as exc:
+            yield RowError(f"JSON inválido: {exc}")
+
+
+def _csv_rows(lines):
+    reader = csv.DictReader(line for line in lines if line.strip())
+    missing = {'timestamp', 'metric', 'value'} - set(reader.fieldnames or ())
+    if missing:
+        raise RowError(f"faltan columnas en el encabezado: {', '.join(sorted(missing))}")
+    yield from reader
+
+
+def iter_rows(stream, fmt):
+    """Filas crudas de un stream binario (archivo o request), sin leerlo entero."""
+    lines = codecs.iterdecode(stream, 'utf-8')
+    if fmt == 'csv':
+        return _csv_rows(lines)
+    return _ndjson_rows(lines)
+
+
+def _datetime_adapter():
+    if connection.vendor == 'sqlite' and settings.USE_TZ:
+        # mismo texto que guarda el backend de SQLite (UTC sin zona), sin el
+        # costo de adapt_datetimefield_value por fila
+        utc = datetime.timezone.utc
+        return lambda ts: ts.astimezone(utc).replace(tzinfo=None).isoformat(' ')
+    return connection.ops.adapt_datetimefield_value
+
+
+def insert_points(incident_id, points):
+    """
+    Inserta tuplas (timestamp, metric, value, note) del incidente con un único executemany.
+    Equivale a MetricPoint.objects.bulk_create() pero sin instanciar modelos ni
+    compilar un INSERT por lote, que con SQLite es el costo dominante. Los
+    agregados de rollups.py se actualizan en la misma transacción.
+    """
+    if not points:
+        return
+    opts = MetricPoint._meta
+    quote = connection.ops.quote_name
+    columns = ', '.join(
+        quote(opts.get_field(name).column) for name in ('incident', 'timestamp', 'metric', 'value', 'note')
+    )
+    adapt = _datetime_adapter()
+    rows = []
+    last_ts = last_value = None
+    for ts, metric, value, note in points:
+        # las series suelen traer varias métricas con el mismo timestamp seguido
+        if ts is not last_ts:
+            last_ts, last_value = ts, adapt(ts)
+        rows.append((incident_id, last_value, metric, value, note))
+    with transaction.atomic(savepoint=False), connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {quote(opts.db_table)} ({columns}) VALUES (%s, %s, %s, %s, %s)',
+            rows,
+        )
+        rollups.add_points(incident_id, points)
+
+
+def _write_batch(incident_id, number, points, errors, rejected):
+    with transaction.atomic():
+        insert_points(incident_id, points)
+    return {"batch": number, "accepted": len(points), "rejected": rejected, "errors": errors}
+
+
+def ingest(incident_id, stream, fmt='ndjson', batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Lee, valida y guarda en el incidente. Genera un resultado por lote:
+    {"batch": n, "accepted": x, "rejected": y, "errors": [{"row": .., "error": ..}, ...]}
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"formato desconocido: {fmt}")
+    number, points, errors, rejected = 1, [], [], 0
+    for row_number, row in enumerate(iter_rows(stream, fmt), start=1):
+        try:
+            if isinstance(row, RowError):
+                raise row
+            points.append(build_point(row))
+        except RowError as exc:
+            rejected += 1
+            if len(errors) < MAX_ERRORS_PER_BATCH:
+                errors.append({"row": row_number, "error": str(exc)})
+        if len(points) + rejected >= batch_size:
+            yield _write_batch(incident_id, number, points, errors, rejected)
+            number, points, errors, rejected = number + 1, [], [], 0
+    if points or rejected:
+        yield _write_batch(incident_id, number, points, errors, rejected)
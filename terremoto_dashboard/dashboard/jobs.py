@@ -0,0 +1,217 @@
+"""
+Tareas en segundo plano sin broker externo.
+
+Cada tarea es una fila Job; un pool de hilos del propio proceso la ejecuta
+(DASHBOARD_JOB_WORKERS hilos; con 0 se ejecuta en línea, útil en tests y
+comandos). Pedidos idénticos (mismo tipo y parámetros) mientras uno sigue en
+curso devuelven ese mismo Job en lugar de encolar otro.
+
+Las funciones de cada tipo se registran con @register (con un validador
+opcional que normaliza los parámetros al encolar) y reciben (params, report);
+report(fracción) guarda el progreso y lanza Cancelled si alguien pidió
+cancelar, así que la cancelación de una tarea en curso es cooperativa. Las
+tareas encoladas se cancelan de inmediato.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+
+from . import allocation, changes, incidents, projection
+from .models import IncidentSummary, Job
+
+logger = logging.getLogger(__name__)
+
+KINDS = {}
+# cada cuánto (segundos) como mínimo se escribe el progreso
+PROGRESS_INTERVAL = 0.5
+
+
+class JobError(ValueError):
+    """Tipo de tarea desconocido o parámetros inválidos."""
+
+
+class Cancelled(Exception):
+    """La tarea se canceló mientras corría."""
+
+
+def register(kind, validate=None):
+    def decorator(func):
+        KINDS[kind] = (func, validate)
+        return func
+    return decorator
+
+
+def job_key(kind, params):
+    raw = json.dumps([kind, params], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def worker_count():
+    return getattr(settings, 'DASHBOARD_JOB_WORKERS', 2)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=worker_count(), thread_name_prefix='dashboard-job')
+        return _executor
+
+
+def submit(kind, params=None):
+    """Encola una tarea. Devuelve (job, creado); creado=False si se reutilizó una en curso."""
+    if kind not in KINDS:
+        raise JobError(f"tipo de tarea desconocido: {kind}")
+    params = params or {}
+    if not isinstance(params, dict):
+        raise JobError("params debe ser un objeto")
+    validate = KINDS[kind][1]
+    if validate is not None:
+        try:
+            params = validate(params)
+        except (KeyError, TypeError, ValueError) as exc:
+            raise JobError(str(exc))
+    key = job_key(kind, params)
+    try:
+        with transaction.atomic():
+            job = Job.objects.create(kind=kind, params=params, key=key)
+    except IntegrityError:
+        existing = Job.objects.filter(key=key, status__in=Job.ACTIVE).first()
+        if existing is None:
+            # terminó entre el INSERT y esta consulta: se vuelve a intentar una vez
+            return submit(kind, params)
+        return existing, False
+    if worker_count() == 0:
+        execute(job.id)
+        job.refresh_from_db()
+    else:
+        transaction.on_commit(lambda: _pool().submit(_run_in_thread, job.id))
+    return job, True
+
+
+def cancel(job):
+    """Cancela una tarea encolada, o pide cancelar una en curso."""
+    queued = Job.objects.filter(pk=job.pk, status=Job.QUEUED)
+    if not queued.update(status=Job.CANCELLED, finished_at=timezone.now()):
+        Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(cancel_requested=True)
+    job.refresh_from_db()
+    return job
+
+
+def _reporter(job_id):
+    last = [0.0]
+
+    def report(fraction):
+        now = time.monotonic()
+        if now - last[0] < PROGRESS_INTERVAL and fraction < 1:
+            return
+        last[0] = now
+        Job.objects.filter(pk=job_id).update(progress=min(max(fraction, 0.0), 1.0))
+        if Job.objects.filter(pk=job_id, cancel_requested=True).exists():
+            raise Cancelled()
+    return report
+
+
+def execute(job_id):
+    """Corre una tarea encolada en el hilo actual (si nadie la tomó antes)."""
+    if not Job.objects.filter(pk=job_id, status=Job.QUEUED).update(status=Job.RUNNING, started_at=timezone.now()):
+        return
+    job = Job.objects.get(pk=job_id)
+    func = KINDS[job.kind][0]
+    try:
+        result = func(job.params, _reporter(job_id))
+        fields = dict(status=Job.DONE, progress=1.0, result=result)
+    except Cancelled:
+        fields = dict(status=Job.CANCELLED)
+    except Exception as exc:
+        logger.exception("falló la tarea %s", job_id)
+        fields = dict(status=Job.FAILED, error=f"{type(exc).__name__}: {exc}")
+    Job.objects.filter(pk=job_id).update(finished_at=timezone.now(), **fields)
+
+
+def _run_in_thread(job_id):
+    try:
+        execute(job_id)
+    finally:
+        # cada hilo del pool tiene sus propias conexiones
+        connections.close_all()
+
+
+def recover(stale_after):
+    """
+    Marca como fallidas las tareas 'running' que llevan más de `stale_after`
+    (timedelta) sin terminar: su proceso murió y bloquean la deduplicación.
+    """
+    limit = timezone.now() - stale_after
+    return Job.objects.filter(status=Job.RUNNING, started_at__lt=limit).update(
+        status=Job.FAILED, error="interrumpida (proceso finalizado)", finished_at=timezone.now()
+    )
+
+
+def _incident(params):
+    # se resuelve al encolar: la tarea queda atada a ese incidente aunque después se cree otro
+    return incidents.resolve(params.get('incident'))
+
+
+def _simulate_params(params):
+    return {**projection.parse_options(params), "incident": _incident(params)}
+
+
+@register('simulate', validate=_simulate_params)
+def _simulate(params, report):
+    report(0.05)
+    params = dict(params)
+    summary = IncidentSummary.objects.get(pk=params.pop('incident'))
+    result = projection.project(summary, **params)
+    report(0.8)
+    projection.advance(summary, result)
+    return {**summary.to_dict(), "projection": result}
+
+
+def _allocation_params(params):
+    kind = params.get('kind', 'shelters')
+    if kind not in allocation.KINDS:
+        raise allocation.AllocationError(f"kind debe ser uno de: {', '.join(allocation.KINDS)}")
+    if params.get('demand') is not None:
+        allocation.parse_demand(params['demand'])
+    return {
+        "incident": _incident(params),
+        "kind": kind,
+        "demand": params.get('demand'),
+        "k": int(params.get('k', allocation.DEFAULT_K)),
+        "clusters": allocation.check_clusters(int(params.get('clusters', allocation.DEFAULT_CLUSTERS))),
+        "detail": bool(params.get('detail')),
+    }
+
+
+@register('allocation', validate=_allocation_params)
+def _allocation(params, report):
+    demand = allocation.parse_demand(params['demand']) if params['demand'] is not None else None
+    report(0.05)
+    summary = IncidentSummary.objects.get(pk=params['incident']) if demand is None else None
+    return allocation.run(params['incident'], params['kind'], demand, k=params['k'], clusters=params['clusters'],
+                          detail=params['detail'], summary=summary)
+
+
+def _checkpoint_params(params):
+    since = int(params.get('since', 0))
+    if since < 0:
+        raise ValueError("since no puede ser negativo")
+    return {"since": since}
+
+
+@register('checkpoint', validate=_checkpoint_params)
+def _checkpoint(params, report):
+    # la encola changes.record() cada DASHBOARD_HISTORY_CHECKPOINT_EVERY cambios
+    return {"saved": changes.checkpoint_changed(params['since'])}
@@ -0,0 +1,381 @@
+"""
+Carga simulada de dashboards contra un servidor en marcha (comando load_test).
+
+Cada cliente hace lo mismo que dashboard.html en un navegador:
+
+  1. GET de la página (/ o /incidents/<id>/), de donde salen la base de la
+     API del incidente (const API), la capa de teselas y la cookie CSRF;
+  2. delta/?metrics=0 (estado completo), las series en binario hasta el
+     cursor (metrics/?format=binary&delta=1&until_id=...) y las teselas de
+     clusters de un viewport de 1280x720 en zoom 12 sobre el epicentro, a la
+     vez; también las del mapa si son locales (/tiles/...);
+  3. cada `poll` segundos (15, como POLL_MS, con ±20 % de variación),
+     delta/?since=<cursor> hasta que no venga "more": el polling de respaldo
+     de un navegador sin WebSocket;
+  4. cada tanto (en promedio cada `simulate_every` segundos) un POST a
+     simulate/ con el token CSRF, como un operador que pide una proyección.
+
+El cliente HTTP/1.1 es propio, sobre asyncio, sin dependencias: como un
+navegador, hasta MAX_CONNECTIONS conexiones keep-alive por cliente, con
+gzip y cookies.
+
+El perfil es una lista de etapas (clientes, segundos). Los clientes nuevos
+de cada etapa arrancan escalonados a lo largo de un intervalo de polling y
+siguen en las etapas siguientes; si una etapa tiene menos, se cortan los
+últimos. Por etapa y por endpoint se informan requests/s, latencia
+p50/p95/p99 y tasa de error. El codo es la última etapa en la que sumar
+clientes todavía aumentó el throughput al menos KNEE_GAIN sin errores: de ahí
+en más el servidor encola en lugar de atender más.
+"""
+import asyncio
+import gzip
+import json
+import math
+import random
+import re
+import time
+from collections import Counter
+from http.cookies import SimpleCookie
+from urllib.parse import quote, urlencode, urlsplit
+
+MAX_CONNECTIONS = 6
+POLL_SECONDS = 15.0
+SIMULATE_EVERY = 300.0
+TIMEOUT = 30.0
+VIEWPORT = (1280, 720)
+ZOOM = 12
+TILE_SIZE = 256
+CHART_METRICS = ('fatalities', 'injured_severe', 'injured_mild')
+KNEE_GAIN = 0.10
+MAX_ERROR_RATE = 0.01
+
+_API_BASE = re.compile(r"const API = '([^']*)'")
+_TILE_LAYER = re.compile(r'<script id="tile-layer" type="application/json">(.*?)</script>', re.S)
+
+
+class LoadTestError(ValueError):
+    """Perfil o URL mal formados."""
+
+
+def parse_profile(raw):
+    """'10:30,50:30,100:60' -> [(10, 30.0), (50, 30.0), (100, 60.0)] (clientes:segundos)."""
+    stages = []
+    for part in raw.split(','):
+        try:
+            clients, seconds = part.split(':')
+            stage = (int(clients), float(seconds))
+        except ValueError:
+            raise LoadTestError(f"etapa inválida {part!r}: se espera 'clientes:segundos'")
+        if stage[0] < 0 or stage[1] <= 0:
+            raise LoadTestError(f"etapa inválida {part!r}: clientes >= 0 y segundos > 0")
+        stages.append(stage)
+    return stages
+
+
+def viewport_tiles(lat, lng, z=ZOOM, size=VIEWPORT):
+    """(x, y) de las teselas que cubre un mapa de `size` píxeles centrado en el punto."""
+    n = 1 << z
+    cx = (lng + 180.0) / 360.0 * n * TILE_SIZE
+    cy = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n * TILE_SIZE
+
+    def span(center, extent):
+        low, high = (center - extent / 2) // TILE_SIZE, (center + extent / 2) // TILE_SIZE
+        return range(max(int(low), 0), min(int(high), n - 1) + 1)
+
+    return [(x, y) for x in span(cx, size[0]) for y in span(cy, size[1])]
+
+
+class Response:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 300
+
+    def content(self):
+        if self.headers.get('content-encoding') == 'gzip':
+            return gzip.decompress(self.body)
+        return self.body
+
+    def text(self):
+        return self.content().decode()
+
+    def json(self):
+        return json.loads(self.content())
+
+
+async def _read_chunked(reader):
+    parts = []
+    while True:
+        size = int((await reader.readline()).split(b';')[0], 16)
+        if not size:
+            # trailers opcionales hasta la línea vacía
+            while (await reader.readline()).strip():
+                pass
+            return b''.join(parts)
+        parts.append(await reader.readexactly(size))
+        await reader.readexactly(2)
+
+
+async def _read_response(reader):
+    """(Response, cookies nuevas, si la conexión sigue abierta)."""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("el servidor cerró la conexión")
+    status = int(line.split()[1])
+    headers, cookies = {}, SimpleCookie()
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name, value = name.strip().lower(), value.strip()
+        if name == 'set-cookie':
+            cookies.load(value)
+        headers[name] = value
+    keep_alive = headers.get('connection', '').lower() != 'close'
+    if status in (204, 304) or status < 200:
+        body = b''
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = await _read_chunked(reader)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body, keep_alive = await reader.read(), False
+    return Response(status, headers, body), cookies, keep_alive
+
+
+def parse_address(base_url):
+    """'http://host[:puerto]' -> (host, puerto)."""
+    parts = urlsplit(base_url)
+    if parts.scheme != 'http' or not parts.hostname:
+        raise LoadTestError("la URL debe ser http://host[:puerto]")
+    return parts.hostname, parts.port or 80
+
+
+class Browser:
+    """Conexiones y cookies de un cliente; cada request se registra con record(endpoint, ms, estado)."""
+
+    def __init__(self, base_url, record, timeout=TIMEOUT):
+        self.host, self.port = parse_address(base_url)
+        self.record = record
+        self.timeout = timeout
+        self.cookies = {}
+        self._idle = []
+        self._slots = asyncio.Semaphore(MAX_CONNECTIONS)
+
+    async def request(self, endpoint, method, path, headers=None, body=b''):
+        """La respuesta, o None si no llegó (conexión rechazada, cortada o vencida)."""
+        async with self._slots:
+            start = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(self._send(method, path, headers or {}, body), self.timeout)
+            except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError) as exc:
+                self.record(endpoint, (time.perf_counter() - start) * 1000, type(exc).__name__)
+                return None
+            self.record(endpoint, (time.perf_counter() - start) * 1000, response.status)
+            return response
+
+    def _encode(self, method, path, headers, body):
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}', 'Accept-Encoding: gzip',
+                 'User-Agent: terremoto-load-test']
+        if self.cookies:
+            lines.append('Cookie: ' + '; '.join(f'{name}={value}' for name, value in self.cookies.items()))
+        if body or method == 'POST':
+            lines.append(f'Content-Length: {len(body)}')
+        lines.extend(f'{name}: {value}' for name, value in headers.items())
+        return '\r\n'.join(lines).encode('latin-1') + b'\r\n\r\n' + body
+
+    async def _send(self, method, path, headers, body):
+        while True:
+            reused = bool(self._idle)
+            reader, writer = self._idle.pop() if reused else await asyncio.open_connection(self.host, self.port)
+            try:
+                writer.write(self._encode(method, path, headers, body))
+                await writer.drain()
+                response, cookies, keep_alive = await _read_response(reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                # el servidor pudo cerrar una conexión ociosa: se reintenta con una nueva
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                # cortado a mitad de respuesta (timeout o cancelación): la conexión no se reusa
+                writer.close()
+                raise
+            self.cookies.update({name: morsel.value for name, morsel in cookies.items()})
+            if keep_alive:
+                self._idle.append((reader, writer))
+            else:
+                writer.close()
+            return response
+
+    def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+
+
+async def _pause(stop, seconds):
+    """Espera `seconds`; True si mientras tanto se pidió terminar."""
+    try:
+        await asyncio.wait_for(stop.wait(), seconds)
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+
+async def _open_page(browser, page_path):
+    """(html, base de la API, estado completo) o None si algo falló."""
+    page = await browser.request('page', 'GET', page_path, {'Accept': 'text/html'})
+    if page is None or not page.ok:
+        return None
+    html = page.text()
+    api = _API_BASE.search(html)
+    if api is None:
+        return None
+    full = await browser.request('delta', 'GET', api.group(1) + 'delta/?metrics=0')
+    if full is None or not full.ok:
+        return None
+    return html, api.group(1), full.json()
+
+
+async def dashboard_client(browser, page_path, stop, rng, poll=POLL_SECONDS, simulate_every=SIMULATE_EVERY):
+    """Un dashboard abierto: carga inicial y polling hasta `stop` (ver el docstring del módulo)."""
+    opened = await _open_page(browser, page_path)
+    while opened is None:
+        # como quien recarga una página que falló
+        if await _pause(stop, poll):
+            return
+        opened = await _open_page(browser, page_path)
+    html, api, state = opened
+    cursor = state['cursor']
+    tiles = viewport_tiles(state['coords']['lat'], state['coords']['lng'])
+    layer = _TILE_LAYER.search(html)
+    map_url = json.loads(layer.group(1))['url'] if layer else ''
+    series = urlencode({'format': 'binary', 'delta': 1, 'metric': ','.join(CHART_METRICS),
+                        'until_id': cursor.split('.')[0]}, safe=',')
+    await asyncio.gather(
+        browser.request('metrics', 'GET', f'{api}metrics/?{series}'),
+        *(browser.request('clusters', 'GET', f'{api}clusters/{ZOOM}/{x}/{y}/') for x, y in tiles),
+        # teselas del mapa solo si las sirve el mismo servidor: nada de servicios externos
+        *(browser.request('tiles', 'GET', map_url.format(z=ZOOM, x=x, y=y))
+          for x, y in (tiles if map_url.startswith('/') else ())),
+    )
+    next_simulate = time.monotonic() + rng.expovariate(1 / simulate_every) if simulate_every else math.inf
+    while not await _pause(stop, poll * rng.uniform(0.8, 1.2)):
+        more = True
+        while more:
+            delta = await browser.request('delta', 'GET', f'{api}delta/?since={quote(cursor)}')
+            if delta is None or not delta.ok:
+                break
+            data = delta.json()
+            cursor, more = data['cursor'], data.get('more', False)
+        if time.monotonic() >= next_simulate:
+            await browser.request('simulate', 'POST', f'{api}simulate/',
+                                  {'X-CSRFToken': browser.cookies.get('csrftoken', '')})
+            next_simulate = time.monotonic() + rng.expovariate(1 / simulate_every)
+
+
+def _percentile(values, q):
+    return values[min(int(len(values) * q), len(values) - 1)] if values else None
+
+
+def _stats(samples, seconds):
+    latencies = sorted(ms for ms, _ in samples)
+    errors = sum(not isinstance(status, int) or status >= 400 for _, status in samples)
+    return {
+        "requests": len(samples),
+        "rps": round(len(samples) / seconds, 2),
+        "p50_ms": _percentile(latencies, 0.50),
+        "p95_ms": _percentile(latencies, 0.95),
+        "p99_ms": _percentile(latencies, 0.99),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "statuses": dict(Counter(str(status) for _, status in samples)),
+    }
+
+
+def _round(stats):
+    return {key: round(value, 2) if isinstance(value, float) else value for key, value in stats.items()}
+
+
+def knee(stages):
+    """La última etapa donde más clientes todavía dieron KNEE_GAIN más de throughput sin errores."""
+    best = None
+    for stage in stages:
+        total = stage['total']
+        if total['error_rate'] > MAX_ERROR_RATE:
+            break
+        if best is not None and (stage['clients'] <= best['clients']
+                                 or total['rps'] < best['total']['rps'] * (1 + KNEE_GAIN)):
+            break
+        best = stage
+    if best is None:
+        return None
+    return {"clients": best['clients'], "rps": best['total']['rps'], "p95_ms": best['total']['p95_ms'],
+            "saturated": best is not stages[-1]}
+
+
+async def run(base_url, stages, page_path='/', poll=POLL_SECONDS, simulate_every=SIMULATE_EVERY, timeout=TIMEOUT,
+              seed=0, progress=None):
+    """Corre el perfil y devuelve el informe (ver el docstring del módulo)."""
+    samples = []
+    stop = asyncio.Event()
+    rng = random.Random(seed)
+    clients = []
+
+    def record(endpoint, ms, status):
+        samples.append((endpoint, ms, status))
+
+    async def client(browser, delay, seed):
+        try:
+            if not await _pause(stop, delay):
+                await dashboard_client(browser, page_path, stop, random.Random(seed), poll, simulate_every)
+        finally:
+            browser.close()
+
+    parse_address(base_url)
+    report = []
+    try:
+        for count, seconds in stages:
+            while len(clients) > count:
+                clients.pop().cancel()
+            while len(clients) < count:
+                browser = Browser(base_url, record, timeout)
+                clients.append(asyncio.create_task(client(browser, rng.uniform(0, min(poll, seconds)), rng.random())))
+            first = len(samples)
+            await asyncio.sleep(seconds)
+            stage = samples[first:]
+            by_endpoint = {}
+            for endpoint, ms, status in stage:
+                by_endpoint.setdefault(endpoint, []).append((ms, status))
+            result = {
+                "clients": count,
+                "seconds": seconds,
+                "total": _round(_stats([(ms, status) for _, ms, status in stage], seconds)),
+                "endpoints": {name: _round(_stats(rows, seconds)) for name, rows in sorted(by_endpoint.items())},
+            }
+            report.append(result)
+            if progress:
+                progress(result)
+    finally:
+        stop.set()
+        # los clientes terminan en la próxima pausa: se espera lo que está en vuelo
+        # para no dejarle al servidor requests cuya respuesta nadie va a leer
+        if clients:
+            await asyncio.wait(clients, timeout=timeout)
+        for task in clients:
+            task.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+    return {
+        "url": base_url + page_path,
+        "poll_seconds": poll,
+        "simulate_every_seconds": simulate_every,
+        "stages": report,
+        "knee": knee(report),
+    }
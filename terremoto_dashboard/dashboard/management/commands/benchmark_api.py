@@ -0,0 +1,79 @@
+# dashboard/management/commands/benchmark_api.py
+import json
+import platform
+import subprocess
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from dashboard import benchmarks
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide latencia, consultas SQL y tamaño de respuesta de la API a varias escalas. "
+        "Corre contra una base de test descartable, nunca contra la base configurada."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='tiny,small,medium',
+                            help=f"escalas separadas por coma ({', '.join(benchmarks.SCALES)})")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--output', help="archivo JSON de salida (por defecto, stdout)")
+
+    def handle(self, *args, **options):
+        scales = [name.strip() for name in options['scales'].split(',') if name.strip()]
+        unknown = [name for name in scales if name not in benchmarks.SCALES]
+        if unknown:
+            raise CommandError(f"escalas desconocidas: {', '.join(unknown)}")
+
+        setup_test_environment()
+        cache = benchmarks.local_cache()
+        cache.enable()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        # las demás conexiones (la de solo lectura) también usan la base de test
+        mirrors = {alias: connections[alias].settings_dict['NAME'] for alias in connections if alias != DEFAULT_DB_ALIAS}
+        for alias in mirrors:
+            connections[alias].close()
+            connections[alias].creation.set_as_test_mirror(connection.settings_dict)
+        try:
+            runs = []
+            for name in scales:
+                self.stderr.write(f"escala {name}: {benchmarks.SCALES[name]}")
+                run = benchmarks.run_scale(name, benchmarks.SCALES[name], options['repeat'])
+                for result in run['results']:
+                    self.stderr.write(
+                        f"  {result['endpoint']:<15} {result['variant']:<13} p50 {result['p50_ms']:>9.2f} ms"
+                        f"  {result['queries']:>3} consultas  {result['bytes']:>10} bytes"
+                    )
+                runs.append(run)
+        finally:
+            for alias, name in mirrors.items():
+                connections[alias].close()
+                connections[alias].settings_dict['NAME'] = name
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            cache.disable()
+            teardown_test_environment()
+
+        report = {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "runs": runs,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output + '\n')
+        else:
+            self.stdout.write(output)
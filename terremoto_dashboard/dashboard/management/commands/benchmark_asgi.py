@@ -0,0 +1,177 @@
+# dashboard/management/commands/benchmark_asgi.py
+import asyncio
+import io
+import statistics
+import sys
+import threading
+import time
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connections
+from django.test.utils import override_settings
+
+from dashboard import benchmarks, scenario, snapshot
+
+from .stress_database import Command as StressDatabaseCommand
+
+HOST = 'testserver'
+
+# nombre -> (ruta con {id} del incidente, query string, preparar antes de cada request)
+CASES = {
+    'dashboard': ('/incidents/{id}/', '', None),
+    'summary 304': ('/api/incidents/{id}/summary/', '', None),
+    'summary frío': ('/api/incidents/{id}/summary/', '', snapshot.clear_local_snapshot),
+    'metrics points=500': ('/api/incidents/{id}/metrics/', 'points=500', None),
+}
+
+
+def wsgi_request(app, path, query, headers):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': path, 'QUERY_STRING': query,
+        'SERVER_NAME': HOST, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        **{'HTTP_' + name.upper().replace('-', '_'): value for name, value in headers.items()},
+    }
+    status = []
+    result = app(environ, lambda line, headers, exc_info=None: status.append(line))
+    try:
+        for _ in result:
+            pass
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return int(status[0][:3])
+
+
+async def asgi_request(app, path, query, headers):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', HOST.encode())] + [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        'client': ('127.0.0.1', 0), 'server': (HOST, 80),
+    }
+    received, status = [], []
+
+    async def receive():
+        if not received:
+            received.append(True)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # el handler escucha la desconexión hasta que termina la respuesta
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+class Command(StressDatabaseCommand):
+    help = (
+        "Requests por segundo de las vistas servidas por malvinas/asgi.py frente a "
+        "malvinas/wsgi.py con un hilo por cliente, a varias concurrencias, sobre una copia de la base "
+        "con un escenario sintético. Los dos servidores corren en este proceso, sin red."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=3.0, help="duración de cada medición")
+        parser.add_argument('--clients', default='1,16,64', help="concurrencias separadas por coma")
+        parser.add_argument('--scale', default='small', help=f"escala del escenario ({', '.join(benchmarks.SCALES)})")
+        parser.add_argument('--cases', default=','.join(CASES), help="casos separados por coma")
+        parser.add_argument('--baseline', action='store_true',
+                            help="SQLite con la configuración por defecto (sin WAL ni busy timeout)")
+
+    def run_phases(self, options):
+        if options['scale'] not in benchmarks.SCALES:
+            raise CommandError(f"escala desconocida: {options['scale']}")
+        cases = [name.strip() for name in options['cases'].split(',') if name.strip()]
+        unknown = [name for name in cases if name not in CASES]
+        if unknown:
+            raise CommandError(f"casos desconocidos: {', '.join(unknown)}")
+        clients = [int(n) for n in options['clients'].split(',')]
+        from malvinas.asgi import application as asgi_app
+        from malvinas.wsgi import application as wsgi_app
+
+        call_command('migrate', verbosity=0)
+        incident_id = scenario.load(scenario.generate(seed=0, **benchmarks.SCALES[options['scale']]), new=True)['incident']
+        connections.close_all()
+        etag = f'"summary-{incident_id}-{snapshot.get_version(incident_id)}"'
+        self.stderr.write(f"escala {options['scale']}: {benchmarks.SCALES[options['scale']]}")
+        self.stdout.write(f"  {'caso':<20} {'clientes':>8}  {'WSGI req/s':>10} {'p95 ms':>8}  {'ASGI req/s':>10} {'p95 ms':>8}")
+        # los requests lentos por la concurrencia no son noticia acá
+        with override_settings(DASHBOARD_PERF_SLOW_MS=float('inf')):
+            for name in cases:
+                path, query, prepare = CASES[name]
+                headers = {'Accept-Encoding': 'gzip'}
+                if name == 'summary 304':
+                    headers['If-None-Match'] = etag
+                request = (path.format(id=incident_id), query, headers, prepare)
+                for count in clients:
+                    wsgi = self.wsgi_phase(wsgi_app, request, count, options['seconds'])
+                    asgi = asyncio.run(self.asgi_phase(asgi_app, request, count, options['seconds']))
+                    self.stdout.write(
+                        f"  {name:<20} {count:>8}  {wsgi['rps']:>10.1f} {wsgi['p95_ms']:>8.2f}"
+                        f"  {asgi['rps']:>10.1f} {asgi['p95_ms']:>8.2f}"
+                    )
+                    for label, result in (('WSGI', wsgi), ('ASGI', asgi)):
+                        if result['errors']:
+                            self.stderr.write(self.style.WARNING(f"    {label}: {result['errors']}"))
+
+    def wsgi_phase(self, app, request, count, seconds):
+        path, query, headers, prepare = request
+        lock = threading.Lock()
+        latencies, errors = [], set()
+        deadline = time.perf_counter() + seconds
+
+        def client():
+            local = []
+            try:
+                while time.perf_counter() < deadline:
+                    if prepare:
+                        prepare()
+                    begin = time.perf_counter()
+                    status = wsgi_request(app, path, query, headers)
+                    local.append((time.perf_counter() - begin) * 1000)
+                    if status not in (200, 304):
+                        errors.add(status)
+            finally:
+                connections.close_all()
+                with lock:
+                    latencies.extend(local)
+
+        threads = [threading.Thread(target=client) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.result(latencies, errors, seconds)
+
+    async def asgi_phase(self, app, request, count, seconds):
+        path, query, headers, prepare = request
+        latencies, errors = [], set()
+        deadline = time.perf_counter() + seconds
+
+        async def client():
+            while time.perf_counter() < deadline:
+                if prepare:
+                    prepare()
+                begin = time.perf_counter()
+                status = await asgi_request(app, path, query, headers)
+                latencies.append((time.perf_counter() - begin) * 1000)
+                if status not in (200, 304):
+                    errors.add(status)
+
+        await asyncio.gather(*(client() for _ in range(count)))
+        return self.result(latencies, errors, seconds)
+
+    def result(self, latencies, errors, seconds):
+        latencies.sort()
+        return {
+            "rps": len(latencies) / seconds,
+            "p50_ms": statistics.median(latencies) if latencies else 0.0,
+            "p95_ms": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+            "errors": sorted(errors),
+        }
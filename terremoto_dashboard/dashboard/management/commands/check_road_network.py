@@ -0,0 +1,51 @@
+# dashboard/management/commands/check_road_network.py
+import math
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard import incidents, roads
+from dashboard.models import Bridge
+
+
+class Command(BaseCommand):
+    help = (
+        "Carga la red vial (DASHBOARD_ROAD_NETWORK o la ruta indicada), informa su tamaño y qué "
+        "puentes del incidente (por defecto el actual) quedan vinculados, y arma los árboles de "
+        "caminos a sus hospitales y refugios."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help="CSV de tramos; por defecto DASHBOARD_ROAD_NETWORK")
+        parser.add_argument('--incident', type=int, help="id del incidente; por defecto el actual")
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.DASHBOARD_ROAD_NETWORK
+        if not path:
+            raise CommandError("no hay red vial configurada (DASHBOARD_ROAD_NETWORK)")
+        start = time.perf_counter()
+        try:
+            incident_id = incidents.resolve(options['incident'])
+            network = roads.load_network(path, incident_id)
+        except (incidents.IncidentNotFound, roads.NetworkUnavailable) as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(
+            f"{network.node_count} nodos, {network.edge_count} aristas dirigidas, "
+            f"cargada en {time.perf_counter() - start:.2f}s."
+        )
+        known = set(Bridge.objects.filter(incident_id=incident_id).values_list('name', flat=True))
+        linked = sorted(set(network.bridge_edges) & known)
+        missing = sorted(set(network.bridge_edges) - known)
+        self.stdout.write(f"Puentes vinculados: {', '.join(linked) or 'ninguno'}.")
+        if missing:
+            self.stdout.write(self.style.WARNING(f"Puentes del archivo sin Bridge: {', '.join(missing)}."))
+        for kind in roads.TARGETS:
+            start = time.perf_counter()
+            tree = roads.build_tree(network, incident_id, kind)
+            reachable = sum(d < math.inf for d in tree.dist)
+            self.stdout.write(
+                f"Árbol a {kind}: {reachable}/{network.node_count} nodos alcanzables "
+                f"({time.perf_counter() - start:.2f}s)."
+            )
+        self.stdout.write(self.style.SUCCESS("Red vial OK."))
@@ -0,0 +1,23 @@
+# dashboard/management/commands/checkpoint_changes.py
+from django.core.management.base import BaseCommand
+
+from dashboard import changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Guarda un checkpoint del estado de cada incidente con cambios desde su último checkpoint "
+        "(ver dashboard/history.py). Los cambios ya encolan una tarea 'checkpoint' cada "
+        "DASHBOARD_HISTORY_CHECKPOINT_EVERY; esto sirve con ese valor en 0, sin workers de tareas o antes "
+        "de una revisión con ?as_of=."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incident', type=int, help="solo este incidente")
+
+    def handle(self, *args, **options):
+        if options['incident']:
+            saved = int(changes.checkpoint(options['incident']) is not None)
+        else:
+            saved = changes.checkpoint_changed()
+        self.stdout.write(self.style.SUCCESS(f"Checkpoints guardados: {saved}"))
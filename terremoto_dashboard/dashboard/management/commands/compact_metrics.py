@@ -0,0 +1,34 @@
+# dashboard/management/commands/compact_metrics.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from dashboard import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Aplica la retención de DASHBOARD_METRIC_RETENTION: borra los puntos crudos y los agregados "
+        "finos más viejos que su límite. Con --rebuild recalcula antes los agregados desde los crudos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help="recalcular los agregados (p. ej. tras cargar datos con bulk_create)")
+        parser.add_argument('--metric', action='append', default=[], help="limitar --rebuild a esta métrica (repetible)")
+        parser.add_argument('--incident', type=int, help="limitar --rebuild a este incidente")
+        parser.add_argument('--no-compact', action='store_true', help="no borrar nada, solo --rebuild")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            start = time.perf_counter()
+            total = rollups.rebuild(options['metric'] or None, incident_id=options['incident'])
+            self.stdout.write(f"Agregados recalculados desde {total} puntos ({time.perf_counter() - start:.2f}s).")
+        if options['no_compact']:
+            return
+        for level, days in rollups.retention().items():
+            limit = rollups.cutoff(level)
+            self.stdout.write(f"  {level}: {'sin límite' if days is None else f'{days} días (desde {limit:%Y-%m-%d})'}")
+        deleted = rollups.compact()
+        summary = ', '.join(f"{level}={count}" for level, count in deleted.items())
+        self.stdout.write(self.style.SUCCESS(f"Filas borradas: {summary}"))
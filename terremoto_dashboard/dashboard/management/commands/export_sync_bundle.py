@@ -0,0 +1,40 @@
+# dashboard/management/commands/export_sync_bundle.py
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard import changes, incidents, sync
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera un paquete de sincronización con lo nuevo del incidente para otro nodo, firmado con "
+        "la clave compartida con --node. Arranca desde lo que ese nodo confirmó haber importado o, "
+        "con --since, desde el cursor indicado."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="archivo de salida, o '-' para stdout")
+        parser.add_argument('--incident', type=int, help="id del incidente; por defecto el actual")
+        parser.add_argument('--node', required=True, help="nodo destino (ver DASHBOARD_SYNC_KEYS)")
+        parser.add_argument('--since', help="cursor '<metric_id>.<change_id>' desde el cual exportar")
+
+    def handle(self, *args, **options):
+        try:
+            incident_id = incidents.resolve(options['incident'])
+            bundle, info = sync.export(incident_id, peer=options['node'], since=options['since'])
+        except (incidents.IncidentNotFound, changes.CursorError, sync.SyncError) as exc:
+            raise CommandError(str(exc))
+        if options['output'] == '-':
+            sys.stdout.buffer.write(bundle)
+            sys.stdout.buffer.flush()
+            out = self.stderr
+        else:
+            with open(options['output'], 'wb') as fh:
+                fh.write(bundle)
+            out = self.stdout
+        out.write(
+            f"Incidente {incident_id}: {info['resources']} recursos y {info['points']} puntos "
+            f"desde {info['since']}, {info['bytes']:,} bytes."
+        )
+        out.write(self.style.SUCCESS(f"Cursor {info['cursor']} (usalo como --since si el otro nodo no responde)."))
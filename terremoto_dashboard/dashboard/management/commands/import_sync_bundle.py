@@ -0,0 +1,36 @@
+# dashboard/management/commands/import_sync_bundle.py
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard import sync
+
+
+class Command(BaseCommand):
+    help = "Importa un paquete de sincronización de otro nodo (o '-' para stdin), en una transacción."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="paquete a importar, o '-' para leer de stdin")
+        parser.add_argument('--force', action='store_true',
+                            help="aceptar el paquete aunque falte uno anterior del mismo nodo")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            if path == '-':
+                bundle = sys.stdin.buffer.read()
+            else:
+                with open(path, 'rb') as fh:
+                    bundle = fh.read()
+            result = sync.apply(bundle, force=options['force'])
+        except (OSError, sync.SyncError) as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(
+            f"Incidente {result['incident']} desde {result['node']}: "
+            f"resumen {'actualizado' if result['summary'] else 'sin cambios'}."
+        )
+        for key, (created, updated, skipped) in result['resources'].items():
+            self.stdout.write(f"  {key}: {created} creados, {updated} actualizados, {skipped} descartados")
+        points = result['points']
+        self.stdout.write(f"  puntos: {points['added']} agregados, {points['repeated']} repetidos")
+        self.stdout.write(self.style.SUCCESS(f"Importado hasta el cursor {result['cursor']} de {result['node']}."))
@@ -0,0 +1,47 @@
+# dashboard/management/commands/ingest_metrics.py
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard import incidents, ingest
+
+
+class Command(BaseCommand):
+    help = "Carga masiva de MetricPoint desde un archivo NDJSON o CSV (o '-' para stdin)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="archivo a cargar, o '-' para leer de stdin")
+        parser.add_argument('--format', choices=ingest.FORMATS, help="por defecto se deduce de la extensión")
+        parser.add_argument('--batch-size', type=int, default=ingest.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--incident', type=int, help="id del incidente; por defecto el actual")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size debe ser positivo")
+        try:
+            incident_id = incidents.resolve(options['incident'])
+        except incidents.IncidentNotFound as exc:
+            raise CommandError(str(exc))
+        stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        accepted = rejected = 0
+        start = time.perf_counter()
+        try:
+            for result in ingest.ingest(incident_id, stream, fmt, options['batch_size']):
+                accepted += result['accepted']
+                rejected += result['rejected']
+                self.stdout.write(f"lote {result['batch']}: {result['accepted']} aceptados, {result['rejected']} rechazados")
+                for error in result['errors']:
+                    self.stdout.write(self.style.WARNING(f"  fila {error['row']}: {error['error']}"))
+        except (ingest.RowError, UnicodeDecodeError) as exc:
+            raise CommandError(str(exc))
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+        elapsed = time.perf_counter() - start
+        rate = accepted / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{accepted} puntos cargados, {rejected} rechazados en {elapsed:.2f}s ({rate:,.0f} puntos/s)."
+        ))
@@ -0,0 +1,57 @@
+# dashboard/management/commands/load_test.py
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        "Carga de dashboards simulados contra un servidor ya en marcha (runserver, daphne, gunicorn...): "
+        "cada cliente hace lo que dashboard.html (carga inicial, polling del feed de deltas y, cada "
+        "tanto, un POST a simulate/ con CSRF). Por etapa del perfil informa en JSON requests/s, "
+        "p50/p95/p99 y tasa de error por endpoint, y el codo: la concurrencia desde la cual sumar "
+        "clientes ya no aumenta el throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="servidor (http://host:puerto)")
+        parser.add_argument('--incident', type=int, help="abrir /incidents/<id>/ en lugar del incidente actual")
+        parser.add_argument('--profile', default='10:30,20:30,40:30,80:30',
+                            help="etapas 'clientes:segundos' separadas por coma")
+        parser.add_argument('--poll', type=float, default=loadtest.POLL_SECONDS,
+                            help="segundos entre polls de cada cliente (el dashboard usa 15)")
+        parser.add_argument('--simulate-every', type=float, default=loadtest.SIMULATE_EVERY,
+                            help="segundos promedio entre POST a simulate/ por cliente (0: ninguno)")
+        parser.add_argument('--timeout', type=float, default=loadtest.TIMEOUT, help="segundos por request")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="archivo JSON de salida (por defecto, stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            stages = loadtest.parse_profile(options['profile'])
+            loadtest.parse_address(options['url'])
+        except loadtest.LoadTestError as exc:
+            raise CommandError(str(exc))
+        page = f"/incidents/{options['incident']}/" if options['incident'] else '/'
+        report = asyncio.run(loadtest.run(
+            options['url'].rstrip('/'), stages, page_path=page, poll=options['poll'],
+            simulate_every=options['simulate_every'], timeout=options['timeout'], seed=options['seed'],
+            progress=self.progress,
+        ))
+        raw = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(raw + '\n')
+            self.stderr.write(f"Resultados en {options['output']}")
+        else:
+            self.stdout.write(raw)
+
+    def progress(self, stage):
+        total = stage['total']
+        self.stderr.write(
+            f"  {stage['clients']:>5} clientes  {total['rps']:>8.1f} req/s  p95 {total['p95_ms'] or 0:>8.1f} ms"
+            f"  errores {total['error_rate']:.1%}"
+        )
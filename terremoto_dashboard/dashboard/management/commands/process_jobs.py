@@ -0,0 +1,37 @@
+# dashboard/management/commands/process_jobs.py
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+
+from dashboard import jobs
+from dashboard.models import Job
+
+
+class Command(BaseCommand):
+    help = (
+        "Ejecuta en este proceso las tareas encoladas (útil como worker aparte o si el servidor se "
+        "reinició con tareas pendientes) y marca como fallidas las que quedaron colgadas en 'running'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-minutes', type=int, default=30,
+                            help="tareas 'running' con más antigüedad se consideran interrumpidas")
+        parser.add_argument('--loop', action='store_true', help="seguir esperando tareas nuevas")
+        parser.add_argument('--interval', type=float, default=1.0, help="segundos entre revisiones con --loop")
+
+    def handle(self, *args, **options):
+        stale = jobs.recover(datetime.timedelta(minutes=options['stale_minutes']))
+        if stale:
+            self.stdout.write(self.style.WARNING(f"{stale} tareas interrumpidas marcadas como fallidas."))
+        while True:
+            pending = list(Job.objects.filter(status=Job.QUEUED).order_by('id').values_list('id', flat=True))
+            for job_id in pending:
+                start = time.perf_counter()
+                jobs.execute(job_id)
+                job = Job.objects.get(pk=job_id)
+                self.stdout.write(f"#{job.id} {job.kind}: {job.status} ({time.perf_counter() - start:.2f}s)")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS("Sin tareas pendientes."))
@@ -0,0 +1,76 @@
+# dashboard/management/commands/seed_tiles.py
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard import incidents, spatial, tiles
+
+
+class Command(BaseCommand):
+    help = (
+        "Siembra el MBTiles local (DASHBOARD_TILES) con la pirámide de teselas que cubre la zona del "
+        "incidente: sus recursos y el epicentro más un margen, o --bbox. El origen es un servidor de "
+        "teselas (URL con {z}/{x}/{y}) o un MBTiles regional más grande. Las teselas que ya están no se "
+        "vuelven a pedir salvo con --force."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incident', type=int, help="id del incidente; por defecto el actual")
+        parser.add_argument('--bbox', help="'oeste,sur,este,norte' en lugar de la zona del incidente")
+        parser.add_argument('--margin-km', type=float, default=5.0, help="margen alrededor de los recursos (km)")
+        parser.add_argument('--min-zoom', type=int, default=5)
+        parser.add_argument('--max-zoom', type=int, default=14)
+        parser.add_argument('--source', help="URL {z}/{x}/{y} o archivo .mbtiles; por defecto DASHBOARD_TILE_SOURCE")
+        parser.add_argument('--output', help="MBTiles a completar; por defecto DASHBOARD_TILES")
+        parser.add_argument('--force', action='store_true', help="volver a pedir las teselas que ya están")
+        parser.add_argument('--max-tiles', type=int, default=20_000,
+                            help="no sembrar si la pirámide tiene más teselas que esto")
+        parser.add_argument('--delay', type=float, default=0.0,
+                            help="pausa entre descargas (s), para respetar el límite del servidor de origen")
+        parser.add_argument('--attribution', default=tiles.DEFAULT_ATTRIBUTION)
+
+    def handle(self, *args, **options):
+        output = options['output'] or getattr(settings, 'DASHBOARD_TILES', None)
+        spec = options['source'] or getattr(settings, 'DASHBOARD_TILE_SOURCE', None)
+        if not output:
+            raise CommandError("no hay archivo de teselas configurado (DASHBOARD_TILES ni --output)")
+        if not spec:
+            raise CommandError("no hay origen de teselas (DASHBOARD_TILE_SOURCE ni --source)")
+        try:
+            if options['bbox']:
+                bbox = spatial.parse_bbox(options['bbox'])
+            else:
+                bbox = tiles.incident_bbox(incidents.resolve(options['incident']), options['margin_km'])
+            total = tiles.count(bbox, options['min_zoom'], options['max_zoom'])
+            tiles.check_seed_source(spec, options['min_zoom'], options['max_zoom'])
+            fetch = tiles.source_for(spec)
+        except (incidents.IncidentNotFound, spatial.BBoxError, tiles.TileError) as exc:
+            raise CommandError(str(exc))
+        if total > options['max_tiles']:
+            raise CommandError(
+                f"la pirámide tiene {total:,} teselas (más que --max-tiles {options['max_tiles']:,}): "
+                "bajar --max-zoom o subir --max-tiles"
+            )
+        south, west, north, east = bbox
+        self.stdout.write(
+            f"Sembrando {total:,} teselas (z{options['min_zoom']}-{options['max_zoom']}) de "
+            f"{west:.4f},{south:.4f},{east:.4f},{north:.4f} en {output}"
+        )
+        metadata = {'attribution': options['attribution']}
+        if hasattr(fetch, 'metadata'):
+            source = fetch.metadata()
+            metadata.update({key: source[key] for key in ('format', 'attribution') if source.get(key)})
+        start = time.perf_counter()
+        try:
+            stats = tiles.seed(
+                output, fetch, bbox, options['min_zoom'], options['max_zoom'], force=options['force'],
+                delay=options['delay'], metadata=metadata,
+                progress=lambda s: self.stdout.write(f"  {s['added'] + s['kept'] + s['missing']:,}/{total:,}"),
+            )
+        except (OSError, tiles.TilesUnavailable) as exc:
+            raise CommandError(f"falló el origen de teselas: {exc} (lo ya sembrado quedó; volver a correr para seguir)")
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['added']:,} teselas nuevas ({stats['bytes'] / 1e6:.1f} MB), {stats['kept']:,} ya estaban, "
+            f"{stats['missing']:,} sin tesela en el origen ({time.perf_counter() - start:.1f}s)."
+        ))
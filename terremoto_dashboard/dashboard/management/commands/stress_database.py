@@ -0,0 +1,159 @@
+# dashboard/management/commands/stress_database.py
+import datetime
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from dashboard import benchmarks, ingest
+from dashboard.models import IncidentSummary
+
+READ_PATHS = (
+    ('metrics/', {'metric': 'stress_read', 'points': 200}),
+    ('resources/', {'bbox': '-180,-90,180,90'}),
+)
+SEED_POINTS = 20_000
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de concurrencia sobre una copia de la base configurada: mide lecturas de la API "
+        "por segundo sin escritores y con escritores activos. Con --baseline usa la configuración "
+        "de SQLite por defecto (sin WAL, sin busy timeout, lecturas por 'default') para comparar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5.0, help="duración de cada fase")
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--batch', type=int, default=200, help="puntos por transacción de escritura")
+        parser.add_argument('--write-rate', type=float, default=20.0,
+                            help="transacciones por segundo de cada escritor (0: sin pausa). Con un ritmo "
+                                 "fijo la diferencia entre fases es contención en la base y no en el GIL")
+        parser.add_argument('--baseline', action='store_true')
+
+    def handle(self, *args, **options):
+        source = connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+        if connections[DEFAULT_DB_ALIAS].vendor != 'sqlite' or not os.path.exists(source):
+            raise CommandError("stress_database necesita una base SQLite en archivo")
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'stress.sqlite3')
+            src, dst = sqlite3.connect(f'file:{source}?mode=ro', uri=True), sqlite3.connect(path)
+            src.backup(dst)
+            if options['baseline']:
+                dst.execute('PRAGMA journal_mode = DELETE')
+            src.close()
+            dst.close()
+            saved = {alias: dict(connections[alias].settings_dict) for alias in connections}
+            connections.close_all()
+            for alias in connections:
+                connections[alias].settings_dict['NAME'] = path
+                if options['baseline']:
+                    connections[alias].settings_dict['OPTIONS'] = {}
+            setup_test_environment()
+            try:
+                # los ids de incidente de la copia van a un cache propio, no al compartido con el servidor
+                with benchmarks.local_cache(), override_settings(
+                    **({'DASHBOARD_READ_ALIAS': DEFAULT_DB_ALIAS} if options['baseline'] else {})
+                ):
+                    self.run_phases(options)
+            finally:
+                teardown_test_environment()
+                connections.close_all()
+                for alias, settings_dict in saved.items():
+                    connections[alias].settings_dict.update(settings_dict)
+
+    def run_phases(self, options):
+        call_command('migrate', verbosity=0)
+        incident = IncidentSummary.objects.create(name='stress_database')
+        self.api = f'/api/incidents/{incident.pk}/'
+        self.incident_id = incident.pk
+        start = timezone.now() - datetime.timedelta(days=1)
+        ingest.insert_points(incident.pk, [
+            (start + datetime.timedelta(seconds=4 * i), 'stress_read', float(i % 500), '') for i in range(SEED_POINTS)
+        ])
+        connections.close_all()
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal = cursor.fetchone()[0]
+        self.stderr.write(f"journal_mode={journal}  lectores={options['readers']}  escritores={options['writers']}")
+        idle = self.phase(options, writers=0)
+        busy = self.phase(options, writers=options['writers'])
+        for label, result in (('sin escritores', idle), ('con escritores', busy)):
+            self.stdout.write(
+                f"  {label:<15} {result['reads_per_s']:>8.1f} lecturas/s  p50 {result['p50_ms']:>7.2f} ms"
+                f"  p95 {result['p95_ms']:>7.2f} ms  {result['writes_per_s']:>7.1f} escrituras/s"
+                f"  {result['errors']} errores"
+            )
+        ratio = busy['reads_per_s'] / idle['reads_per_s'] if idle['reads_per_s'] else 0
+        self.stdout.write(self.style.SUCCESS(f"Lecturas con escritores: {ratio:.0%} de las lecturas sin escritores."))
+
+    def phase(self, options, writers):
+        stop = threading.Event()
+        lock = threading.Lock()
+        latencies, errors, writes = [], [], [0]
+
+        def reader(number):
+            client, local = Client(), []
+            try:
+                while not stop.is_set():
+                    path, params = READ_PATHS[len(local) % len(READ_PATHS)]
+                    begin = time.perf_counter()
+                    response = client.get(self.api + path, params)
+                    if response.status_code != 200:
+                        with lock:
+                            errors.append(f"{path}: {response.status_code}")
+                    local.append((time.perf_counter() - begin) * 1000)
+            except OperationalError as exc:
+                with lock:
+                    errors.append(str(exc))
+            finally:
+                connections.close_all()
+                with lock:
+                    latencies.extend(local)
+
+        def writer(number):
+            sequence = 0
+            pause = 1 / options['write_rate'] if options['write_rate'] else 0
+            try:
+                while not stop.wait(pause):
+                    now = timezone.now()
+                    points = [(now, f'stress_write_{number}', float(sequence + i), '') for i in range(options['batch'])]
+                    with transaction.atomic():
+                        ingest.insert_points(self.incident_id, points)
+                    sequence += options['batch']
+                    with lock:
+                        writes[0] += 1
+            except OperationalError as exc:
+                with lock:
+                    errors.append(str(exc))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=reader, args=(n,)) for n in range(options['readers'])]
+        threads += [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        for error in sorted(set(errors))[:5]:
+            self.stderr.write(self.style.WARNING(f"  {error}"))
+        latencies.sort()
+        return {
+            "reads_per_s": len(latencies) / options['seconds'],
+            "p50_ms": statistics.median(latencies) if latencies else 0.0,
+            "p95_ms": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+            "writes_per_s": writes[0] / options['seconds'],
+            "errors": len(errors),
+        }
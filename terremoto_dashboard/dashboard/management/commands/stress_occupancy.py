@@ -0,0 +1,174 @@
+# dashboard/management/commands/stress_occupancy.py
+import json
+import random
+import statistics
+import threading
+import time
+
+from django.core.management import call_command
+from django.db import OperationalError, connections
+from django.test import Client
+
+from dashboard import occupancy
+from dashboard.models import Hospital, IncidentSummary, Shelter
+
+from .stress_database import Command as StressDatabaseCommand
+
+CAPACITY = 200
+
+
+class Command(StressDatabaseCommand):
+    help = (
+        "Prueba de concurrencia de los contadores de ocupación sobre una copia de la base: varios clientes "
+        "registran ingresos y egresos a la vez sobre pocos refugios y hospitales y al final cada contador "
+        "se compara con la suma de las operaciones confirmadas (no debe perderse ninguna). Con --compare "
+        "repite la prueba leyendo y guardando la fila entera con save(), como se hacía antes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5.0, help="duración de cada fase")
+        parser.add_argument('--clients', type=int, default=16, help="mesas de ingreso concurrentes")
+        parser.add_argument('--resources', type=int, default=3,
+                            help="refugios y hospitales (de cada uno) sobre los que se concentran los ingresos")
+        parser.add_argument('--batch', type=int, default=1,
+                            help="operaciones por request; más de 1 usa los lotes de /api/occupancy/")
+        parser.add_argument('--compare', action='store_true', help="medir también leer + save()")
+        parser.add_argument('--baseline', action='store_true',
+                            help="SQLite con la configuración por defecto (sin WAL ni busy timeout)")
+
+    def run_phases(self, options):
+        call_command('migrate', verbosity=0)
+        incident = IncidentSummary.objects.create(name='stress_occupancy')
+        self.incident_id = incident.pk
+        self.api = f'/api/incidents/{incident.pk}/'
+        self.targets = [
+            ('shelters', Shelter.objects.create(incident=incident, name=f'Refugio {i}', lat=-35.02, lng=-69.32,
+                                                capacity=CAPACITY).pk)
+            for i in range(options['resources'])
+        ] + [
+            ('hospitals', Hospital.objects.create(incident=incident, name=f'Hospital {i}', lat=-35.03, lng=-69.31,
+                                                  total_beds=CAPACITY).pk)
+            for i in range(options['resources'])
+        ]
+        connections.close_all()
+        self.stderr.write(f"clientes={options['clients']}  recursos={len(self.targets)}  lote={options['batch']}")
+        phases = [('contadores', self.counter_worker)]
+        if options['compare']:
+            phases.append(('leer + save()', self.save_worker))
+        failed = False
+        for label, worker in phases:
+            result = self.phase(options, worker)
+            self.stdout.write(
+                f"  {label:<14} {result['requests_per_s']:>8.1f} requests/s  {result['ops_per_s']:>8.1f} ops/s"
+                f"  p50 {result['p50_ms']:>6.2f} ms  p95 {result['p95_ms']:>6.2f} ms"
+                f"  {result['rejected']} rechazadas  {result['errors']} errores"
+                f"  {result['lost']} actualizaciones perdidas"
+            )
+            failed |= worker == self.counter_worker and (result['lost'] or result['out_of_range'])
+        if failed:
+            self.stdout.write(self.style.ERROR("Los contadores perdieron actualizaciones o salieron de rango."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Contadores: ninguna actualización perdida."))
+
+    def random_ops(self, rng, size):
+        ops = []
+        for _ in range(size):
+            kind, pk = rng.choice(self.targets)
+            action = rng.choice(('checkin', 'checkout') if kind == 'shelters' else ('admit', 'discharge'))
+            ops.append({"action": action, "id": pk, "count": rng.randint(1, 3)})
+        return ops
+
+    def counter_worker(self, number, stop, record, options):
+        client, rng = Client(), random.Random(number)
+        while not stop.is_set():
+            ops = self.random_ops(rng, options['batch'])
+            begin = time.perf_counter()
+            if options['batch'] == 1:
+                op = ops[0]
+                path = f"{'shelters' if op['action'] in ('checkin', 'checkout') else 'hospitals'}/{op['id']}/{op['action']}/"
+                response = client.post(self.api + path, json.dumps({"count": op['count']}),
+                                       content_type='application/json')
+                results = [response.json()] if response.status_code in (200, 409) else []
+            else:
+                response = client.post(self.api + 'occupancy/', json.dumps({"ops": ops}),
+                                       content_type='application/json')
+                results = response.json().get('results', []) if response.status_code == 200 else []
+            record((time.perf_counter() - begin) * 1000, response.status_code, results)
+
+    def save_worker(self, number, stop, record, options):
+        rng = random.Random(number)
+        while not stop.is_set():
+            results = []
+            begin = time.perf_counter()
+            for op in self.random_ops(rng, options['batch']):
+                kind, sign = occupancy.ACTIONS[op['action']]
+                model, field, limit = occupancy.COUNTERS[kind]
+                obj = model.objects.get(pk=op['id'])
+                value = getattr(obj, field) + sign * op['count']
+                ok = 0 <= value <= getattr(obj, limit)
+                if ok:
+                    setattr(obj, field, value)
+                    obj.save(update_fields=[field])
+                results.append({**op, "type": kind, "ok": ok})
+            record((time.perf_counter() - begin) * 1000, 200, results)
+
+    def reset_counters(self):
+        Shelter.objects.filter(incident_id=self.incident_id).update(occupants=CAPACITY // 2)
+        Hospital.objects.filter(incident_id=self.incident_id).update(available_beds=CAPACITY // 2)
+
+    def phase(self, options, worker):
+        self.reset_counters()
+        stop = threading.Event()
+        lock = threading.Lock()
+        latencies, errors = [], []
+        applied = {target: 0 for target in self.targets}
+        counts = {"ops": 0, "rejected": 0}
+
+        def record(ms, status, results):
+            with lock:
+                latencies.append(ms)
+                if status not in (200, 409):
+                    errors.append(status)
+                for result in results:
+                    counts['ops'] += 1
+                    if not result['ok']:
+                        counts['rejected'] += 1
+                        continue
+                    kind, sign = occupancy.ACTIONS[result['action']]
+                    applied[kind, result['id']] += sign * result['count']
+
+        def run(number):
+            try:
+                worker(number, stop, record, options)
+            except OperationalError as exc:
+                with lock:
+                    errors.append(str(exc))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(options['clients'])]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        for error in sorted(set(map(str, errors)))[:5]:
+            self.stderr.write(self.style.WARNING(f"  {error}"))
+        lost = out_of_range = 0
+        for (kind, pk), delta in applied.items():
+            model, field, limit = occupancy.COUNTERS[kind]
+            value, cap = model.objects.filter(pk=pk).values_list(field, limit).get()
+            lost += abs(CAPACITY // 2 + delta - value)
+            out_of_range += not 0 <= value <= cap
+        latencies.sort()
+        return {
+            "requests_per_s": len(latencies) / options['seconds'],
+            "ops_per_s": counts['ops'] / options['seconds'],
+            "p50_ms": statistics.median(latencies) if latencies else 0.0,
+            "p95_ms": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+            "rejected": counts['rejected'],
+            "errors": len(errors),
+            "lost": lost,
+            "out_of_range": out_of_range,
+        }
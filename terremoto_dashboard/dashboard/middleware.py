@@ -0,0 +1,162 @@
+"""
+  - PerfMiddleware: mide cada request (ver dashboard/perf.py) y agrega la
+    cabecera Server-Timing. Va primero en MIDDLEWARE para contar los bytes ya
+    comprimidos y el tiempo de todo el resto de la cadena.
+  - CompressionMiddleware: compresión de respuestas según Accept-Encoding:
+    brotli si el paquete `brotli` está instalado y el cliente lo acepta, si no
+    gzip. Reemplaza a django.middleware.gzip.GZipMiddleware con la misma
+    lógica (ETag débil, Vary, respuestas chicas o ya comprimidas sin tocar) y
+    también comprime las respuestas en streaming. Las imágenes (teselas del
+    mapa) ya vienen comprimidas y se dejan pasar sin intentarlo.
+
+Los dos son solo sync a propósito. Bajo ASGI, Django corre los middlewares
+con process_request/process_response (MiddlewareMixin) pasando a un hilo por
+cada método; con una cadena toda sync pasa una sola vez y vuelve al event
+loop para las vistas asíncronas (ver aio.py): medido con benchmark_asgi, cada
+request cuesta ~1 ms menos. Las respuestas en streaming pueden traer un
+iterador asíncrono: se miden y comprimen igual.
+"""
+import re
+import zlib
+
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+from . import perf
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli es opcional
+    brotli = None
+
+MIN_LENGTH = 200
+BROTLI_QUALITY = 5
+INCOMPRESSIBLE = ('image/png', 'image/jpeg', 'image/webp')
+_accepts = {'br': re.compile(r'\bbr\b'), 'gzip': re.compile(r'\bgzip\b')}
+
+
+def choose_encoding(accept_encoding):
+    if brotli is not None and _accepts['br'].search(accept_encoding):
+        return 'br'
+    if _accepts['gzip'].search(accept_encoding):
+        return 'gzip'
+    return None
+
+
+def _stream_compressor(encoding):
+    """(comprimir bloque, terminar); en gzip cada bloque sale completo (flush), como en compress_sequence de Django."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return (lambda chunk: compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)), compressor.flush
+
+
+def _compressed_sequence(sequence, encoding):
+    compress, finish = _stream_compressor(encoding)
+    for chunk in sequence:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+async def _acompressed_sequence(sequence, encoding):
+    compress, finish = _stream_compressor(encoding)
+    async for chunk in sequence:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+class CompressionMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        return self.compress(request, response)
+
+    def compress(self, request, response):
+        if response.has_header('Content-Encoding') or response.get('Content-Type', '').startswith(INCOMPRESSIBLE):
+            return response
+        if not response.streaming and len(response.content) < MIN_LENGTH:
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+        if response.streaming:
+            compressed = _acompressed_sequence if response.is_async else _compressed_sequence
+            response.streaming_content = compressed(response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            if encoding == 'br':
+                compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+            else:
+                compressed = compress_string(response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            # otra codificación, otro cuerpo: el ETag deja de ser fuerte
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+
+def _measured_stream(stats, content, path, status):
+    # las consultas y la serialización de una respuesta en streaming ocurren
+    # al iterarla, después de que el middleware devolvió la respuesta
+    iterator = iter(content)
+    try:
+        while True:
+            with perf.instrument(stats):
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+            stats.bytes += len(chunk)
+            yield chunk
+    finally:
+        perf.finish(stats, status, path)
+
+
+async def _ameasured_stream(stats, content, path, status):
+    iterator = aiter(content)
+    try:
+        while True:
+            with perf.instrument(stats):
+                try:
+                    chunk = await anext(iterator)
+                except StopAsyncIteration:
+                    break
+            stats.bytes += len(chunk)
+            yield chunk
+    finally:
+        perf.finish(stats, status, path)
+
+
+class PerfMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not perf.enabled():
+            return self.get_response(request)
+        stats = perf.RequestStats(None)
+        with perf.instrument(stats):
+            response = self.get_response(request)
+        match = request.resolver_match
+        stats.view = match.view_name if match else '<sin ruta>'
+        response['Server-Timing'] = perf.server_timing(stats, stats.elapsed_ms())
+        if response.streaming:
+            measured = _ameasured_stream if response.is_async else _measured_stream
+            response.streaming_content = measured(stats, response.streaming_content, request.path, response.status_code)
+        else:
+            stats.bytes = len(response.content)
+            perf.finish(stats, response.status_code, request.path)
+        return response
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0002_bridge_hospital_metricpoint_servicestatus_shelter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='metricpoint',
+            index=models.Index(fields=['metric', 'timestamp'], name='metricpoint_metric_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+from dashboard.spatial import cell_for
+
+
+def fill_cells(apps, schema_editor):
+    for name in ('Bridge', 'Hospital', 'Shelter'):
+        model = apps.get_model('dashboard', name)
+        rows = list(model.objects.only('id', 'lat', 'lng'))
+        for row in rows:
+            row.cell = cell_for(row.lat, row.lng)
+        model.objects.bulk_update(rows, ['cell'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0004_resourcechange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bridge',
+            name='cell',
+            field=models.IntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='hospital',
+            name='cell',
+            field=models.IntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='shelter',
+            name='cell',
+            field=models.IntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(fill_cells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:57
+
+import datetime
+
+from django.db import migrations, models
+
+from dashboard.rollups import aggregate
+
+
+def fill_rollups(apps, schema_editor):
+    MetricPoint = apps.get_model('dashboard', 'MetricPoint')
+    MetricRollup = apps.get_model('dashboard', 'MetricRollup')
+    utc = datetime.timezone.utc
+    for metric in MetricPoint.objects.values_list('metric', flat=True).distinct():
+        points = MetricPoint.objects.filter(metric=metric).values_list('timestamp', 'metric', 'value', 'note')
+        rows = [
+            MetricRollup(metric=metric, resolution=resolution, bucket=datetime.datetime.fromtimestamp(bucket, tz=utc),
+                         count=agg[0], min_value=agg[1], max_value=agg[2], sum_value=agg[3], last_value=agg[4],
+                         first_timestamp=agg[8], last_timestamp=agg[6])
+            for resolution, level in aggregate(points.iterator(chunk_size=5000)).items()
+            for (_, bucket), agg in level.items()
+        ]
+        MetricRollup.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0006_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=80)),
+                ('resolution', models.PositiveIntegerField()),
+                ('bucket', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('min_value', models.FloatField()),
+                ('max_value', models.FloatField()),
+                ('sum_value', models.FloatField()),
+                ('last_value', models.FloatField()),
+                ('first_timestamp', models.DateTimeField()),
+                ('last_timestamp', models.DateTimeField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('metric', 'resolution', 'bucket'), name='metricrollup_bucket_unique')],
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
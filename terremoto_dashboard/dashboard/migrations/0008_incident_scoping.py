@@ -0,0 +1,152 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# modelos que pasan a pertenecer a un incidente
+SCOPED = ('Bridge', 'Hospital', 'Shelter', 'ServiceStatus', 'MetricPoint', 'MetricRollup', 'ResourceChange')
+
+
+def assign_incident(apps, schema_editor):
+    """Los datos existentes eran de un único incidente global: pasan al más reciente."""
+    IncidentSummary = apps.get_model('dashboard', 'IncidentSummary')
+    scoped = [apps.get_model('dashboard', name) for name in SCOPED]
+    if not any(model.objects.exists() for model in scoped):
+        return
+    incident = IncidentSummary.objects.order_by('-created_at').first() or IncidentSummary.objects.create()
+    for model in scoped:
+        model.objects.filter(incident__isnull=True).update(incident=incident)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0007_metricrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='incidentsummary',
+            name='name',
+            field=models.CharField(blank=True, default='', max_length=120),
+        ),
+        migrations.AlterField(
+            model_name='incidentsummary',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='bridge',
+            name='incident',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='dashboard.incidentsummary'),
+        ),
+        migrations.AddField(
+            model_name='hospital',
+            name='incident',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='dashboard.incidentsummary'),
+        ),
+        migrations.AddField(
+            model_name='shelter',
+            name='incident',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='dashboard.incidentsummary'),
+        ),
+        migrations.AddField(
+            model_name='servicestatus',
+            name='incident',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='services', to='dashboard.incidentsummary'),
+        ),
+        migrations.AddField(
+            model_name='metricpoint',
+            name='incident',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='metric_points', to='dashboard.incidentsummary'),
+        ),
+        migrations.AddField(
+            model_name='metricrollup',
+            name='incident',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='metric_rollups', to='dashboard.incidentsummary'),
+        ),
+        migrations.AddField(
+            model_name='resourcechange',
+            name='incident',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='dashboard.incidentsummary'),
+        ),
+        migrations.RunPython(assign_incident, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='bridge',
+            name='incident',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='dashboard.incidentsummary'),
+        ),
+        migrations.AlterField(
+            model_name='hospital',
+            name='incident',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='dashboard.incidentsummary'),
+        ),
+        migrations.AlterField(
+            model_name='shelter',
+            name='incident',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='dashboard.incidentsummary'),
+        ),
+        migrations.AlterField(
+            model_name='servicestatus',
+            name='incident',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='services', to='dashboard.incidentsummary'),
+        ),
+        migrations.AlterField(
+            model_name='metricpoint',
+            name='incident',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metric_points', to='dashboard.incidentsummary'),
+        ),
+        migrations.AlterField(
+            model_name='metricrollup',
+            name='incident',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metric_rollups', to='dashboard.incidentsummary'),
+        ),
+        migrations.AlterField(
+            model_name='resourcechange',
+            name='incident',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='dashboard.incidentsummary'),
+        ),
+        migrations.AlterField(
+            model_name='bridge',
+            name='cell',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='bridge',
+            index=models.Index(fields=['incident', 'cell'], name='bridge_incident_cell_idx'),
+        ),
+        migrations.AlterField(
+            model_name='hospital',
+            name='cell',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='hospital',
+            index=models.Index(fields=['incident', 'cell'], name='hospital_incident_cell_idx'),
+        ),
+        migrations.AlterField(
+            model_name='shelter',
+            name='cell',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='shelter',
+            index=models.Index(fields=['incident', 'cell'], name='shelter_incident_cell_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='metricpoint',
+            name='metricpoint_metric_ts_idx',
+        ),
+        migrations.AddIndex(
+            model_name='metricpoint',
+            index=models.Index(fields=['incident', 'metric', 'timestamp'], name='metricpoint_incident_ts_idx'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='metricrollup',
+            name='metricrollup_bucket_unique',
+        ),
+        migrations.AddConstraint(
+            model_name='metricrollup',
+            constraint=models.UniqueConstraint(fields=('incident', 'metric', 'resolution', 'bucket'), name='metricrollup_bucket_unique'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:05
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+def assign_uids(apps, schema_editor):
+    # un default callable se evalúa una sola vez al agregar la columna: cada
+    # incidente existente necesita su propio uid
+    IncidentSummary = apps.get_model('dashboard', 'IncidentSummary')
+    for incident in IncidentSummary.objects.all():
+        incident.uid = uuid.uuid4()
+        incident.save(update_fields=['uid'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0008_incident_scoping'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='incidentsummary',
+            name='uid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, null=True),
+        ),
+        migrations.RunPython(assign_uids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='incidentsummary',
+            name='uid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AddField(
+            model_name='resourcechange',
+            name='origin',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='resourcechange',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='resourcechange',
+            index=models.Index(fields=['incident', 'model', 'object_id'], name='resourcechange_object_idx'),
+        ),
+        migrations.CreateModel(
+            name='SyncPeer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('node', models.CharField(max_length=64)),
+                ('acked', models.CharField(default='0.0', max_length=40)),
+                ('received', models.CharField(default='0.0', max_length=40)),
+                ('echo', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('incident', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_peers', to='dashboard.incidentsummary')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('node', 'incident'), name='syncpeer_node_incident_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Max
+
+from dashboard.changes import TRACKED, pack_state, table_state
+
+
+def initial_checkpoints(apps, schema_editor):
+    # los cambios ya registrados no tienen valores: la historia de cada
+    # incidente existente arranca con su estado actual
+    IncidentSummary = apps.get_model('dashboard', 'IncidentSummary')
+    ResourceChange = apps.get_model('dashboard', 'ResourceChange')
+    ChangeCheckpoint = apps.get_model('dashboard', 'ChangeCheckpoint')
+    models_by_key = {key: apps.get_model('dashboard', model.__name__) for key, model in TRACKED.items()}
+    for incident_id in IncidentSummary.objects.values_list('pk', flat=True):
+        last = ResourceChange.objects.filter(incident_id=incident_id).aggregate(m=Max('id'))['m'] or 0
+        ChangeCheckpoint.objects.create(
+            incident_id=incident_id, change_id=last, state=pack_state(table_state(incident_id, models_by_key)),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0009_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resourcechange',
+            name='data',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ChangeCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('change_id', models.BigIntegerField()),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('state', models.BinaryField()),
+                ('incident', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='dashboard.incidentsummary')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['incident', 'taken_at'], name='changecheckpoint_taken_idx')],
+            },
+        ),
+        migrations.RunPython(initial_checkpoints, migrations.RunPython.noop),
+    ]
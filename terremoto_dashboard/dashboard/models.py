@@ -1,8 +1,22 @@
+import uuid
+
 from django.db import models
 from django.utils import timezone
 
+from .spatial import cell_for
+
+# epicentro del enunciado (Las Malvinas, San Rafael)
+EPICENTER = {"lat": -35.020694, "lng": -69.323999}
+
 class IncidentSummary(models.Model):
-    created_at = models.DateTimeField(auto_now_add=True)
+    """
+    Un incidente (o ejercicio). Recursos, métricas y cambios cuelgan de él; el
+    incidente "actual" es el creado más recientemente (ver incidents.py).
+    `uid` lo identifica entre nodos que sincronizan (ver sync.py).
+    """
+    uid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    name = models.CharField(max_length=120, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     population = models.IntegerField(default=3500)
     affected_pct_min = models.FloatField(default=0.25)
     affected_pct_max = models.FloatField(default=0.35)
@@ -27,6 +41,7 @@ class IncidentSummary(models.Model):
     def to_dict(self):
         return {
             "id": self.id,
+            "name": self.name,
             "created_at": self.created_at.isoformat(),
             "population": self.population,
             "affected": self.avg_affected(),
@@ -38,7 +53,29 @@ class IncidentSummary(models.Model):
             "injured_mild": self.avg_injured_mild(),
         }
 
-class Bridge(models.Model):
+class GeoResource(models.Model):
+    """Recurso ubicado en el mapa; `cell` es su celda en el índice espacial (ver spatial.py)."""
+    incident = models.ForeignKey(IncidentSummary, on_delete=models.CASCADE, related_name='%(class)ss')
+    cell = models.IntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+        indexes = [
+            # las consultas por viewport siempre van acotadas a un incidente
+            models.Index(fields=['incident', 'cell'], name='%(class)s_incident_cell_idx'),
+        ]
+
+    def update_cell(self):
+        self.cell = cell_for(self.lat, self.lng)
+
+    def save(self, *args, **kwargs):
+        self.update_cell()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ('lat' in update_fields or 'lng' in update_fields):
+            kwargs['update_fields'] = {*update_fields, 'cell'}
+        super().save(*args, **kwargs)
+
+class Bridge(GeoResource):
     name = models.CharField(max_length=120)
     lat = models.FloatField()
     lng = models.FloatField()
@@ -51,7 +88,7 @@ class Bridge(models.Model):
     def __str__(self):
         return f"{self.name} ({self.status})"
 
-class Hospital(models.Model):
+class Hospital(GeoResource):
     name = models.CharField(max_length=120)
     lat = models.FloatField()
     lng = models.FloatField()
@@ -70,7 +107,7 @@ class Hospital(models.Model):
     def __str__(self):
         return f"{self.name} - {self.total_beds} camas"
 
-class Shelter(models.Model):
+class Shelter(GeoResource):
     name = models.CharField(max_length=120)
     lat = models.FloatField()
     lng = models.FloatField()
@@ -88,6 +125,7 @@ class Shelter(models.Model):
         return f"{self.name} ({self.occupants}/{self.capacity})"
 
 class ServiceStatus(models.Model):
+    incident = models.ForeignKey(IncidentSummary, on_delete=models.CASCADE, related_name='services')
     name = models.CharField(max_length=80)  # e.g., Electricity, Water, Communications
     status = models.CharField(max_length=80) # e.g., 'Corte total', 'Parcial', 'Operativo'
     note = models.TextField(blank=True)
@@ -101,10 +139,165 @@ class MetricPoint(models.Model):
     Serie temporal simple para métricas en horas desde el evento:
     tipo: 'fatalities','injured_mild','hospital_capacity', etc.
     """
+    incident = models.ForeignKey(IncidentSummary, on_delete=models.CASCADE, related_name='metric_points')
     timestamp = models.DateTimeField(default=timezone.now)
     metric = models.CharField(max_length=80)
     value = models.FloatField()
     note = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            # el índice de la FK (incident, id) sirve al feed de deltas
+            models.Index(fields=['incident', 'metric', 'timestamp'], name='metricpoint_incident_ts_idx'),
+        ]
+
     def to_dict(self):
         return {"id": self.id, "timestamp": self.timestamp.isoformat(), "metric": self.metric, "value": self.value, "note": self.note}
+
+class MetricRollup(models.Model):
+    """
+    Agregado de MetricPoint por métrica y cubeta de tiempo (ver rollups.py).
+    `resolution` es el ancho de la cubeta en segundos (60, 3600 u 86400).
+    """
+    incident = models.ForeignKey(IncidentSummary, on_delete=models.CASCADE, related_name='metric_rollups')
+    metric = models.CharField(max_length=80)
+    resolution = models.PositiveIntegerField()
+    bucket = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+    min_value = models.FloatField()
+    max_value = models.FloatField()
+    sum_value = models.FloatField()
+    last_value = models.FloatField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['incident', 'metric', 'resolution', 'bucket'],
+                                    name='metricrollup_bucket_unique'),
+        ]
+
+    def to_dict(self):
+        return {
+            "metric": self.metric, "resolution": self.resolution, "bucket": self.bucket.isoformat(),
+            "count": self.count, "min": self.min_value, "max": self.max_value,
+            "avg": self.sum_value / self.count if self.count else None, "last": self.last_value,
+        }
+
+class ResourceChange(models.Model):
+    """
+    Registro de cambios sobre el resumen y los recursos. El id funciona como
+    número de secuencia para el feed incremental (/api/delta/), común a todos
+    los incidentes; cada feed filtra por el suyo. Los cambios importados de
+    otro nodo conservan su `origin` y su momento original (ver sync.py).
+    `data` son los valores de los campos del objeto después del cambio (None
+    en las bajas); con ellos se reconstruyen estados pasados (ver history.py).
+    Las filas de model METRICS avisan que se borraron MetricPoint del
+    incidente; `data` es la lista de series afectadas (ver rollups.py).
+    """
+    METRICS = 'metrics'
+
+    incident = models.ForeignKey(IncidentSummary, on_delete=models.CASCADE, related_name='changes')
+    model = models.CharField(max_length=20)  # 'summary', 'bridges', 'hospitals', 'shelters', 'services', METRICS
+    object_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    data = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    origin = models.CharField(max_length=64, blank=True, default='')  # '' = este nodo
+
+    class Meta:
+        indexes = [
+            # última versión de cada objeto (sync.py)
+            models.Index(fields=['incident', 'model', 'object_id'], name='resourcechange_object_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.model}:{self.object_id}{' (borrado)' if self.deleted else ''}"
+
+class ChangeCheckpoint(models.Model):
+    """
+    Estado completo de un incidente (resumen y recursos) hasta el cambio
+    `change_id` inclusive, como JSON comprimido con zlib (ver changes.py). Las
+    consultas ?as_of= parten del último tomado antes del momento pedido.
+    """
+    incident = models.ForeignKey(IncidentSummary, on_delete=models.CASCADE, related_name='checkpoints')
+    change_id = models.BigIntegerField()
+    taken_at = models.DateTimeField(default=timezone.now)
+    state = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['incident', 'taken_at'], name='changecheckpoint_taken_idx'),
+        ]
+
+    def __str__(self):
+        return f"incidente {self.incident_id} hasta #{self.change_id}"
+
+class Job(models.Model):
+    """
+    Tarea en segundo plano (ver jobs.py). `key` identifica pedidos idénticos:
+    mientras uno está en curso no se encola otro igual.
+    """
+    QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+    STATUS_CHOICES = [(s, s) for s in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)]
+    ACTIVE = (QUEUED, RUNNING)
+
+    kind = models.CharField(max_length=40)
+    params = models.JSONField(default=dict)
+    key = models.CharField(max_length=64)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    progress = models.FloatField(default=0.0)
+    cancel_requested = models.BooleanField(default=False)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # un solo pedido en curso por clave: la deduplicación no depende de carreras
+            models.UniqueConstraint(fields=['key'], condition=models.Q(status__in=('queued', 'running')),
+                                    name='job_active_key_unique'),
+        ]
+
+    def to_dict(self, include_result=True):
+        data = {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": round(self.progress, 3),
+            "params": self.params,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "error": self.error,
+        }
+        if include_result:
+            data["result"] = self.result
+        return data
+
+    def __str__(self):
+        return f"#{self.id} {self.kind} ({self.status})"
+
+class SyncPeer(models.Model):
+    """
+    Estado de la sincronización con otro nodo para un incidente (ver sync.py).
+    `acked` es nuestro cursor que el otro nodo confirmó haber importado,
+    `received` el suyo hasta el que importamos y `echo` los rangos de id de
+    MetricPoint que vinieron de él, para no devolvérselos.
+    """
+    node = models.CharField(max_length=64)
+    incident = models.ForeignKey(IncidentSummary, on_delete=models.CASCADE, related_name='sync_peers')
+    acked = models.CharField(max_length=40, default='0.0')
+    received = models.CharField(max_length=40, default='0.0')
+    echo = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['node', 'incident'], name='syncpeer_node_incident_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.node} / incidente {self.incident_id}"
@@ -0,0 +1,91 @@
+"""
+Núcleo numérico de las proyecciones Monte Carlo (ver projection.py).
+
+Solo depende de NumPy para que los procesos hijos del pool puedan importarlo
+sin inicializar Django. Los hijos arrancan con 'forkserver' y no con fork: el
+pool se crea desde procesos con varios hilos (servidor, tareas en segundo
+plano) y un fork heredaría locks tomados por otros hilos.
+
+Cada métrica se describe con (inicio, final_min, final_max): en cada escenario
+el valor final a `hours` horas se sortea uniforme en [final_min, final_max] y
+la trayectoria va del inicio al final con una curva de saturación
+1 - exp(-t/tau), con tau sorteado por escenario y compartido entre métricas
+(un incidente que evoluciona rápido lo hace en todas a la vez). Si el inicio
+es None se toma START_FRACTION del final sorteado.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+PERCENTILES = (10, 50, 90)
+# constante de tiempo de la evolución del incidente, en horas
+TAU_HOURS = (12.0, 36.0)
+START_FRACTION = 0.6
+# por encima de esta cantidad de escenarios se trabaja por bloques y los
+# percentiles salen de combinar resúmenes por cuantiles de cada bloque
+CHUNK_SCENARIOS = 100_000
+QUANTILE_GRID = np.linspace(0.0, 1.0, 401)
+
+
+def simulate(params, scenarios, hours, seed):
+    """Trayectorias {métrica: array (hours + 1, scenarios)}, una fila por hora."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(hours + 1, dtype=float)[:, None]
+    tau = rng.uniform(*TAU_HOURS, size=scenarios)
+    shape = (1 - np.exp(-t / tau)) / (1 - np.exp(-max(hours, 1) / tau))
+    paths = {}
+    for metric, (start, low, high) in params.items():
+        final = rng.uniform(low, high, size=scenarios)
+        begin = final * START_FRACTION if start is None else start
+        paths[metric] = begin + (final - begin) * shape
+    return paths
+
+
+def _quantiles(paths, q):
+    """
+    Cuantiles `q` (0..1) por fila, con interpolación lineal como np.quantile.
+    Ordenar cada fila (contigua) y elegir posiciones es más rápido que
+    np.percentile sobre el eje de escenarios.
+    """
+    paths.sort(axis=1)
+    position = np.asarray(q) * (paths.shape[1] - 1)
+    low = np.floor(position).astype(np.intp)
+    high = np.minimum(low + 1, paths.shape[1] - 1)
+    weight = position - low
+    return (paths[:, low] * (1 - weight) + paths[:, high] * weight).T
+
+
+def quantile_sketch(params, scenarios, hours, seed):
+    """Resumen de un bloque: cuantiles QUANTILE_GRID por métrica, forma (len(grid), hours + 1)."""
+    return {
+        metric: _quantiles(path, QUANTILE_GRID)
+        for metric, path in simulate(params, scenarios, hours, seed).items()
+    }
+
+
+def bands(params, scenarios, hours, seed=None, workers=1):
+    """
+    Percentiles PERCENTILES por métrica y hora: {métrica: array (3, hours + 1)}.
+    Hasta CHUNK_SCENARIOS escenarios el cálculo es exacto y en este proceso;
+    por encima se reparte en bloques (en un pool de `workers` procesos si
+    workers > 1) y los percentiles se calculan sobre los cuantiles combinados.
+    """
+    q = np.asarray(PERCENTILES) / 100
+    if scenarios <= CHUNK_SCENARIOS:
+        paths = simulate(params, scenarios, hours, seed)
+        return {metric: _quantiles(path, q) for metric, path in paths.items()}
+    chunks = -(-scenarios // CHUNK_SCENARIOS)
+    sizes = [len(part) for part in np.array_split(np.arange(scenarios), chunks)]
+    seeds = np.random.SeedSequence(seed).spawn(chunks)
+    args = ([params] * chunks, sizes, [hours] * chunks, seeds)
+    if workers > 1:
+        context = multiprocessing.get_context('forkserver')
+        with ProcessPoolExecutor(max_workers=min(workers, chunks), mp_context=context) as pool:
+            sketches = list(pool.map(quantile_sketch, *args))
+    else:
+        sketches = list(map(quantile_sketch, *args))
+    return {
+        metric: _quantiles(np.concatenate([sketch[metric] for sketch in sketches]).T.copy(), q)
+        for metric in params
+    }
@@ -0,0 +1,142 @@
+"""
+Ingresos y egresos en refugios y hospitales, como contadores atómicos.
+
+Cada operación es un único UPDATE condicional (el equivalente de
+filter(<valor> + delta entre 0 y el tope).update(<valor>=F(<valor>) + delta)):
+la base suma el delta solo si el resultado queda entre 0 y la capacidad y
+devuelve el valor nuevo con RETURNING, sin leer la fila antes. Varias mesas de
+ingreso que registran a la vez no se pisan: la base serializa los UPDATE y
+cada uno parte del valor que dejó el anterior. Solo cuando una operación se
+rechaza se lee la fila, para informar el valor actual.
+
+Los UPDATE no pasan por save(): cada lote registra sus cambios en el feed
+(changes.record) dentro de la misma transacción.
+"""
+from django.db import connection, transaction
+from django.db.models import F
+
+from . import changes
+from .models import Hospital, Shelter
+
+# tipo -> (modelo, contador, tope)
+COUNTERS = {
+    'shelters': (Shelter, 'occupants', 'capacity'),
+    'hospitals': (Hospital, 'available_beds', 'total_beds'),
+}
+# acción -> (tipo, signo): un ingreso al hospital ocupa una cama libre
+ACTIONS = {
+    'checkin': ('shelters', 1),
+    'checkout': ('shelters', -1),
+    'admit': ('hospitals', -1),
+    'discharge': ('hospitals', 1),
+}
+MAX_COUNT = 10_000
+MAX_BATCH = 1000
+
+
+class OccupancyError(ValueError):
+    """Operación mal formada."""
+
+
+class BatchRejected(Exception):
+    """Un lote atómico con alguna operación rechazada: no se aplicó nada."""
+
+    def __init__(self, results):
+        super().__init__("lote rechazado")
+        self.results = results
+
+
+def parse_op(raw, action=None, pk=None):
+    """(acción, id, cantidad) desde un dict {"action", "id", "count"}; action/pk de la URL tienen prioridad."""
+    if not isinstance(raw, dict):
+        raise OccupancyError("cada operación debe ser un objeto JSON")
+    action = action or raw.get('action')
+    if action not in ACTIONS:
+        raise OccupancyError(f"action debe ser uno de: {', '.join(ACTIONS)}")
+    count = raw.get('count', 1)
+    try:
+        pk = int(pk if pk is not None else raw.get('id'))
+    except (TypeError, ValueError):
+        raise OccupancyError("id debe ser un entero")
+    if isinstance(count, bool) or not isinstance(count, int) or not 1 <= count <= MAX_COUNT:
+        raise OccupancyError(f"count debe ser un entero entre 1 y {MAX_COUNT}")
+    return action, pk, count
+
+
+def parse_batch(body):
+    if not isinstance(body, dict) or not isinstance(body.get('ops'), list):
+        raise OccupancyError('se espera {"ops": [{"action", "id", "count"}, ...]}')
+    if not 1 <= len(body['ops']) <= MAX_BATCH:
+        raise OccupancyError(f"un lote lleva entre 1 y {MAX_BATCH} operaciones")
+    return [parse_op(op) for op in body['ops']]
+
+
+def _update_sql(kind):
+    model, field, limit = COUNTERS[kind]
+    quote = connection.ops.quote_name
+    table, value, cap = quote(model._meta.db_table), quote(field), quote(limit)
+    return (
+        f"UPDATE {table} SET {value} = {value} + %s "
+        f"WHERE {quote('id')} = %s AND {quote('incident_id')} = %s AND {value} + %s BETWEEN 0 AND {cap} "
+        f"RETURNING {value}, {cap}"
+    )
+
+
+def _returning():
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)
+
+
+def _adjust(cursor, incident_id, kind, pk, delta):
+    """(nuevo valor, tope) o None si el resultado quedaría fuera de [0, tope] o el recurso no existe."""
+    if _returning():
+        cursor.execute(_update_sql(kind), [delta, pk, incident_id, delta])
+        return cursor.fetchone()
+    # sin RETURNING: el mismo UPDATE condicional y la lectura en la misma transacción
+    model, field, limit = COUNTERS[kind]
+    updated = model.objects.filter(
+        pk=pk, incident_id=incident_id, **{f'{field}__gte': -delta, f'{field}__lte': F(limit) - delta},
+    ).update(**{field: F(field) + delta})
+    if not updated:
+        return None
+    return model.objects.filter(pk=pk).values_list(field, limit).get()
+
+
+def _result(action, pk, count, kind, row, ok):
+    _, field, limit = COUNTERS[kind]
+    result = {"action": action, "type": kind, "id": pk, "count": count, "ok": ok}
+    if row is not None:
+        result.update({field: row[0], limit: row[1]})
+    return result
+
+
+def apply(incident_id, ops, atomic=False):
+    """
+    Aplica [(acción, id, cantidad), ...] en una transacción. Cada resultado
+    lleva "ok" y el valor del contador (el nuevo, o el actual si se rechazó).
+    Con atomic=True, si alguna operación se rechaza no se aplica ninguna
+    (BatchRejected con los resultados hasta esa).
+    """
+    results = []
+    touched = {kind: set() for kind in COUNTERS}
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for action, pk, count in ops:
+                kind, sign = ACTIONS[action]
+                row = _adjust(cursor, incident_id, kind, pk, sign * count)
+                if row is not None:
+                    touched[kind].add(pk)
+                    results.append(_result(action, pk, count, kind, row, True))
+                    continue
+                model, field, limit = COUNTERS[kind]
+                current = model.objects.filter(pk=pk, incident_id=incident_id).values_list(field, limit).first()
+                result = _result(action, pk, count, kind, current, False)
+                result['error'] = "no existe" if current is None else "fuera de capacidad"
+                results.append(result)
+                if atomic:
+                    raise BatchRejected(results)
+        for kind, pks in touched.items():
+            if pks:
+                changes.record(incident_id, COUNTERS[kind][0], sorted(pks))
+    return results
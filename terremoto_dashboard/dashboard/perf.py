@@ -0,0 +1,292 @@
+"""
+Instrumentación de requests: tiempo total, consultas y tiempo de base de
+datos, tiempo de serialización y bytes de respuesta, por vista.
+
+PerfMiddleware (ver middleware.py) mide cada request, agrega la cabecera
+Server-Timing y suma los valores a histogramas del proceso; /api/_perf los
+devuelve con p50/p95/p99 (o en texto de Prometheus con ?format=prometheus).
+Los requests más lentos que DASHBOARD_PERF_SLOW_MS se registran en el logger
+'dashboard.perf' con sus consultas más lentas.
+
+Cada conexión lleva un execute_wrapper fijo (instalado al conectarse, ver
+signals.py) que atribuye la consulta al request activo en una contextvar: la
+contextvar viaja con sync_to_async, así que también cuentan las consultas que
+corren en otros hilos (las que una vista asíncrona reparte en el pool, los
+bloques de un streaming, ver aio.py).
+
+Costo por request: una contextvar por consulta (y dos perf_counter() si hay un
+request medido) y una actualización de histogramas con cubetas fijas bajo un lock.
+"""
+import bisect
+import collections
+import contextlib
+import contextvars
+import heapq
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+# consultas más lentas que se guardan por request para el log de lentos
+SLOWEST_SQL = 5
+RECENT_SLOW = 20
+
+_current = contextvars.ContextVar('dashboard_perf_stats', default=None)
+
+
+def enabled():
+    return getattr(settings, 'DASHBOARD_PERF', True)
+
+
+def slow_ms():
+    return getattr(settings, 'DASHBOARD_PERF_SLOW_MS', 500)
+
+
+class Histogram:
+    """
+    Histograma de cubetas con crecimiento geométrico (cada límite es
+    `growth` veces el anterior): el error relativo de un cuantil es a lo sumo
+    growth - 1, con memoria y costo por valor constantes.
+    """
+
+    def __init__(self, lowest, growth=1.2, size=100):
+        self.bounds = [lowest * growth ** i for i in range(size)]
+        self.counts = [0] * (size + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = math.ceil(q * self.count)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                # límite superior de la cubeta, sin pasarse del máximo observado
+                return min(self.bounds[index] if index < len(self.bounds) else self.max, self.max)
+        return self.max
+
+    def summary(self, digits=3):
+        data = {"count": self.count, "mean": round(self.total / self.count, digits) if self.count else 0.0}
+        for q in QUANTILES:
+            data[f"p{int(q * 100)}"] = round(self.quantile(q), digits)
+        data["max"] = round(self.max, digits)
+        return data
+
+
+class RequestStats:
+    # outer: la medición que estaba activa al entrar (p. ej. la de benchmarks.measure
+    # alrededor del request), que también suma las consultas
+    __slots__ = ('view', 'start', 'queries', 'db_ms', 'spans', 'active', 'sql', 'bytes', 'outer', 'lock')
+
+    def __init__(self, view):
+        self.view = view
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_ms = 0.0
+        self.spans = {}
+        self.active = set()
+        self.sql = []  # heap de mínimos: las SLOWEST_SQL más lentas hasta ahora
+        self.bytes = 0
+        self.outer = None
+        # las consultas de una vista asíncrona corren a la vez en varios hilos
+        self.lock = threading.Lock()
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def add_query(self, elapsed, alias, sql):
+        with self.lock:
+            self.queries += 1
+            self.db_ms += elapsed
+            if len(self.sql) < SLOWEST_SQL:
+                heapq.heappush(self.sql, (elapsed, alias, sql))
+            elif elapsed > self.sql[0][0]:
+                heapq.heapreplace(self.sql, (elapsed, alias, sql))
+
+    def __call__(self, execute, sql, params, many, context):
+        # con la firma de un execute_wrapper de Django: mide la consulta
+        begin = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - begin) * 1000
+            stats = self
+            while stats is not None:
+                stats.add_query(elapsed, context['connection'].alias, sql)
+                stats = stats.outer
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.slow = collections.deque(maxlen=RECENT_SLOW)
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+            self.slow.clear()
+
+    def record(self, stats, total_ms, status):
+        with self.lock:
+            view = self.views.get(stats.view)
+            if view is None:
+                view = self.views[stats.view] = {
+                    "wall_ms": Histogram(0.05),
+                    "db_ms": Histogram(0.01),
+                    "serialize_ms": Histogram(0.01),
+                    "queries": Histogram(1, growth=1.5, size=30),
+                    "bytes": Histogram(64, growth=1.5, size=50),
+                    "errors": 0,
+                }
+            view["wall_ms"].add(total_ms)
+            view["db_ms"].add(stats.db_ms)
+            view["serialize_ms"].add(stats.spans.get('serialize', 0.0))
+            view["queries"].add(stats.queries)
+            view["bytes"].add(stats.bytes)
+            if status >= 500:
+                view["errors"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: {
+                    "errors": data["errors"],
+                    **{key: hist.summary() for key, hist in data.items() if key != "errors"},
+                }
+                for name, data in sorted(self.views.items())
+            }
+
+
+registry = Registry()
+
+
+def current():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def span(name):
+    """
+    Suma la duración del bloque al tramo `name` del request en curso (si hay).
+    Un tramo anidado con el mismo nombre no se cuenta dos veces.
+    """
+    stats = _current.get()
+    if stats is None or name in stats.active:
+        yield
+        return
+    stats.active.add(name)
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.active.discard(name)
+        stats.spans[name] = stats.spans.get(name, 0.0) + (time.perf_counter() - begin) * 1000
+
+
+def _dispatch(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def install(connection, **kwargs):
+    """Receptor de connection_created: agrega el execute_wrapper de la contextvar (una vez por conexión)."""
+    if _dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_dispatch)
+
+
+@contextlib.contextmanager
+def instrument(stats):
+    """
+    Activa `stats` para el bloque: consultas de todas las conexiones, también
+    las de los hilos que hereden el contexto, y tramos.
+    """
+    outer = _current.get()
+    if outer is not stats:
+        stats.outer = outer
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def server_timing(stats, total_ms):
+    parts = [f'total;dur={total_ms:.1f}', f'db;dur={stats.db_ms:.1f};desc="{stats.queries} consultas"']
+    for name, duration in stats.spans.items():
+        parts.append(f'{name};dur={duration:.1f}')
+    return ', '.join(parts)
+
+
+def finish(stats, status, path):
+    """Cierra la medición: histogramas y, si fue lento, log con las consultas más lentas."""
+    total_ms = stats.elapsed_ms()
+    registry.record(stats, total_ms, status)
+    if total_ms >= slow_ms():
+        slowest = sorted(stats.sql, reverse=True)
+        entry = {
+            "view": stats.view,
+            "path": path,
+            "status": status,
+            "wall_ms": round(total_ms, 1),
+            "db_ms": round(stats.db_ms, 1),
+            "queries": stats.queries,
+            "sql": [{"ms": round(ms, 2), "db": alias, "sql": sql} for ms, alias, sql in slowest],
+        }
+        registry.slow.append(entry)
+        logger.warning(
+            "request lento: %s %s %.0f ms (%d consultas, %.0f ms en la base)\n%s",
+            stats.view, path, total_ms, stats.queries, stats.db_ms,
+            '\n'.join(f"  {ms:8.2f} ms [{alias}] {sql}" for ms, alias, sql in slowest),
+        )
+    return total_ms
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def prometheus_text():
+    """Exposición en formato de texto de Prometheus (resúmenes con cuantiles)."""
+    metrics = (
+        ('wall_ms', 'dashboard_request_seconds', 'Duración de los requests', 1000),
+        ('db_ms', 'dashboard_request_db_seconds', 'Tiempo en la base por request', 1000),
+        ('serialize_ms', 'dashboard_request_serialize_seconds', 'Tiempo de serialización por request', 1000),
+        ('queries', 'dashboard_request_queries', 'Consultas SQL por request', 1),
+        ('bytes', 'dashboard_response_bytes', 'Bytes de respuesta', 1),
+    )
+    with registry.lock:
+        views = {name: dict(data) for name, data in registry.views.items()}
+    lines = []
+    for key, metric, help_text, scale in metrics:
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} summary')
+        for name, data in sorted(views.items()):
+            hist = data[key]
+            label = f'view="{_label(name)}"'
+            for q in QUANTILES:
+                lines.append(f'{metric}{{{label},quantile="{q}"}} {hist.quantile(q) / scale:.6g}')
+            lines.append(f'{metric}_sum{{{label}}} {hist.total / scale:.6g}')
+            lines.append(f'{metric}_count{{{label}}} {hist.count}')
+    lines.append('# HELP dashboard_request_errors_total Respuestas 5xx')
+    lines.append('# TYPE dashboard_request_errors_total counter')
+    for name, data in sorted(views.items()):
+        lines.append(f'dashboard_request_errors_total{{view="{_label(name)}"}} {data["errors"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,148 @@
+"""
+Proyección Monte Carlo del incidente.
+
+Toma los rangos de incertidumbre del resumen (afectados, heridos graves y
+leves, necesidad de albergue) y el último valor observado de cada serie, sortea
+miles de escenarios con montecarlo.py y devuelve las bandas p10/p50/p90 por
+hora. Las bandas se guardan como series MetricPoint `proj_<métrica>_p<n>` del
+mismo incidente.
+"""
+import datetime
+import os
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import montecarlo, rollups
+from .ingest import insert_points
+from .models import MetricPoint
+from .scenario import SERIES
+
+DEFAULT_SCENARIOS = 10_000
+MAX_SCENARIOS = 1_000_000
+DEFAULT_HOURS = 72
+MAX_HOURS = 24 * 30
+# escenarios × pasos sorteados por corrida: MAX_SCENARIOS alcanza solo con el horizonte por defecto
+MAX_SCENARIO_STEPS = MAX_SCENARIOS * (DEFAULT_HOURS + 1)
+PREFIX = 'proj_'
+# total de fallecidos en el horizonte, relativo a la proyección puntual del resumen
+FATALITY_SPREAD = (0.9, 1.25)
+# fracción de la capacidad hospitalaria operativa que queda al final del horizonte
+HOSPITAL_DECAY = (0.35, 1.0)
+# métricas acumuladas: el final sorteado nunca queda por debajo de lo ya observado
+CUMULATIVE = ('fatalities', 'injured_severe', 'injured_mild', 'affected', 'shelter_needed')
+
+
+class ProjectionError(ValueError):
+    """Parámetros de proyección inválidos."""
+
+
+def band_name(metric, percentile):
+    return f'{PREFIX}{metric}_p{percentile}'
+
+
+def parse_options(params):
+    """scenarios/hours/seed desde un QueryDict (o dict)."""
+    try:
+        scenarios = int(params.get('scenarios', DEFAULT_SCENARIOS))
+        hours = int(params.get('hours', DEFAULT_HOURS))
+        seed = int(params['seed']) if params.get('seed') not in (None, '') else None
+    except (TypeError, ValueError):
+        raise ProjectionError("scenarios, hours y seed deben ser enteros")
+    if not 1 <= scenarios <= MAX_SCENARIOS:
+        raise ProjectionError(f"scenarios debe estar entre 1 y {MAX_SCENARIOS}")
+    if not 1 <= hours <= MAX_HOURS:
+        raise ProjectionError(f"hours debe estar entre 1 y {MAX_HOURS}")
+    if scenarios * (hours + 1) > MAX_SCENARIO_STEPS:
+        raise ProjectionError(f"scenarios × (hours + 1) no puede superar {MAX_SCENARIO_STEPS}")
+    return {"scenarios": scenarios, "hours": hours, "seed": seed}
+
+
+def latest_values(incident_id):
+    """Último valor observado de cada serie del escenario en el incidente (None si no hay datos)."""
+    points = MetricPoint.objects.filter(incident_id=incident_id)
+    return {
+        metric: points.filter(metric=metric).order_by('-timestamp').values_list('value', flat=True).first()
+        for metric in SERIES
+    }
+
+
+def parameters(summary, observed):
+    """(inicio, final_min, final_max) por métrica para montecarlo.simulate."""
+    hospital = observed['hospital_operational_pct']
+    if hospital is None:
+        hospital = summary.hospital_operational_pct * 100
+    params = {
+        'fatalities': (observed['fatalities'], *(summary.fatalities * f for f in FATALITY_SPREAD)),
+        'injured_severe': (observed['injured_severe'], summary.injured_severe_min, summary.injured_severe_max),
+        'injured_mild': (observed['injured_mild'], summary.injured_mild_min, summary.injured_mild_max),
+        'hospital_operational_pct': (hospital, *(hospital * f for f in HOSPITAL_DECAY)),
+        'affected': (None, summary.affected_pct_min * summary.population, summary.affected_pct_max * summary.population),
+        'shelter_needed': (None, summary.shelter_needed_min, summary.shelter_needed_max),
+    }
+    for metric in CUMULATIVE:
+        start, low, high = params[metric]
+        low = max(low, start or 0)
+        params[metric] = (start, low, max(high, low))
+    return params
+
+
+def workers():
+    """Procesos del pool de montecarlo.bands: lo configurado, sin pasar de las CPU que este proceso puede usar."""
+    available = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    return min(getattr(settings, 'DASHBOARD_PROJECTION_WORKERS', None) or available, available)
+
+
+def project(summary, scenarios=DEFAULT_SCENARIOS, hours=DEFAULT_HOURS, seed=None):
+    """Bandas {métrica: {"p10": [...], "p50": [...], "p90": [...]}} con un valor por hora."""
+    start = time.perf_counter()
+    params = parameters(summary, latest_values(summary.pk))
+    result = montecarlo.bands(params, scenarios, hours, seed, workers())
+    return {
+        "scenarios": scenarios,
+        "hours": hours,
+        "seed": seed,
+        "bands": {
+            metric: {f"p{p}": [round(float(v), 2) for v in values] for p, values in zip(montecarlo.PERCENTILES, rows)}
+            for metric, rows in result.items()
+        },
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+
+
+def save_bands(incident_id, projection, start):
+    """Reemplaza las series proj_* del incidente por las bandas de `projection`, desde `start` cada una hora."""
+    note = f"{projection['scenarios']} escenarios"
+    points = []
+    for metric, bands in projection['bands'].items():
+        for label, values in bands.items():
+            name = f'{PREFIX}{metric}_{label}'
+            points.extend(
+                (start + datetime.timedelta(hours=hour), name, value, note) for hour, value in enumerate(values)
+            )
+    with transaction.atomic():
+        rollups.delete_metrics(Q(incident_id=incident_id, metric__startswith=PREFIX))
+        insert_points(incident_id, points)
+    return len(points)
+
+
+def advance(summary, projection, step_hours=1):
+    """
+    Avanza el escenario `step_hours` según la mediana: agrega el punto actual de
+    cada serie observada y actualiza la capacidad hospitalaria operativa del
+    resumen. Los fallecidos proyectados del resumen no se tocan: son la base
+    del rango de la próxima corrida y la mediana queda en proj_fatalities_p50.
+    """
+    bands = projection['bands']
+    step = min(step_hours, projection['hours'])
+    now = timezone.now()
+    with transaction.atomic():
+        summary.hospital_operational_pct = round(max(0.05, bands['hospital_operational_pct']['p50'][step] / 100), 4)
+        summary.save()
+        note = f'p50 a {step}h ({projection["scenarios"]} escenarios)'
+        insert_points(summary.pk, [(now, metric, bands[metric]['p50'][step], note) for metric in SERIES])
+        save_bands(summary.pk, projection, now)
+    return summary
@@ -0,0 +1,132 @@
+"""
+Difusión de cambios por WebSocket.
+
+Un único relay por proceso lee el feed incremental (changes.delta_since) de
+cada incidente con suscriptores y, cuando hubo cambios, manda un solo mensaje
+al grupo de ese incidente. Así se detectan igual los cambios hechos desde
+api_simulate, el admin, los comandos de manage.py u otros workers, y la base
+recibe una consulta por incidente activo e intervalo en lugar de una por
+cliente conectado. El relay solo corre mientras haya suscriptores.
+
+Con una capa de canales compartida entre procesos (p. ej. Redis) conviene
+dejar DASHBOARD_WS_RELAY = True en un único proceso para no duplicar mensajes.
+"""
+import asyncio
+import logging
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from . import changes
+
+logger = logging.getLogger(__name__)
+
+RESOURCE_KEYS = ('bridges', 'hospitals', 'shelters', 'services')
+
+
+def group_name(incident_id):
+    return f'incident_{incident_id}'
+
+
+def poll_interval():
+    return getattr(settings, 'DASHBOARD_WS_POLL_SECONDS', 0.5)
+
+
+def point_count(delta):
+    return sum(len(points) for points in delta.get('metrics', {}).values())
+
+
+def merge_delta(older, newer):
+    """
+    Combina dos deltas consecutivos en uno solo (since del primero, cursor del
+    segundo). Los recursos se reemplazan por id y las bajas anulan altas previas;
+    una serie que el segundo delta pide recargar (reset_metrics) descarta los
+    puntos encolados del primero, porque el cliente la vuelve a pedir entera.
+    """
+    merged = {"since": older.get("since"), "cursor": newer["cursor"], "reset": False}
+    if newer.get("more"):
+        merged["more"] = True
+    summary = newer.get("summary") or older.get("summary")
+    if summary:
+        merged["summary"] = summary
+    reset = set(newer.get("reset_metrics", ()))
+    if reset or older.get("reset_metrics"):
+        merged["reset_metrics"] = sorted(reset.union(older.get("reset_metrics", ())))
+    metrics = {
+        name: list(points) for name, points in older.get("metrics", {}).items() if name not in reset
+    }
+    for name, points in newer.get("metrics", {}).items():
+        metrics.setdefault(name, []).extend(points)
+    if metrics:
+        merged["metrics"] = metrics
+    deleted = {}
+    for key in RESOURCE_KEYS:
+        rows = {row["id"]: row for row in older.get(key, [])}
+        gone = set(older.get("deleted", {}).get(key, []))
+        for pk in newer.get("deleted", {}).get(key, []):
+            rows.pop(pk, None)
+            gone.add(pk)
+        for row in newer.get(key, []):
+            rows[row["id"]] = row
+            gone.discard(row["id"])
+        if rows:
+            merged[key] = list(rows.values())
+        if gone:
+            deleted[key] = sorted(gone)
+    if deleted:
+        merged["deleted"] = deleted
+    return merged
+
+
+class Relay:
+    def __init__(self):
+        self.subscribers = {}  # incidente -> sockets conectados
+        self.cursors = {}
+        self.task = None
+
+    async def subscribe(self, incident_id):
+        self.subscribers[incident_id] = self.subscribers.get(incident_id, 0) + 1
+        if not getattr(settings, 'DASHBOARD_WS_RELAY', True):
+            return None
+        if incident_id not in self.cursors:
+            self.cursors[incident_id] = await database_sync_to_async(changes.current_cursor)()
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._run())
+        return changes.format_cursor(*self.cursors[incident_id])
+
+    def unsubscribe(self, incident_id):
+        remaining = self.subscribers.get(incident_id, 0) - 1
+        if remaining > 0:
+            self.subscribers[incident_id] = remaining
+        else:
+            self.subscribers.pop(incident_id, None)
+            self.cursors.pop(incident_id, None)
+
+    def _poll(self, incident_id):
+        cursor = self.cursors.get(incident_id)
+        if cursor is None:
+            return None
+        since = changes.format_cursor(*cursor)
+        delta = changes.delta_since(incident_id, *cursor)
+        if delta["cursor"] == since:
+            return None
+        self.cursors[incident_id] = changes.parse_cursor(delta["cursor"])
+        delta["since"] = since
+        return delta
+
+    async def _run(self):
+        layer = get_channel_layer()
+        while self.subscribers:
+            await asyncio.sleep(poll_interval())
+            for incident_id in list(self.subscribers):
+                try:
+                    delta = await database_sync_to_async(self._poll)(incident_id)
+                except Exception:
+                    logger.exception("relay: no se pudo leer el feed de cambios del incidente %s", incident_id)
+                    continue
+                if delta is not None:
+                    await layer.group_send(group_name(incident_id), {"type": "incident.delta", "delta": delta})
+
+
+relay = Relay()
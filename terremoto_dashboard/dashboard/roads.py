@@ -0,0 +1,466 @@
+"""
+Red vial y ruteo (routing.py ya lo usan las rutas de WebSocket).
+
+La red se lee de un CSV de tramos (p. ej. un extracto de OSM convertido a
+lista de aristas), una fila por tramo:
+
+    from_id,from_lat,from_lng,to_id,to_lat,to_lng,length_m,speed_kmh,oneway,bridge
+
+length_m, speed_kmh, oneway y bridge son opcionales (por defecto: distancia en
+línea recta, 40 km/h, doble mano, sin puente). `bridge` es el nombre de un
+Bridge: el tramo queda cortado si el puente está 'derribado' y se recorre más
+lento si está 'parcialmente'.
+
+El grafo se guarda en arrays (CSR). Las rutas punto a punto usan A*; el
+tiempo al hospital/refugio más cercano sale de un árbol de caminos mínimos
+hacia todos ellos, que se cachea por proceso y se repara de forma incremental
+cuando cambia el estado de un puente (los cambios se leen de ResourceChange).
+
+Cada incidente tiene sus puentes y establecimientos: la topología se lee una
+vez y cada incidente usa una copia con sus propios costos (RoadNetwork.fork)
+y sus propios árboles.
+"""
+import copy
+import csv
+import heapq
+import math
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max
+
+from . import allocation
+from .models import Bridge, Hospital, ResourceChange, Shelter
+from .spatial import haversine_m
+
+DEFAULT_SPEED_KMH = 40.0
+# multiplicador del tiempo de viaje según el estado del puente
+STATUS_FACTORS = {'ok': 1.0, 'parcialmente': 3.0, 'derribado': math.inf}
+# distancia máxima de un punto (o establecimiento) al nodo de la red más cercano
+SNAP_MAX_M = 5000
+# qué establecimientos son destino de los árboles de caminos
+TARGET_FILTERS = {'hospitals': {'operational': True}, 'shelters': {}}
+TARGETS = {
+    'hospitals': lambda incident_id: Hospital.objects.filter(incident_id=incident_id, **TARGET_FILTERS['hospitals']),
+    'shelters': lambda incident_id: Shelter.objects.filter(incident_id=incident_id, **TARGET_FILTERS['shelters']),
+}
+
+
+class RoutingError(ValueError):
+    """Consulta inválida (coordenadas fuera de la red, destino desconocido)."""
+
+
+class NetworkUnavailable(RuntimeError):
+    """No hay red vial configurada o no se pudo leer el archivo."""
+
+
+def _truthy(raw):
+    return (raw or '').strip().lower() in ('1', 'yes', 'true', 'si', 'sí')
+
+
+class RoadNetwork:
+    """Grafo dirigido en formato CSR, con índices de aristas salientes y entrantes."""
+
+    def __init__(self, lat, lng, src, dst, length, base_cost, edge_bridge):
+        n = len(lat)
+        self.lat, self.lng = np.asarray(lat, dtype=float), np.asarray(lng, dtype=float)
+        self._coords = list(zip(self.lat.tolist(), self.lng.tolist()))
+        src, dst = np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64)
+        out_order = np.argsort(src, kind='stable')
+        in_order = np.argsort(dst, kind='stable')
+        # los lazos de Dijkstra indexan listas de Python: es más rápido que hacerlo sobre arrays
+        self.src, self.dst = src.tolist(), dst.tolist()
+        self.length = list(length)
+        self.base_cost = list(base_cost)
+        self.cost = list(base_cost)
+        self.out_ptr = np.searchsorted(src[out_order], np.arange(n + 1)).tolist()
+        self.out_edges = out_order.tolist()
+        self.in_ptr = np.searchsorted(dst[in_order], np.arange(n + 1)).tolist()
+        self.in_edges = in_order.tolist()
+        self.bridge_edges = {}
+        for edge, name in enumerate(edge_bridge):
+            if name:
+                self.bridge_edges.setdefault(name, []).append(edge)
+        self.bridge_factors = dict.fromkeys(self.bridge_edges, 1.0)
+        # velocidad que hace admisible la heurística de A* (línea recta / costo)
+        straight = [haversine_m(lat[s], lng[s], lat[d], lng[d]) for s, d in zip(self.src, self.dst)]
+        self.max_speed = max([s / c for s, c in zip(straight, self.base_cost) if c > 0] or [1.0])
+        self.xyz = allocation.unit_vectors(self.lat, self.lng)
+        self._kdtree = allocation.cKDTree(self.xyz) if allocation.cKDTree is not None and n else None
+
+    @property
+    def node_count(self):
+        return len(self.lat)
+
+    @property
+    def edge_count(self):
+        return len(self.src)
+
+    @classmethod
+    def from_csv(cls, path):
+        nodes, lat, lng = {}, [], []
+        src, dst, length, cost, bridges = [], [], [], [], []
+
+        def node(raw_id, raw_lat, raw_lng):
+            index = nodes.get(raw_id)
+            if index is None:
+                index = nodes[raw_id] = len(lat)
+                lat.append(float(raw_lat))
+                lng.append(float(raw_lng))
+            return index
+
+        with open(path, newline='', encoding='utf-8') as fh:
+            reader = csv.DictReader(fh)
+            for line, row in enumerate(reader, start=2):
+                try:
+                    u = node(row['from_id'], row['from_lat'], row['from_lng'])
+                    v = node(row['to_id'], row['to_lat'], row['to_lng'])
+                    meters = float(row.get('length_m') or haversine_m(lat[u], lng[u], lat[v], lng[v]))
+                    speed = float(row.get('speed_kmh') or DEFAULT_SPEED_KMH)
+                except (KeyError, TypeError, ValueError):
+                    raise NetworkUnavailable(f"{path}: fila {line} inválida")
+                if speed <= 0 or meters < 0:
+                    raise NetworkUnavailable(f"{path}: fila {line} con velocidad o longitud inválida")
+                seconds = meters / (speed / 3.6)
+                bridge = (row.get('bridge') or '').strip()
+                pairs = [(u, v)] if _truthy(row.get('oneway')) else [(u, v), (v, u)]
+                for a, b in pairs:
+                    src.append(a)
+                    dst.append(b)
+                    length.append(meters)
+                    cost.append(seconds)
+                    bridges.append(bridge)
+        return cls(lat, lng, src, dst, length, cost, bridges)
+
+    def fork(self):
+        """Copia que comparte la topología y arranca con los costos base (todos los puentes 'ok')."""
+        network = copy.copy(self)
+        network.cost = list(self.base_cost)
+        network.bridge_factors = dict.fromkeys(self.bridge_edges, 1.0)
+        return network
+
+    def apply_bridge_status(self, statuses):
+        """
+        Ajusta el costo de los tramos según {nombre de puente: estado}. Los puentes
+        que no figuran se consideran 'ok'. Devuelve las aristas que cambiaron.
+        """
+        changed = []
+        for name, edges in self.bridge_edges.items():
+            factor = STATUS_FACTORS.get(statuses.get(name, 'ok'), 1.0)
+            if factor == self.bridge_factors[name]:
+                continue
+            self.bridge_factors[name] = factor
+            for edge in edges:
+                self.cost[edge] = self.base_cost[edge] * factor
+            changed.extend(edges)
+        return changed
+
+    def snap(self, lat, lng):
+        """Nodo más cercano a cada punto y su distancia en metros."""
+        if not self.node_count:
+            raise RoutingError("la red vial está vacía")
+        points = allocation.unit_vectors(np.atleast_1d(lat), np.atleast_1d(lng))
+        if self._kdtree is not None:
+            chord, idx = self._kdtree.query(points)
+            return np.atleast_1d(idx), allocation.chord_to_m(np.atleast_1d(chord))
+        dist, idx = allocation.nearest(points, self.xyz, 1)
+        return idx[:, 0], dist[:, 0]
+
+    def edge_bridge_names(self, edges):
+        names = {edge: name for name, bridge_edges in self.bridge_edges.items() for edge in bridge_edges}
+        return [names[edge] for edge in edges if edge in names]
+
+    def shortest_path(self, source, target):
+        """A* de `source` a `target`. Devuelve la lista de aristas, o None si no hay camino."""
+        coords, speed = self._coords, self.max_speed
+        goal_lat, goal_lng = coords[target]
+        out_ptr, out_edges, dst, cost = self.out_ptr, self.out_edges, self.dst, self.cost
+        dist = {source: 0.0}
+        prev = {}
+        heap = [(haversine_m(*coords[source], goal_lat, goal_lng) / speed, source)]
+        done = set()
+        while heap:
+            _, u = heapq.heappop(heap)
+            if u == target:
+                break
+            if u in done:
+                continue
+            done.add(u)
+            base = dist[u]
+            for i in range(out_ptr[u], out_ptr[u + 1]):
+                edge = out_edges[i]
+                c = cost[edge]
+                if c == math.inf:
+                    continue
+                v = dst[edge]
+                nd = base + c
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    prev[v] = edge
+                    heapq.heappush(heap, (nd + haversine_m(*coords[v], goal_lat, goal_lng) / speed, v))
+        if target not in dist:
+            return None
+        edges, node = [], target
+        while node != source:
+            edge = prev[node]
+            edges.append(edge)
+            node = self.src[edge]
+        edges.reverse()
+        return edges
+
+
+class PathTree:
+    """
+    Árbol de caminos mínimos desde cada nodo hacia el destino más cercano de un
+    conjunto (Dijkstra multi-origen sobre las aristas entrantes).
+    """
+
+    def __init__(self, network, targets):
+        n = network.node_count
+        self.network = network
+        self.dist = [math.inf] * n
+        self.next_edge = [-1] * n
+        self.target = [None] * n
+        heap = []
+        for node, target in targets.items():
+            self.dist[node] = 0.0
+            self.target[node] = target
+            heap.append((0.0, node))
+        heapq.heapify(heap)
+        self._run(heap)
+
+    def _run(self, heap):
+        net = self.network
+        in_ptr, in_edges, src, cost = net.in_ptr, net.in_edges, net.src, net.cost
+        dist, next_edge, target = self.dist, self.next_edge, self.target
+        while heap:
+            d, w = heapq.heappop(heap)
+            if d > dist[w]:
+                continue
+            for i in range(in_ptr[w], in_ptr[w + 1]):
+                edge = in_edges[i]
+                nd = d + cost[edge]
+                v = src[edge]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    next_edge[v] = edge
+                    target[v] = target[w]
+                    heapq.heappush(heap, (nd, v))
+
+    def repair(self, edges):
+        """
+        Actualiza el árbol tras cambiar el costo de `edges`. Solo se recalcula
+        el subárbol que colgaba de las aristas del árbol que cambiaron, más lo
+        que mejore a partir de las aristas que bajaron de costo.
+        Devuelve la cantidad de nodos invalidados.
+        """
+        net = self.network
+        src, dst, cost = net.src, net.dst, net.cost
+        dist, next_edge, target = self.dist, self.next_edge, self.target
+        broken = set()
+        stack = [src[edge] for edge in edges if next_edge[src[edge]] == edge]
+        while stack:
+            v = stack.pop()
+            if v in broken:
+                continue
+            broken.add(v)
+            for i in range(net.in_ptr[v], net.in_ptr[v + 1]):
+                edge = net.in_edges[i]
+                if next_edge[src[edge]] == edge:
+                    stack.append(src[edge])
+        for v in broken:
+            dist[v], next_edge[v], target[v] = math.inf, -1, None
+        heap = []
+        # cada nodo invalidado arranca desde su mejor vecino que quedó sano
+        for v in broken:
+            for i in range(net.out_ptr[v], net.out_ptr[v + 1]):
+                edge = net.out_edges[i]
+                nd = dist[dst[edge]] + cost[edge]
+                if nd < dist[v]:
+                    dist[v], next_edge[v], target[v] = nd, edge, target[dst[edge]]
+            if dist[v] < math.inf:
+                heap.append((dist[v], v))
+        # aristas fuera del árbol que bajaron de costo
+        for edge in edges:
+            v, w = src[edge], dst[edge]
+            nd = dist[w] + cost[edge]
+            if nd < dist[v]:
+                dist[v], next_edge[v], target[v] = nd, edge, target[w]
+                heap.append((nd, v))
+        heapq.heapify(heap)
+        self._run(heap)
+        return len(broken)
+
+    def path_from(self, node):
+        edges = []
+        while self.next_edge[node] != -1:
+            edges.append(self.next_edge[node])
+            node = self.network.dst[self.next_edge[node]]
+        return edges
+
+
+# Red y árboles cacheados por proceso: la topología leída del CSV y, por
+# incidente, su copia de la red, el cursor de ResourceChange y los árboles
+_lock = threading.RLock()
+_state = {"path": None, "base": None, "incidents": {}}
+
+
+def reset():
+    with _lock:
+        _state.update(path=None, base=None, incidents={})
+
+
+def _bridge_statuses(incident_id):
+    return dict(Bridge.objects.filter(incident_id=incident_id).values_list('name', 'status'))
+
+
+def load_network(path, incident_id=None):
+    """Lee la red de `path` y, si se indica un incidente, le aplica el estado de sus puentes."""
+    try:
+        network = RoadNetwork.from_csv(path)
+    except OSError as exc:
+        raise NetworkUnavailable(f"no se pudo leer la red vial: {exc}")
+    if incident_id is not None:
+        network.apply_bridge_status(_bridge_statuses(incident_id))
+    return network
+
+
+def _incident_state(incident_id):
+    path = getattr(settings, 'DASHBOARD_ROAD_NETWORK', None)
+    if not path:
+        raise NetworkUnavailable("no hay red vial configurada (DASHBOARD_ROAD_NETWORK)")
+    if _state['base'] is None or _state['path'] != str(path):
+        _state.update(path=str(path), base=load_network(path), incidents={})
+    state = _state['incidents'].get(incident_id)
+    if state is None:
+        # el cursor se toma antes de leer los puentes para no perder cambios
+        cursor = ResourceChange.objects.aggregate(m=Max('id'))['m'] or 0
+        network = _state['base'].fork()
+        network.apply_bridge_status(_bridge_statuses(incident_id))
+        state = _state['incidents'][incident_id] = {"network": network, "cursor": cursor, "trees": {}}
+    else:
+        _sync(incident_id, state)
+    return state
+
+
+def get_network(incident_id):
+    """Red vial del incidente, actualizada con los últimos cambios de puentes y establecimientos."""
+    with _lock:
+        return _incident_state(incident_id)['network']
+
+
+def _placement(kind, deleted, data):
+    """(lat, lng) con que un cambio deja al objeto entre los destinos de `kind`; None si no es destino."""
+    if deleted or not all(data.get(field) == value for field, value in TARGET_FILTERS[kind].items()):
+        return None
+    return data['lat'], data['lng']
+
+
+def _moves_targets(tree, kind, changed):
+    for _, model, pk, deleted, data in changed:
+        if model != kind:
+            continue
+        if data is None and not deleted:
+            # cambio registrado sin valores: no se sabe qué cambió
+            return True
+        if _placement(kind, deleted, data) != tree.placements.get(pk):
+            return True
+    return False
+
+
+def _sync(incident_id, state):
+    changed = list(
+        ResourceChange.objects.filter(incident_id=incident_id, id__gt=state['cursor'], model__in=('bridges', *TARGETS))
+        .values_list('id', 'model', 'object_id', 'deleted', 'data').order_by('id')
+    )
+    if not changed:
+        return
+    state['cursor'] = changed[-1][0]
+    models = {row[1] for row in changed}
+    for kind in TARGETS:
+        tree = state['trees'].get(kind)
+        # los ingresos y egresos (occupancy.py) también son cambios: solo una
+        # baja, un alta o un cambio de posición u operatividad rearman el árbol
+        if tree is not None and _moves_targets(tree, kind, changed):
+            state['trees'].pop(kind)
+    if 'bridges' in models:
+        edges = state['network'].apply_bridge_status(_bridge_statuses(incident_id))
+        if edges:
+            for tree in state['trees'].values():
+                tree.repair(edges)
+
+
+def build_tree(network, incident_id, kind):
+    """Árbol de caminos hacia los establecimientos de `kind` (hospitals/shelters) del incidente."""
+    rows = list(TARGETS[kind](incident_id).values_list('id', 'lat', 'lng'))
+    targets = {}
+    if rows:
+        ids, lat, lng = zip(*rows)
+        nodes, meters = network.snap(lat, lng)
+        for pk, node, distance in zip(ids, nodes.tolist(), meters.tolist()):
+            if distance <= SNAP_MAX_M:
+                targets.setdefault(node, pk)
+    tree = PathTree(network, targets)
+    # posición de cada destino, para ver si un cambio posterior lo afecta (ver _sync)
+    tree.placements = {pk: (lat, lng) for pk, lat, lng in rows}
+    return tree
+
+
+def path_tree(incident_id, kind):
+    with _lock:
+        state = _incident_state(incident_id)
+        tree = state['trees'].get(kind)
+        if tree is None:
+            tree = state['trees'][kind] = build_tree(state['network'], incident_id, kind)
+        return tree
+
+
+def _snap_point(network, lat, lng):
+    nodes, meters = network.snap(lat, lng)
+    if meters[0] > SNAP_MAX_M:
+        raise RoutingError(f"el punto ({lat}, {lng}) está a más de {SNAP_MAX_M} m de la red vial")
+    return int(nodes[0]), float(meters[0])
+
+
+def _describe(network, start, edges):
+    lat, lng = network.lat, network.lng
+    nodes = [start] + [network.dst[edge] for edge in edges]
+    return {
+        "reachable": True,
+        "travel_s": round(sum(network.cost[edge] for edge in edges), 1),
+        "distance_m": round(sum(network.length[edge] for edge in edges), 1),
+        "bridges": sorted(set(network.edge_bridge_names(edges))),
+        "path": [[float(lat[node]), float(lng[node])] for node in nodes],
+    }
+
+
+def route(incident_id, from_lat, from_lng, to_lat, to_lng):
+    """Ruta más rápida entre dos puntos, según el estado actual de los puentes del incidente."""
+    network = get_network(incident_id)
+    with _lock:
+        source, snap_from = _snap_point(network, from_lat, from_lng)
+        target, snap_to = _snap_point(network, to_lat, to_lng)
+        edges = network.shortest_path(source, target)
+        if edges is None:
+            return {"reachable": False}
+        result = _describe(network, source, edges)
+    result["snap_m"] = [round(snap_from, 1), round(snap_to, 1)]
+    return result
+
+
+def nearest_facility(incident_id, lat, lng, kind):
+    """Tiempo de viaje y ruta al hospital (o refugio) alcanzable más cercano del incidente."""
+    if kind not in TARGETS:
+        raise RoutingError(f"nearest debe ser uno de: {', '.join(TARGETS)}")
+    tree = path_tree(incident_id, kind)
+    with _lock:
+        network = tree.network
+        source, snap = _snap_point(network, lat, lng)
+        if tree.target[source] is None:
+            return {"reachable": False, "kind": kind}
+        result = _describe(network, source, tree.path_from(source))
+        target_id = tree.target[source]
+    target = TARGETS[kind](incident_id).filter(pk=target_id).values('id', 'name').first()
+    result.update(kind=kind, snap_m=round(snap, 1), target=target)
+    return result
@@ -0,0 +1,300 @@
+"""
+Agregados de MetricPoint por minuto, hora y día (count, min, max, sum, last).
+
+Se llevan por incidente y se mantienen de forma incremental:
+ingest.insert_points (y con él la ingesta masiva, los escenarios y las
+proyecciones) suma cada lote con un UPSERT por lote; los MetricPoint creados
+de a uno llegan por post_save. Quien inserte con
+MetricPoint.objects.bulk_create() debe llamar a add_points() o a rebuild().
+
+Con los agregados al día, compact() borra los puntos crudos y los agregados
+finos más viejos que DASHBOARD_METRIC_RETENTION, y timeseries lee de la
+resolución más gruesa que alcanza para lo que pide el gráfico (y, para la
+serie completa, de los agregados en lo que ya no tiene puntos crudos).
+
+Los borrados de puntos crudos (compact(), delete_metrics(), delete_points()) dejan en el feed
+de cambios un ResourceChange 'metrics' por incidente con las series
+afectadas: los clientes que las tienen en memoria las vuelven a pedir.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import MetricPoint, MetricRollup, ResourceChange
+
+MINUTE, HOUR, DAY = 60, 3600, 86400
+RESOLUTIONS = {'minute': MINUTE, 'hour': HOUR, 'day': DAY}
+# días que se conservan en cada nivel (None: sin límite)
+DEFAULT_RETENTION = {'raw': 7, 'minute': 30, 'hour': 365, 'day': None}
+REBUILD_BATCH = 10_000
+
+UTC = datetime.timezone.utc
+
+
+def retention():
+    days = {**DEFAULT_RETENTION, **getattr(settings, 'DASHBOARD_METRIC_RETENTION', {})}
+    levels = ['raw', *RESOLUTIONS]
+    kept = [days[level] for level in levels]
+    # cada nivel tiene que cubrir al menos lo mismo que el anterior, más fino
+    for finer, coarser, level in zip(kept, kept[1:], levels[1:]):
+        if coarser is not None and (finer is None or coarser < finer):
+            raise ValueError(f"DASHBOARD_METRIC_RETENTION: '{level}' no puede durar menos que el nivel más fino")
+    return days
+
+
+def cutoff(level, now=None):
+    """
+    Momento desde el que `level` ('raw', 'minute', ...) conserva datos, o None.
+    Se alinea al comienzo del día (UTC) para que ninguna cubeta quede con
+    parte de sus puntos compactados (ver rebuild()).
+    """
+    days = retention()[level]
+    if days is None:
+        return None
+    limit = (now or timezone.now()) - datetime.timedelta(days=days)
+    return _from_epoch(_floor(limit.timestamp(), DAY))
+
+
+def compacted_ranges(now=None):
+    """
+    [(resolución, desde, hasta)] que cubren lo anterior al límite de los puntos
+    crudos, cada tramo con el nivel más fino que todavía lo conserva (desde=None:
+    sin límite). Vacío si los puntos crudos no se compactan.
+    """
+    until = cutoff('raw', now)
+    ranges = []
+    if until is None:
+        return ranges
+    for level, resolution in RESOLUTIONS.items():
+        since = cutoff(level, now)
+        ranges.append((resolution, since, until))
+        if since is None:
+            break
+        until = since
+    return ranges
+
+
+def _floor(epoch, resolution):
+    return int(epoch // resolution) * resolution
+
+
+def _from_epoch(epoch):
+    return datetime.datetime.fromtimestamp(epoch, tz=UTC)
+
+
+def aggregate(points):
+    """
+    Agrega tuplas (timestamp, metric, value, note). Devuelve
+    {resolución: {(metric, epoch de la cubeta): [count, min, max, sum, last, last_epoch, last_ts,
+                                                 first_epoch, first_ts]}}.
+    Los puntos se recorren una sola vez (por minuto); hora y día salen de plegar
+    el nivel anterior.
+    """
+    level = {}
+    last_ts = epoch = None
+    for ts, metric, value, _ in points:
+        # las series suelen traer varias métricas con el mismo timestamp seguido
+        if ts is not last_ts:
+            last_ts, epoch = ts, ts.timestamp()
+        key = (metric, _floor(epoch, MINUTE))
+        agg = level.get(key)
+        if agg is None:
+            level[key] = [1, value, value, value, value, epoch, ts, epoch, ts]
+            continue
+        agg[0] += 1
+        if value < agg[1]:
+            agg[1] = value
+        if value > agg[2]:
+            agg[2] = value
+        agg[3] += value
+        if epoch >= agg[5]:
+            agg[4], agg[5], agg[6] = value, epoch, ts
+        if epoch < agg[7]:
+            agg[7], agg[8] = epoch, ts
+    levels = {MINUTE: level}
+    for resolution in (HOUR, DAY):
+        coarser = {}
+        for (metric, bucket), agg in level.items():
+            key = (metric, _floor(bucket, resolution))
+            into = coarser.get(key)
+            if into is None:
+                coarser[key] = list(agg)
+            else:
+                _merge(into, agg)
+        levels[resolution] = level = coarser
+    return levels
+
+
+def _merge(into, agg):
+    into[0] += agg[0]
+    into[1] = min(into[1], agg[1])
+    into[2] = max(into[2], agg[2])
+    into[3] += agg[3]
+    if agg[5] >= into[5]:
+        into[4], into[5], into[6] = agg[4], agg[5], agg[6]
+    if agg[7] < into[7]:
+        into[7], into[8] = agg[7], agg[8]
+
+
+def _upsert_sql():
+    quote = connection.ops.quote_name
+    table = quote(MetricRollup._meta.db_table)
+    columns = ['incident_id', 'metric', 'resolution', 'bucket', 'count', 'min_value', 'max_value',
+               'sum_value', 'last_value', 'first_timestamp', 'last_timestamp']
+    c = {name: quote(name) for name in columns}
+    newer = f"excluded.{c['last_timestamp']} >= {table}.{c['last_timestamp']}"
+    return (
+        f"INSERT INTO {table} ({', '.join(c.values())}) VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON CONFLICT ({c['incident_id']}, {c['metric']}, {c['resolution']}, {c['bucket']}) DO UPDATE SET "
+        f"{c['count']} = {table}.{c['count']} + excluded.{c['count']}, "
+        f"{c['min_value']} = CASE WHEN excluded.{c['min_value']} < {table}.{c['min_value']} "
+        f"THEN excluded.{c['min_value']} ELSE {table}.{c['min_value']} END, "
+        f"{c['max_value']} = CASE WHEN excluded.{c['max_value']} > {table}.{c['max_value']} "
+        f"THEN excluded.{c['max_value']} ELSE {table}.{c['max_value']} END, "
+        f"{c['sum_value']} = {table}.{c['sum_value']} + excluded.{c['sum_value']}, "
+        f"{c['last_value']} = CASE WHEN {newer} THEN excluded.{c['last_value']} ELSE {table}.{c['last_value']} END, "
+        f"{c['first_timestamp']} = CASE WHEN excluded.{c['first_timestamp']} < {table}.{c['first_timestamp']} "
+        f"THEN excluded.{c['first_timestamp']} ELSE {table}.{c['first_timestamp']} END, "
+        f"{c['last_timestamp']} = CASE WHEN {newer} "
+        f"THEN excluded.{c['last_timestamp']} ELSE {table}.{c['last_timestamp']} END"
+    )
+
+
+def add_points(incident_id, points):
+    """Suma un lote de tuplas (timestamp, metric, value, note) a los agregados del incidente."""
+    if not points:
+        return
+    adapt = connection.ops.adapt_datetimefield_value
+    rows = [
+        (incident_id, metric, resolution, adapt(_from_epoch(bucket)), *agg[:5], adapt(agg[8]), adapt(agg[6]))
+        for resolution, level in aggregate(points).items()
+        for (metric, bucket), agg in level.items()
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(_upsert_sql(), rows)
+
+
+def _record_deleted(points):
+    """Deja en el feed de cambios qué series de cada incidente pierden los puntos de `points`."""
+    series = {}
+    for incident_id, metric in points.order_by().values_list('incident_id', 'metric').distinct():
+        series.setdefault(incident_id, []).append(metric)
+    ResourceChange.objects.bulk_create(
+        ResourceChange(incident_id=incident_id, model=ResourceChange.METRICS, object_id=0, deleted=True,
+                       data=sorted(metrics))
+        for incident_id, metrics in series.items()
+    )
+
+
+def delete_metrics(q):
+    """Borra puntos crudos y agregados que cumplen `q` (un Q sobre `incident` y `metric`)."""
+    with transaction.atomic():
+        points = MetricPoint.objects.filter(q)
+        _record_deleted(points)
+        points.delete()
+        MetricRollup.objects.filter(q).delete()
+
+
+def delete_points(points):
+    """
+    Borra los MetricPoint de `points` (un queryset con cualquier filtro, p. ej.
+    por nota) y rehace los agregados de cada serie afectada desde el día de su
+    primer punto borrado, con los puntos crudos que quedan.
+    """
+    with transaction.atomic():
+        firsts = list(
+            points.order_by().values('incident', 'metric').annotate(first=Min('timestamp'))
+            .values_list('incident', 'metric', 'first')
+        )
+        _record_deleted(points)
+        points.delete()
+        for incident_id, metric, first in firsts:
+            _reaggregate(incident_id, metric, _from_epoch(_floor(first.timestamp(), DAY)))
+
+
+def compact(now=None):
+    """
+    Aplica la retención: borra los puntos crudos y los agregados de minuto y
+    hora más viejos que su límite. Devuelve las filas borradas por nivel.
+    """
+    deleted = {}
+    with transaction.atomic():
+        limit = cutoff('raw', now)
+        if limit is not None:
+            points = MetricPoint.objects.filter(timestamp__lt=limit)
+            _record_deleted(points)
+            deleted['raw'] = points.delete()[0]
+        for level, resolution in RESOLUTIONS.items():
+            limit = cutoff(level, now)
+            if limit is not None:
+                deleted[level] = MetricRollup.objects.filter(resolution=resolution, bucket__lt=limit).delete()[0]
+    return deleted
+
+
+def rebuild(metrics=None, incident_id=None):
+    """
+    Recalcula los agregados a partir de los puntos crudos que quedan. Por
+    incidente y métrica se rehacen solo las cubetas desde el día del primer
+    punto crudo: lo anterior ya fue compactado y vive solo en los agregados.
+    """
+    raw = MetricPoint.objects.all()
+    if incident_id is not None:
+        raw = raw.filter(incident_id=incident_id)
+    if metrics:
+        raw = raw.filter(metric__in=metrics)
+    firsts = (
+        raw.values('incident', 'metric').annotate(first=Min('timestamp'))
+        .values_list('incident', 'metric', 'first')
+    )
+    total = 0
+    with transaction.atomic():
+        for incident, metric, first in firsts:
+            total += _reaggregate(incident, metric, _from_epoch(_floor(first.timestamp(), DAY)))
+    return total
+
+
+def _reaggregate(incident_id, metric, start):
+    """Rehace las cubetas de la serie desde `start` (comienzo de un día) con sus puntos crudos."""
+    MetricRollup.objects.filter(incident_id=incident_id, metric=metric, bucket__gte=start).delete()
+    rows = (
+        MetricPoint.objects.filter(incident_id=incident_id, metric=metric, timestamp__gte=start).order_by('timestamp')
+        .values_list('timestamp', 'metric', 'value', 'note')
+    )
+    total = 0
+    batch = []
+    for point in rows.iterator(chunk_size=REBUILD_BATCH):
+        batch.append(point)
+        if len(batch) >= REBUILD_BATCH:
+            add_points(incident_id, batch)
+            total += len(batch)
+            batch = []
+    add_points(incident_id, batch)
+    return total + len(batch)
+
+
+def bounds(incident_id, metrics=None):
+    """(primer, último timestamp) del incidente según los agregados diarios, o (None, None)."""
+    qs = MetricRollup.objects.filter(incident_id=incident_id, resolution=DAY)
+    if metrics:
+        qs = qs.filter(metric__in=metrics)
+    result = qs.aggregate(first=Min('first_timestamp'), last=Max('last_timestamp'))
+    return result['first'], result['last']
+
+
+def choose_resolution(start, end, points, now=None):
+    """
+    Resolución más gruesa (segundos; 0 = puntos crudos) cuya cubeta no supera
+    el ancho de punto pedido y que todavía conserva datos desde `start`.
+    Si ninguna alcanza ese detalle se usa la más fina que cubre `start`.
+    """
+    width = (end - start).total_seconds() / points
+    levels = [('raw', 0), *RESOLUTIONS.items()]
+    retained = [
+        resolution for level, resolution in levels
+        if cutoff(level, now) is None or cutoff(level, now) <= start
+    ]
+    fitting = [resolution for resolution in retained if resolution <= width]
+    return max(fitting) if fitting else min(retained or [DAY])
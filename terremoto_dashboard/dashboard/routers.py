@@ -0,0 +1,34 @@
+"""
+Ruteo de consultas entre la conexión de escritura ('default') y la de solo
+lectura (DASHBOARD_READ_ALIAS, por defecto 'replica').
+
+Con SQLite en modo WAL los lectores no bloquean al escritor ni entre sí, pero
+una conexión que escribe sí serializa a quien comparta esa conexión: las
+lecturas de la API van por su propia conexión (con PRAGMA query_only) y las
+escrituras por 'default'. Dentro de una transacción de 'default' las lecturas
+se quedan en 'default' para ver lo que la propia transacción escribió.
+"""
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+def read_alias():
+    alias = getattr(settings, 'DASHBOARD_READ_ALIAS', 'replica')
+    return alias if alias in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # las dos conexiones apuntan a la misma base
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
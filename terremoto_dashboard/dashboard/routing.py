@@ -0,0 +1,6 @@
+from django.urls import re_path
+from . import consumers
+
+websocket_urlpatterns = [
+    re_path(r'^ws/incidents/(?P<incident_id>\d+)/$', consumers.IncidentConsumer.as_asgi()),
+]
@@ -0,0 +1,285 @@
+"""
+Escenarios de incidente y su carga en la base.
+
+`enunciado()` describe el terremoto de Las Malvinas (San Rafael) tal como lo
+plantea el enunciado; `generate()` arma escenarios sintéticos del tamaño que se
+pida, reproducibles a partir de una semilla, para dimensionar la API. `load()`
+guarda cualquiera de los dos en un incidente, en una única transacción y con
+operaciones por lote.
+"""
+import datetime
+import math
+import random
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import EPICENTER, IncidentSummary, Bridge, Hospital, Shelter, ServiceStatus, MetricPoint
+from . import changes, rollups
+from .ingest import insert_points
+
+BATCH_SIZE = 1000
+SERIES = ('fatalities', 'injured_severe', 'injured_mild', 'hospital_operational_pct')
+# nota (o prefijo "escenario: ...") de los MetricPoint que escribe load(): al
+# recargar se reemplazan solo esos, no lo observado en las mismas series
+SCENARIO_NOTE = 'escenario'
+
+RESOURCE_FIELDS = {
+    Bridge: ('lat', 'lng', 'status', 'notes'),
+    Hospital: ('lat', 'lng', 'total_beds', 'available_beds', 'operational'),
+    Shelter: ('lat', 'lng', 'capacity', 'occupants'),
+    ServiceStatus: ('status', 'note'),
+}
+
+
+def enunciado():
+    # Datos tomados textualmente del enunciado del usuario
+    summary = dict(
+        population=3500,
+        affected_pct_min=0.25,
+        affected_pct_max=0.35,
+        shelter_needed_min=800,
+        shelter_needed_max=900,
+        hospital_operational_pct=0.40,  # 40% operativa inicial departamental
+        fatalities=80,  # fallecidos proyectados (en 72h)
+        injured_severe_min=60,
+        injured_severe_max=80,
+        injured_mild_min=800,
+        injured_mild_max=900,
+    )
+    # Puentes principales derribados (RP179 y RP175). Uso epicentro cercano y posiciones relativas aproximadas.
+    # Si tenés coords exactas de cada puente, reemplazalas aquí.
+    bridges = [
+        dict(name='Puente RP179', lat=-35.0215, lng=-69.3250, status='derribado', notes='Puente principal derribado según enunciado'),
+        dict(name='Puente RP175', lat=-35.0180, lng=-69.3200, status='derribado', notes='Segundo puente derribado — acceso estratégico interrumpido'),
+    ]
+    # Hospitals: en el enunciado se menciona saturación departamental y 40% operativa.
+    # Creo dos hospitales representativos: el regional departamental (fuera del pueblo) y uno local afectado.
+    hospitals = [
+        dict(name='Hospital Regional San Rafael', lat=-34.616, lng=-68.333, total_beds=200, available_beds=int(200 * (0.40)), operational=True),
+        dict(name='Hospital Local Las Malvinas', lat=-35.022, lng=-69.3235, total_beds=30, available_beds=int(30 * 0.10), operational=False),
+    ]
+    # Shelters: el enunciado menciona 800-900 que necesitan albergue. Crear refugios con capacidad.
+    shelters = [
+        dict(name='Polideportivo Las Malvinas', lat=-35.0195, lng=-69.3245, capacity=350, occupants=350),
+        dict(name='Escuela Principal Las Malvinas', lat=-35.0230, lng=-69.3210, capacity=300, occupants=300),
+        dict(name='Refugio Provisorio - Plaza Central', lat=-35.0200, lng=-69.3230, capacity=300, occupants=150),
+    ]
+    # Energía, agua, comunicaciones, radio local y clima (como ServiceStatus 'Clima' con la nota de -3°C nocturno)
+    services = [
+        dict(name='Electricidad', status='Corte total', note='100% sin suministro; postes y transformadores dañados'),
+        dict(name='Agua', status='Cortes y baja presión (20-35%)', note='Rotura de matrices principales, riesgo de contaminación'),
+        dict(name='Comunicaciones móviles', status='Sin telefonía móvil ni internet', note='Operadores no disponibles; VHF/UHF como respaldo'),
+        dict(name='Radio local', status='Activa', note='Canal principal de información a la comunidad'),
+        dict(name='Clima (noches)', status='Frío -3°C nocturno', note='Riesgo de hipotermia; demanda de calefacción y energía crítica'),
+    ]
+    return {
+        "summary": summary,
+        "bridges": bridges,
+        "hospitals": hospitals,
+        "shelters": shelters,
+        "services": services,
+        "metrics": _enunciado_metrics(summary),
+    }
+
+
+def _enunciado_metrics(summary):
+    """Serie temporal representativa (0h, 12h, 24h, 48h, 72h)."""
+    base_fatalities = summary['fatalities']  # 80 proyectados en 72h; distribuyo hacia atrás suponiendo crecimiento
+    base_severe = int((summary['injured_severe_min'] + summary['injured_severe_max']) / 2)
+    base_mild = int((summary['injured_mild_min'] + summary['injured_mild_max']) / 2)
+    # Progresión: 0h -> 60% del total proyectado; 12h -> 70%; 24h -> 85%; 48h -> 95%; 72h -> 100%
+    # Hospital operativo (convertido a %), baja progresiva: 40%, 36%, 30%, 20%, 15%
+    timeline = [
+        (0, 0.60, 40),
+        (12, 0.70, 36),
+        (24, 0.85, 30),
+        (48, 0.95, 20),
+        (72, 1.00, 15),
+    ]
+    now = timezone.now()
+    for hours, frac, hosp_pct in timeline:
+        ts = now - datetime.timedelta(hours=(72 - hours))  # timeline hacia atrás desde ahora (72h total)
+        yield (ts, 'fatalities', int(round(base_fatalities * frac)), f'{hours}h desde evento (estimación)')
+        # Heridos graves y leves: rango medio con crecimiento suave
+        yield (ts, 'injured_severe', int(round(base_severe * (1 + 0.1 * (hours / 24)))), f'{hours}h desde evento')
+        yield (ts, 'injured_mild', int(round(base_mild * (1 + 0.06 * (hours / 24)))), f'{hours}h desde evento')
+        yield (ts, 'hospital_operational_pct', hosp_pct, f'{hours}h desde evento')
+
+
+def _scatter(rng, count):
+    """Posiciones alrededor del epicentro; el radio crece con la cantidad de recursos."""
+    spread = min(3.0, 0.02 * math.sqrt(max(count, 1)))
+    for _ in range(count):
+        yield (round(EPICENTER['lat'] + rng.uniform(-spread, spread), 6),
+               round(EPICENTER['lng'] + rng.uniform(-spread, spread), 6))
+
+
+def generate(seed=0, shelters=300, hospitals=60, bridges=150, metric_points=100_000, hours=72):
+    """
+    Escenario sintético reproducible. Los MetricPoint se generan a medida que
+    se insertan, así que `metric_points` puede ser de millones.
+    """
+    rng = random.Random(seed)
+    shelter_rows = []
+    for i, (lat, lng) in enumerate(_scatter(rng, shelters), start=1):
+        capacity = rng.randint(50, 600)
+        shelter_rows.append(dict(name=f'Refugio {i:05d}', lat=lat, lng=lng, capacity=capacity,
+                                 occupants=rng.randint(0, capacity)))
+    hospital_rows = []
+    for i, (lat, lng) in enumerate(_scatter(rng, hospitals), start=1):
+        total = rng.randint(20, 400)
+        hospital_rows.append(dict(name=f'Hospital {i:05d}', lat=lat, lng=lng, total_beds=total,
+                                  available_beds=rng.randint(0, total), operational=rng.random() > 0.3))
+    statuses = ('derribado', 'parcialmente', 'ok')
+    bridge_rows = [
+        dict(name=f'Puente {i:05d}', lat=lat, lng=lng, status=rng.choices(statuses, weights=(2, 3, 5))[0], notes='')
+        for i, (lat, lng) in enumerate(_scatter(rng, bridges), start=1)
+    ]
+    capacity = sum(row['capacity'] for row in shelter_rows)
+    population = max(3500, int(capacity / 0.25))
+    summary = dict(
+        population=population,
+        affected_pct_min=0.25,
+        affected_pct_max=0.35,
+        shelter_needed_min=int(population * 0.23),
+        shelter_needed_max=int(population * 0.26),
+        hospital_operational_pct=round(sum(h['operational'] for h in hospital_rows) / max(len(hospital_rows), 1), 2),
+        fatalities=int(population * 0.023),
+        injured_severe_min=int(population * 0.017),
+        injured_severe_max=int(population * 0.023),
+        injured_mild_min=int(population * 0.23),
+        injured_mild_max=int(population * 0.26),
+    )
+    services = enunciado()['services']
+    return {
+        "summary": summary,
+        "bridges": bridge_rows,
+        "hospitals": hospital_rows,
+        "shelters": shelter_rows,
+        "services": services,
+        "metrics": _generated_metrics(rng, summary, metric_points, hours),
+    }
+
+
+def _generated_metrics(rng, summary, total, hours):
+    # exactamente `total` puntos (0 incluido): el último instante puede quedar con parte de las series
+    steps = -(-total // len(SERIES))
+    now = timezone.now()
+    start = now - datetime.timedelta(hours=hours)
+    step = datetime.timedelta(hours=hours) / max(steps - 1, 1)
+    severe = (summary['injured_severe_min'] + summary['injured_severe_max']) / 2
+    mild = (summary['injured_mild_min'] + summary['injured_mild_max']) / 2
+    hospital = summary['hospital_operational_pct'] * 100
+    for i in range(steps):
+        progress = i / max(steps - 1, 1)
+        ts = start + step * i
+        noise = rng.gauss(0, 0.01)
+        yield from (
+            (ts, 'fatalities', round(summary['fatalities'] * (0.6 + 0.4 * progress) * (1 + noise), 2), ''),
+            (ts, 'injured_severe', round(severe * (1 + 0.3 * progress) * (1 + noise), 2), ''),
+            (ts, 'injured_mild', round(mild * (1 + 0.18 * progress) * (1 + noise), 2), ''),
+            (ts, 'hospital_operational_pct', round(max(5.0, hospital * (1 - 0.6 * progress)), 2), ''),
+        )[:total - i * len(SERIES)]
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def upsert_by_name(incident_id, model, rows):
+    """
+    Crea o actualiza por nombre dentro del incidente con bulk_create/bulk_update.
+    Solo se actualizan las filas que cambiaron. Devuelve (creados, actualizados).
+    """
+    fields = RESOURCE_FIELDS[model]
+    existing = {}
+    for names in _chunks([row['name'] for row in rows], 500):
+        for obj in model.objects.filter(incident_id=incident_id, name__in=names):
+            existing.setdefault(obj.name, obj)
+    to_create, to_update = [], []
+    for row in rows:
+        obj = existing.get(row['name'])
+        if obj is None:
+            to_create.append(model(incident_id=incident_id, **row))
+        elif any(getattr(obj, field) != row[field] for field in fields):
+            for field in fields:
+                setattr(obj, field, row[field])
+            to_update.append(obj)
+    update_fields = list(fields)
+    if hasattr(model, 'update_cell'):
+        # bulk_create/bulk_update no pasan por save(): la celda se calcula acá
+        for obj in to_create + to_update:
+            obj.update_cell()
+        update_fields.append('cell')
+    if model is ServiceStatus:
+        # bulk_update no aplica auto_now
+        now = timezone.now()
+        for obj in to_update:
+            obj.updated_at = now
+        update_fields.append('updated_at')
+    model.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+    model.objects.bulk_update(to_update, update_fields, batch_size=BATCH_SIZE)
+    # bulk_create/bulk_update no disparan señales: se registran a mano
+    changes.record(incident_id, model, [obj.pk for obj in to_create + to_update])
+    return len(to_create), len(to_update)
+
+
+def _scenario_note(note):
+    return f'{SCENARIO_NOTE}: {note}' if note else SCENARIO_NOTE
+
+
+def scenario_points(incident_id):
+    """MetricPoint del incidente que escribió load() (ver SCENARIO_NOTE)."""
+    return MetricPoint.objects.filter(
+        Q(note=SCENARIO_NOTE) | Q(note__startswith=f'{SCENARIO_NOTE}: '), incident_id=incident_id, metric__in=SERIES,
+    )
+
+
+def load(scenario, incident_id=None, new=False, name=''):
+    """
+    Guarda un escenario en un incidente, en una única transacción: el indicado
+    por `incident_id`, uno nuevo con `new=True`, o si no el más reciente (que
+    se crea si no hay ninguno). Los recursos se cruzan por nombre dentro del
+    incidente y los puntos de las series que cargó un load() anterior se
+    reemplazan; los observados (ingesta, proyecciones) quedan.
+    Devuelve un dict con las cantidades escritas y el id del incidente.
+    """
+    counts = {}
+    with transaction.atomic():
+        if new:
+            summary = None
+        elif incident_id is not None:
+            summary = IncidentSummary.objects.get(pk=incident_id)
+        else:
+            summary = IncidentSummary.objects.order_by('-created_at').first()
+        if summary is None:
+            summary = IncidentSummary.objects.create(name=name, **scenario['summary'])
+            counts['summary'] = 'creado'
+        else:
+            for field, value in scenario['summary'].items():
+                setattr(summary, field, value)
+            if name:
+                summary.name = name
+            summary.save()
+            counts['summary'] = 'actualizado'
+        counts['incident'] = incident_id = summary.pk
+
+        for key, model in (('bridges', Bridge), ('hospitals', Hospital), ('shelters', Shelter), ('services', ServiceStatus)):
+            counts[key] = upsert_by_name(incident_id, model, scenario[key])
+
+        # Vaciamos los puntos del escenario anterior para no duplicar
+        rollups.delete_points(scenario_points(incident_id))
+        inserted = 0
+        batch = []
+        for ts, metric, value, note in scenario['metrics']:
+            batch.append((ts, metric, value, _scenario_note(note)))
+            if len(batch) >= 10_000:
+                insert_points(incident_id, batch)
+                inserted += len(batch)
+                batch = []
+        insert_points(incident_id, batch)
+        counts['metrics'] = inserted + len(batch)
+    return counts
@@ -0,0 +1,204 @@
+"""
+Serialización de los payloads de la API sin pasar por instancias de modelo.
+
+  - rows(): los mismos dicts que Model.to_dict(), pero desde values_list() y
+    con los campos derivados (occupancy_pct, fechas ISO 8601) calculados en la
+    consulta.
+  - dumps(): orjson si está instalado; si no, json con un encoder que da el
+    mismo resultado.
+  - json_response() / stream_series(): respuestas con ese encoder; las series
+    completas se emiten por bloques con StreamingHttpResponse para que la
+    memoria no dependa de la cantidad de puntos.
+  - columnar_payload() / binary_payload(): formatos alternativos de las series
+    de /api/metrics/ (format=columnar|binary o por Accept), una columna por
+    campo en lugar de un objeto por punto. Las columnas salen ya armadas de
+    timeseries (raw_columns(), query_series(columnar=True)).
+
+Formato binario (little-endian, todo alineado a 8 bytes para poder leer las
+columnas con Float64Array sin copiar):
+  cabecera:   b'MSR1', uint8 flags, 3 bytes en 0, uint32 cantidad de métricas, 4 bytes en 0
+              flags: 1 = t codificado en deltas, 2 = cubetas (columnas min, max, count)
+  por métrica: uint32 n, uint32 largo del nombre, nombre UTF-8 completado con
+              ceros hasta múltiplo de 8, y las columnas float64 de n valores:
+              t (ms desde epoch), v[, min, max, count]
+"""
+import datetime
+import decimal
+import json
+import struct
+
+import numpy as np
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Round
+from django.http import HttpResponse, StreamingHttpResponse
+
+from . import perf
+from .models import Bridge, Hospital, ServiceStatus, Shelter
+from .timeseries import IsoTimestamp
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson es opcional
+    orjson = None
+
+STREAM_CHUNK_ROWS = 5000
+
+
+def _default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} no es serializable a JSON")
+
+
+def dumps(data):
+    """JSON compacto en bytes."""
+    with perf.span('serialize'):
+        if orjson is not None:
+            return orjson.dumps(data, default=_default)
+        return json.dumps(data, default=_default, separators=(',', ':')).encode()
+
+
+def json_response(data, status=200):
+    return HttpResponse(dumps(data), status=status, content_type='application/json')
+
+
+def _occupancy(used, total):
+    """Igual que occupancy_pct(): porcentaje con un decimal, 0 si no hay capacidad."""
+    return Case(
+        When(**{total: 0}, then=Value(0.0)),
+        default=Round(used * 100.0 / F(total), 1),
+        output_field=FloatField(),
+    )
+
+
+# modelo -> (campos, anotaciones); el orden de las claves es el de to_dict()
+FIELDS = {
+    Bridge: (('id', 'name', 'lat', 'lng', 'status', 'notes'), {}),
+    Hospital: (
+        ('id', 'name', 'lat', 'lng', 'total_beds', 'available_beds', 'operational'),
+        {'occupancy_pct': _occupancy(F('total_beds') - F('available_beds'), 'total_beds')},
+    ),
+    Shelter: (
+        ('id', 'name', 'lat', 'lng', 'capacity', 'occupants'),
+        {'occupancy_pct': _occupancy(F('occupants'), 'capacity')},
+    ),
+    ServiceStatus: (('id', 'name', 'status', 'note'), {'updated_at': IsoTimestamp('updated_at')}),
+}
+
+
+def rows(qs):
+    """Filas de `qs` como dicts, sin instanciar modelos."""
+    fields, annotations = FIELDS[qs.model]
+    keys = (*fields, *annotations)
+    # con otro nombre: una anotación no puede llamarse como un campo (updated_at)
+    computed = {f'out_{name}': expression for name, expression in annotations.items()}
+    values = qs.annotate(**computed).values_list(*fields, *computed)
+    return [dict(zip(keys, row)) for row in values]
+
+
+def _encoded_points(points):
+    # [{"timestamp": ..., "value": ...}, ...] sin los corchetes
+    return dumps([{"timestamp": ts, "value": value} for ts, value in points])[1:-1]
+
+
+def stream_series(series_rows, chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Genera el JSON {"metric": [{timestamp, value}, ...], ...} por bloques a
+    partir de tuplas (metric, timestamp ISO, value) ordenadas por métrica.
+    """
+    yield b'{'
+    current, points, started = None, [], False
+    for metric, ts, value in series_rows:
+        if metric != current:
+            if points:
+                yield (b',' if started else b'') + _encoded_points(points)
+            if current is not None:
+                yield b'],'
+            yield dumps(metric) + b':['
+            current, points, started = metric, [], False
+        points.append((ts, value))
+        if len(points) >= chunk_rows:
+            yield (b',' if started else b'') + _encoded_points(points)
+            points, started = [], True
+    if points:
+        yield (b',' if started else b'') + _encoded_points(points)
+    if current is not None:
+        yield b']'
+    yield b'}'
+
+
+def streaming_series_response(series_rows):
+    return StreamingHttpResponse(stream_series(series_rows), content_type='application/json')
+
+
+# formato -> Content-Type
+SERIES_FORMATS = {
+    'json': 'application/json',
+    'columnar': 'application/vnd.dashboard.columnar+json',
+    'binary': 'application/vnd.dashboard.series',
+}
+BINARY_MAGIC = b'MSR1'
+FLAG_DELTA, FLAG_BUCKETS = 1, 2
+BUCKET_COLUMNS = ('min', 'max', 'count')
+
+
+def negotiate(request):
+    """Formato pedido para las series: ?format=..., o el Accept; por defecto 'json'."""
+    fmt = request.GET.get('format')
+    if fmt:
+        if fmt not in SERIES_FORMATS:
+            raise ValueError(f"format debe ser uno de: {', '.join(SERIES_FORMATS)}")
+        return fmt
+    accept = request.headers.get('Accept', '')
+    for fmt, content_type in SERIES_FORMATS.items():
+        if fmt != 'json' and content_type in accept:
+            return fmt
+    return 'json'
+
+
+def _time_column(t, delta):
+    return np.diff(t, prepend=0.0) if delta else t
+
+
+def columnar_payload(columns, delta=False):
+    """
+    {"format": "columnar", "delta": bool, "series": {metric: {"t": [...], "v": [...]}}}
+    con t en ms enteros (en deltas respecto del anterior si delta=True).
+    """
+    series = {}
+    for metric, data in columns.items():
+        series[metric] = {
+            name: (_time_column(values, delta).astype(np.int64) if name == 't' else values).tolist()
+            for name, values in data.items()
+        }
+    return {"format": "columnar", "delta": delta, "series": series}
+
+
+def _padded(raw):
+    return raw + b'\0' * (-len(raw) % 8)
+
+
+def binary_payload(columns, delta=False):
+    buckets = any('count' in data for data in columns.values())
+    flags = (FLAG_DELTA if delta else 0) | (FLAG_BUCKETS if buckets else 0)
+    parts = [BINARY_MAGIC, struct.pack('<B3xI4x', flags, len(columns))]
+    for metric, data in columns.items():
+        name = metric.encode()
+        parts.append(struct.pack('<II', len(data['t']), len(name)))
+        parts.append(_padded(name))
+        names = ('t', 'v', *BUCKET_COLUMNS) if buckets else ('t', 'v')
+        for column in names:
+            values = _time_column(data['t'], delta) if column == 't' else data.get(column, np.zeros(len(data['t'])))
+            parts.append(np.ascontiguousarray(values, dtype='<f8').tobytes())
+    return b''.join(parts)
+
+
+def series_response(columns, fmt, delta=False):
+    with perf.span('serialize'):
+        if fmt == 'binary':
+            body = binary_payload(columns, delta)
+        else:
+            body = dumps(columnar_payload(columns, delta))
+    return HttpResponse(body, content_type=SERIES_FORMATS[fmt])
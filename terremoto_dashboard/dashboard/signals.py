@@ -0,0 +1,60 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete
+
+from . import changes, incidents, perf, rollups
+from .models import IncidentSummary, MetricPoint
+
+
+def _incident_id(sender, instance):
+    return instance.pk if sender is IncidentSummary else instance.incident_id
+
+
+def record_save(sender, instance, **kwargs):
+    changes.record(_incident_id(sender, instance), sender, [instance.pk],
+                   values={instance.pk: changes.values_of(instance)})
+
+
+def record_delete(sender, instance, origin=None, **kwargs):
+    # al borrar un incidente sus recursos se borran en cascada junto con su
+    # feed de cambios: no hay a quién avisar
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if sender is IncidentSummary or origin_model is IncidentSummary:
+        return
+    changes.record(instance.incident_id, sender, [instance.pk], deleted=True)
+
+
+# modelos que forman parte del payload de /api/summary/ y del feed de deltas
+for _model in changes.TRACKED.values():
+    post_save.connect(record_save, sender=_model, dispatch_uid=f'changes-save-{_model.__name__}')
+    post_delete.connect(record_delete, sender=_model, dispatch_uid=f'changes-delete-{_model.__name__}')
+
+
+def incident_created(sender, instance, created, **kwargs):
+    # cambia cuál es el incidente actual (ver incidents.py); se invalida ya y
+    # de nuevo al confirmar, por si otro request lo resolvió en el medio
+    if created:
+        incidents.forget()
+        transaction.on_commit(incidents.forget)
+
+
+def incident_deleted(sender, instance, **kwargs):
+    incidents.forget(instance.pk)
+
+
+post_save.connect(incident_created, sender=IncidentSummary, dispatch_uid='incidents-save')
+post_delete.connect(incident_deleted, sender=IncidentSummary, dispatch_uid='incidents-delete')
+
+
+def rollup_point(sender, instance, created, **kwargs):
+    # la ingesta masiva (ingest.insert_points) suma sus lotes por su cuenta
+    if created:
+        rollups.add_points(instance.incident_id, [(instance.timestamp, instance.metric, instance.value, instance.note)])
+
+
+post_save.connect(rollup_point, sender=MetricPoint, dispatch_uid='rollups-save-MetricPoint')
+
+
+# medición de consultas por request (ver perf.py), en cada conexión de cada hilo
+connection_created.connect(perf.install, dispatch_uid='perf-install')
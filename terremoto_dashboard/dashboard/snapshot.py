@@ -0,0 +1,93 @@
+"""
+Snapshot versionado del payload de /api/summary/, uno por incidente.
+
+La version vive en un cache compartido entre procesos (runserver, workers y
+comandos de manage.py) y se incrementa cada vez que cambia un modelo del
+incidente que forma parte del resumen. El payload ya serializado se guarda en
+memoria de cada proceso junto con la version con la que se construyó: mientras
+la version no cambie, los polls se responden sin tocar la base de datos.
+"""
+import threading
+import time
+
+from django.core.cache import caches
+
+from . import incidents
+
+_lock = threading.Lock()
+_snapshots = {}  # incidente -> (version, payload_bytes)
+
+
+def _cache():
+    return caches['dashboard']
+
+
+def _now_us():
+    return time.time_ns() // 1000
+
+
+def _version_key(incident_id):
+    return f'dashboard:summary:{incident_id}:version'
+
+
+def get_version(incident_id):
+    """Version actual del resumen del incidente (microsegundos desde epoch de la última modificación)."""
+    key = _version_key(incident_id)
+    version = _cache().get(key)
+    if version is None:
+        # cache vacío (primer arranque o cache borrado): arrancamos desde "ahora"
+        # para que la version siga siendo creciente respecto de ETags ya emitidos
+        _cache().add(key, _now_us(), timeout=None)
+        version = _cache().get(key)
+    return version
+
+
+def bump_version(incident_id):
+    """Invalida el snapshot del incidente. Siempre devuelve una version mayor que la anterior."""
+    key = _version_key(incident_id)
+    previous = _cache().get(key) or 0
+    version = max(previous + 1, _now_us())
+    _cache().set(key, version, timeout=None)
+    return version
+
+
+def resolve_version(incident_id=None):
+    """(id del incidente, version de su resumen); Http404 si no existe."""
+    incident_id = incidents.resolve_or_404(incident_id)
+    return incident_id, get_version(incident_id)
+
+
+def validators(incident_id, version):
+    """(ETag, Last-Modified en segundos) de una version, para get_conditional_response."""
+    return f'"summary-{incident_id}-{version}"', version // 1_000_000
+
+
+def _store(incident_id, version, payload):
+    with _lock:
+        current = _snapshots.get(incident_id)
+        # una reconstrucción más lenta de una version anterior no pisa la nueva
+        if current is None or current[0] <= version:
+            _snapshots[incident_id] = (version, payload)
+    return version, payload
+
+
+async def aget_summary_snapshot(incident_id, version, build):
+    """
+    Devuelve (version, payload_bytes). La corrutina `build(incident_id)`, que
+    devuelve el payload ya serializado, se espera solo si el snapshot del
+    proceso no corresponde a `version`. La version se lee antes de construir:
+    si alguien la incrementa mientras tanto, el próximo poll vuelve a
+    construir. Dos requests que encuentran el mismo snapshot viejo pueden
+    construirlo los dos; se queda el de version mayor.
+    """
+    current = _snapshots.get(incident_id)
+    if current is not None and current[0] == version:
+        return current
+    return _store(incident_id, version, await build(incident_id))
+
+
+def clear_local_snapshot(incident_id=None):
+    if incident_id is None:
+        _snapshots.clear()
+    else:
+        _snapshots.pop(incident_id, None)
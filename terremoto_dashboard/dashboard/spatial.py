@@ -0,0 +1,103 @@
+"""
+Índice espacial simple por grilla.
+
+Cada recurso con lat/lng guarda en `cell` el número de celda de una grilla
+regular de CELL_DEGREES grados (~1,1 km). Una consulta por bbox se traduce en
+un rango contiguo de celdas por cada fila de la grilla, que la base resuelve con
+el índice sobre `cell`; después se filtra por lat/lng exactos.
+"""
+import math
+
+from django.db.models import Q
+
+CELL_DEGREES = 0.01
+COLUMNS = int(round(360 / CELL_DEGREES))
+# por encima de esta cantidad de filas se usa una sola banda de celdas
+MAX_ROW_RANGES = 64
+EARTH_RADIUS_M = 6_371_008.8
+
+
+class BBoxError(ValueError):
+    """bbox/near mal formados."""
+
+
+def _row(lat):
+    return int(math.floor((min(max(lat, -90.0), 90.0) + 90.0) / CELL_DEGREES))
+
+
+def _col(lng):
+    return min(int(math.floor((min(max(lng, -180.0), 180.0) + 180.0) / CELL_DEGREES)), COLUMNS - 1)
+
+
+def cell_for(lat, lng):
+    return _row(lat) * COLUMNS + _col(lng)
+
+
+def cell_ranges(south, west, north, east):
+    """Rangos (desde, hasta) de celdas que cubren el bbox."""
+    r0, r1 = _row(south), _row(north)
+    c0, c1 = _col(west), _col(east)
+    if r1 - r0 + 1 > MAX_ROW_RANGES:
+        return [(r0 * COLUMNS, r1 * COLUMNS + COLUMNS - 1)]
+    return [(row * COLUMNS + c0, row * COLUMNS + c1) for row in range(r0, r1 + 1)]
+
+
+def filter_bbox(qs, south, west, north, east):
+    cells = Q()
+    for low, high in cell_ranges(south, west, north, east):
+        cells |= Q(cell__range=(low, high))
+    return qs.filter(cells, lat__range=(south, north), lng__range=(west, east))
+
+
+def contains(south, west, north, east, lat, lng):
+    """Lo mismo que filter_bbox() para un punto ya leído."""
+    return south <= lat <= north and west <= lng <= east
+
+
+def parse_bbox(raw):
+    """'west,south,east,north' (formato de L.LatLngBounds.toBBoxString())."""
+    try:
+        west, south, east, north = (float(part) for part in raw.split(','))
+    except ValueError:
+        raise BBoxError("bbox debe ser 'oeste,sur,este,norte'")
+    if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+        raise BBoxError("bbox fuera de rango o invertido")
+    return south, west, north, east
+
+
+def parse_point(raw):
+    """'lat,lng' -> (lat, lng)."""
+    try:
+        lat, lng = (float(part) for part in raw.split(','))
+    except (AttributeError, ValueError):
+        raise BBoxError("se esperaba un punto 'lat,lng'")
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise BBoxError("punto fuera de rango")
+    return lat, lng
+
+
+def parse_near(raw, radius):
+    lat, lng = parse_point(raw)
+    try:
+        radius = float(radius)
+    except (TypeError, ValueError):
+        raise BBoxError("radius debe ser un número de metros")
+    if not math.isfinite(radius) or radius <= 0:
+        raise BBoxError("radius debe ser un número positivo de metros")
+    return lat, lng, radius
+
+
+def bbox_around(lat, lng, radius_m):
+    """bbox (sur, oeste, norte, este) que contiene el círculo de radio `radius_m`."""
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    coslat = max(math.cos(math.radians(lat)), 1e-6)
+    dlng = min(math.degrees(radius_m / (EARTH_RADIUS_M * coslat)), 180.0)
+    return max(lat - dlat, -90.0), max(lng - dlng, -180.0), min(lat + dlat, 90.0), min(lng + dlng, 180.0)
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
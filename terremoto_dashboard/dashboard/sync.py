@@ -0,0 +1,451 @@
+"""
+Paquetes de sincronización entre nodos sin conectividad.
+
+Cada puesto de campo corre su propia copia del dashboard y los nodos se pasan
+paquetes por enlaces lentos o por USB. Un paquete lleva, para un incidente,
+lo que cambió desde el cursor (el del feed de deltas, ver changes.py) que el
+otro nodo ya tiene:
+
+- el resumen y los recursos modificados, identificados por nombre (los ids
+  son locales de cada nodo) y con la versión de su último cambio: el momento
+  en que se hizo y el nodo donde se hizo;
+- los MetricPoint nuevos, agrupados por métrica, con los timestamps en
+  microsegundos y codificados como diferencias.
+
+Conflictos: gana la versión más nueva y, a igual momento, la del nodo de id
+mayor. La regla no depende del orden en que llegan los paquetes, así que los
+nodos convergen; una edición local posterior a un cambio importado le gana
+aunque los relojes estén desfasados (ver _versions()). Los puntos son hechos:
+se agregan los que no estén (misma métrica, timestamp y valor). Las bajas no
+viajan: el recurso borrado ya no tiene nombre con el cual cruzarlo.
+
+Formato: MAGIC, el id del nodo de origen, la firma (HMAC-SHA256 en hex del id
+y el cuerpo) y el cuerpo, JSON comprimido con xz. Cada par de nodos comparte una
+clave (DASHBOARD_SYNC_KEYS, por nodo del otro lado): el paquete se firma con
+la del destino y la importación lo verifica con la del origen antes de
+descomprimir (con un tope de tamaño, MAX_PAYLOAD_BYTES). Después aplica todo
+en una transacción, con operaciones por lote.
+
+Cada paquete dirigido a un nodo trae además el cursor de ese nodo hasta el
+que ya importamos ("ack"): el próximo export hacia él arranca desde ahí, así
+que un paquete perdido se vuelve a mandar solo. Lo que vino de un nodo no se
+le devuelve (rangos `echo` de SyncPeer y `origin` de ResourceChange).
+"""
+import datetime
+import hashlib
+import hmac
+import json
+import lzma
+import socket
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+
+from . import changes, incidents
+from .ingest import insert_points
+from .models import IncidentSummary, MetricPoint, ResourceChange, ServiceStatus, SyncPeer
+from .scenario import BATCH_SIZE, RESOURCE_FIELDS, _chunks
+
+MAGIC = b'TDSYNC2\n'
+FORMAT = 1
+MAX_NODE_LENGTH = 255
+# tope del JSON descomprimido: un paquete completo de un incidente grande ronda las decenas de MB
+MAX_PAYLOAD_BYTES = 512 * 1024 * 1024
+CONTENT_TYPE = 'application/vnd.terremoto-sync'
+SUMMARY_FIELDS = tuple(
+    field.name for field in IncidentSummary._meta.concrete_fields if field.name not in ('id', 'uid', 'created_at')
+)
+RESOURCES = {key: model for key, model in changes.TRACKED.items() if key != 'summary'}
+
+UTC = datetime.timezone.utc
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=UTC)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+class SyncError(ValueError):
+    """Paquete inválido, dañado o fuera de orden."""
+
+
+def node_id():
+    """Id de este nodo en los paquetes (DASHBOARD_NODE_ID, o el nombre del host)."""
+    return getattr(settings, 'DASHBOARD_NODE_ID', None) or socket.gethostname()
+
+
+def _to_us(ts):
+    return (ts - EPOCH) // MICROSECOND
+
+
+def _from_us(us):
+    return EPOCH + us * MICROSECOND
+
+
+def _behind(a, b):
+    """True si al cursor `a` le falta algo que `b` ya incluye."""
+    return any(x < y for x, y in zip(changes.parse_cursor(a), changes.parse_cursor(b)))
+
+
+def _later(a, b):
+    """Máximo componente a componente de dos cursores."""
+    return changes.format_cursor(*(max(x, y) for x, y in zip(changes.parse_cursor(a), changes.parse_cursor(b))))
+
+
+def _versions(incident_id, key, pks):
+    """
+    {pk: (momento en µs, nodo)} del último cambio de cada objeto.
+
+    Si el último cambio es local pero un cambio importado anterior tiene un
+    momento mayor (el reloj del otro nodo adelanta), la versión pasa a ser ese
+    momento más la distancia en ids entre los dos cambios: en este nodo la
+    edición ocurrió después y tiene que ganar también en los demás.
+    """
+    here = node_id()
+    versions = {}
+    for chunk in _chunks(list(pks), 500):
+        newest = {}
+        for object_id, last, at in (
+            ResourceChange.objects.filter(incident_id=incident_id, model=key, object_id__in=chunk)
+            .values('object_id').annotate(last=Max('id'), newest=Max('created_at'))
+            .values_list('object_id', 'last', 'newest')
+        ):
+            newest[last] = at
+        for pk, object_id, at, origin in (
+            ResourceChange.objects.filter(id__in=list(newest)).values_list('id', 'object_id', 'created_at', 'origin')
+        ):
+            if not origin and at < newest[pk]:
+                imported = (
+                    ResourceChange.objects.filter(incident_id=incident_id, model=key, object_id=object_id,
+                                                  created_at=newest[pk])
+                    .aggregate(m=Max('id'))['m']
+                )
+                at = newest[pk] + (pk - imported) * MICROSECOND
+            versions[object_id] = (_to_us(at), origin or here)
+    return versions
+
+
+def shared_key(node):
+    """Clave compartida con `node` (DASHBOARD_SYNC_KEYS); SyncError si no hay."""
+    key = (getattr(settings, 'DASHBOARD_SYNC_KEYS', None) or {}).get(node)
+    if not key:
+        raise SyncError(f"no hay clave compartida con el nodo {node!r} (DASHBOARD_SYNC_KEYS)")
+    return key.encode() if isinstance(key, str) else key
+
+
+def _signature(key, node, body):
+    return hmac.new(key, node + b'\n' + body, hashlib.sha256).hexdigest().encode()
+
+
+def pack(payload, key):
+    """Paquete firmado con `key`, la clave compartida con el nodo destino."""
+    node = payload['node'].encode()
+    if len(node) > MAX_NODE_LENGTH or b'\n' in node:
+        raise SyncError(f"id de nodo inválido: {payload['node']!r}")
+    body = lzma.compress(json.dumps(payload, separators=(',', ':')).encode())
+    return MAGIC + node + b'\n' + _signature(key, node, body) + b'\n' + body
+
+
+def _decompress(body):
+    decompressor = lzma.LZMADecompressor()
+    try:
+        data = decompressor.decompress(body, max_length=MAX_PAYLOAD_BYTES + 1)
+    except lzma.LZMAError:
+        raise SyncError("no se pudo descomprimir el paquete")
+    if len(data) > MAX_PAYLOAD_BYTES:
+        raise SyncError(f"el paquete descomprimido supera {MAX_PAYLOAD_BYTES} bytes")
+    if not decompressor.eof:
+        raise SyncError("no se pudo descomprimir el paquete: está incompleto")
+    return data
+
+
+def unpack(bundle):
+    """Payload de un paquete, verificando su firma con la clave del nodo de origen."""
+    if not bundle.startswith(MAGIC):
+        raise SyncError("no es un paquete de sincronización")
+    end = bundle.find(b'\n', len(MAGIC), len(MAGIC) + MAX_NODE_LENGTH + 1)
+    if end < 0:
+        raise SyncError("paquete mal formado: falta el nodo de origen")
+    node = bundle[len(MAGIC):end]
+    digest, body = bundle[end + 1:end + 66], bundle[end + 66:]
+    try:
+        key = shared_key(node.decode())
+    except UnicodeDecodeError:
+        raise SyncError("paquete mal formado: nodo de origen inválido")
+    if not hmac.compare_digest(digest, _signature(key, node, body) + b'\n'):
+        raise SyncError("firma inválida: el paquete está incompleto, dañado o no viene de ese nodo")
+    data = _decompress(body)
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        raise SyncError("el contenido del paquete no es JSON")
+    if not isinstance(payload, dict) or payload.get('node') != node.decode():
+        raise SyncError("el nodo del paquete no coincide con el de la firma")
+    if payload.get('format') != FORMAT:
+        raise SyncError(f"formato de paquete {payload.get('format')!r} no soportado")
+    return payload
+
+
+def _encode_points(rows):
+    """Filas (metric, timestamp, value, note) ordenadas por métrica y timestamp."""
+    metrics = {}
+    last = {}
+    for metric, ts, value, note in rows:
+        series = metrics.get(metric)
+        if series is None:
+            series = metrics[metric] = {"t": [], "v": []}
+            last[metric] = 0
+        us = _to_us(ts)
+        series["t"].append(us - last[metric])
+        last[metric] = us
+        series["v"].append(value)
+        if note:
+            series.setdefault("note", {})[len(series["v"]) - 1] = note
+    return metrics
+
+
+def _decode_points(series):
+    """Tuplas (timestamp, value, note) de una serie de _encode_points()."""
+    points = []
+    us = 0
+    notes = series.get("note", {})
+    for i, (delta, value) in enumerate(zip(series["t"], series["v"])):
+        us += delta
+        points.append((_from_us(us), value, notes.get(str(i), '')))
+    return points
+
+
+def export(incident_id, peer=None, since=None):
+    """
+    Paquete para `peer` con lo del incidente posterior a `since`
+    ('<metric_id>.<change_id>'), firmado con la clave compartida con `peer`.
+    Sin `since` se usa lo que `peer` confirmó haber importado y, si no hay
+    nada confirmado, se exporta todo. Devuelve (paquete, info).
+    """
+    if not peer:
+        raise SyncError("hace falta el nodo destino: el paquete se firma con su clave")
+    secret = shared_key(peer)
+    incident = IncidentSummary.objects.get(pk=incident_id)
+    state = SyncPeer.objects.filter(node=peer, incident_id=incident_id).first() if peer else None
+    if since is None:
+        since = state.acked if state else changes.format_cursor(0, 0)
+    metric_id, change_id = changes.parse_cursor(since)
+    # el cursor se lee antes que los datos, igual que en changes.full_state()
+    top_metric, top_change = changes.current_cursor()
+    here = node_id()
+
+    changed = {}
+    for key, object_id in (
+        ResourceChange.objects.filter(incident_id=incident_id, id__gt=change_id, id__lte=top_change)
+        .values_list('model', 'object_id').distinct()
+    ):
+        changed.setdefault(key, set()).add(object_id)
+    resources = {}
+    for key, model in RESOURCES.items():
+        if key not in changed:
+            continue
+        versions = _versions(incident_id, key, changed[key])
+        fields = RESOURCE_FIELDS[model]
+        rows = []
+        for chunk in _chunks(sorted(changed[key]), 500):
+            for pk, name, *values in (
+                model.objects.filter(incident_id=incident_id, pk__in=chunk).values_list('pk', 'name', *fields)
+            ):
+                at, node = versions.get(pk, (0, here))
+                # lo que vino de `peer` ya lo tiene
+                if node != peer:
+                    rows.append([at, node, name, *values])
+        if rows:
+            resources[key] = {"fields": fields, "rows": rows}
+
+    summary_at, summary_node = _versions(incident_id, 'summary', [incident_id]).get(incident_id, (0, here))
+    points = MetricPoint.objects.filter(incident_id=incident_id, id__gt=metric_id, id__lte=top_metric)
+    for low, high in state.echo if state else ():
+        if high > metric_id:
+            points = points.exclude(id__range=(low, high))
+    metrics = _encode_points(
+        points.order_by('metric', 'timestamp', 'id').values_list('metric', 'timestamp', 'value', 'note')
+    )
+
+    cursor = changes.format_cursor(top_metric, top_change)
+    payload = {
+        "format": FORMAT,
+        "node": here,
+        "peer": peer,
+        "since": since,
+        "cursor": cursor,
+        "ack": state.received if state else None,
+        "incident": {"uid": str(incident.uid), "created_at": _to_us(incident.created_at)},
+        "summary": {
+            "version": [summary_at, summary_node],
+            "fields": {field: getattr(incident, field) for field in SUMMARY_FIELDS},
+        },
+        "resources": resources,
+        "metrics": metrics,
+    }
+    bundle = pack(payload, secret)
+    info = {
+        "incident": incident_id,
+        "since": since,
+        "cursor": cursor,
+        "resources": sum(len(r["rows"]) for r in resources.values()),
+        "points": sum(len(s["v"]) for s in metrics.values()),
+        "bytes": len(bundle),
+    }
+    return bundle, info
+
+
+def _wins(incoming, local):
+    return local is None or tuple(incoming) > tuple(local)
+
+
+def _record(incident_id, model, winners):
+    """winners: {pk: (momento en µs, nodo)}; los cambios se registran con su versión original."""
+    here = node_id()
+    by_origin = {}
+    for pk, (at, node) in winners.items():
+        by_origin.setdefault('' if node == here else node, {})[pk] = _from_us(at)
+    for origin, at in by_origin.items():
+        changes.record(incident_id, model, list(at), origin=origin, at=at)
+
+
+def _apply_incident(payload):
+    """El incidente del paquete (se crea si no existe) y si se aplicó su resumen."""
+    data, summary = payload['incident'], payload['summary']
+    version = tuple(summary['version'])
+    incident = IncidentSummary.objects.filter(uid=data['uid']).first()
+    if incident is None:
+        incident = IncidentSummary(uid=uuid.UUID(data['uid']), **summary['fields'])
+        # sin señales: el cambio se registra con la versión del nodo de origen
+        IncidentSummary.objects.bulk_create([incident])
+        # el actual es el creado más recientemente: un momento importado no puede
+        # ser posterior a la importación, o un reloj adelantado lo dejaría como actual
+        created_at = _from_us(data['created_at'])
+        if created_at < incident.created_at:
+            IncidentSummary.objects.filter(pk=incident.pk).update(created_at=created_at)
+        incidents.forget()
+        transaction.on_commit(incidents.forget)
+        _record(incident.pk, IncidentSummary, {incident.pk: version})
+        return incident, True
+    local = _versions(incident.pk, 'summary', [incident.pk]).get(incident.pk)
+    if not _wins(version, local):
+        return incident, False
+    IncidentSummary.objects.filter(pk=incident.pk).update(**summary['fields'])
+    _record(incident.pk, IncidentSummary, {incident.pk: version})
+    return incident, True
+
+
+def _apply_resources(incident_id, key, data):
+    """Aplica las filas que ganan; devuelve (creados, actualizados, descartados)."""
+    if key not in RESOURCES:
+        raise SyncError(f"recurso desconocido: {key}")
+    model = RESOURCES[key]
+    fields = RESOURCE_FIELDS[model]
+    if tuple(data['fields']) != tuple(fields):
+        raise SyncError(f"campos de {key} incompatibles: {data['fields']}")
+    rows = {}
+    for at, node, name, *values in data['rows']:
+        # un mismo nombre repetido: queda la versión más nueva
+        if name not in rows or _wins((at, node), rows[name][0]):
+            rows[name] = ((at, node), values)
+    existing = {}
+    for names in _chunks(list(rows), 500):
+        for obj in model.objects.filter(incident_id=incident_id, name__in=names):
+            existing.setdefault(obj.name, obj)
+    local = _versions(incident_id, key, [obj.pk for obj in existing.values()])
+    to_create, to_update, applied = [], [], []
+    for name, (version, values) in rows.items():
+        obj = existing.get(name)
+        if obj is None:
+            obj = model(incident_id=incident_id, name=name, **dict(zip(fields, values)))
+            to_create.append(obj)
+        elif _wins(version, local.get(obj.pk)):
+            for field, value in zip(fields, values):
+                setattr(obj, field, value)
+            to_update.append(obj)
+        else:
+            continue
+        if model is ServiceStatus:
+            obj.updated_at = _from_us(version[0])
+        if hasattr(model, 'update_cell'):
+            obj.update_cell()
+        applied.append((obj, version))
+    update_fields = list(fields)
+    if hasattr(model, 'update_cell'):
+        update_fields.append('cell')
+    if model is ServiceStatus:
+        update_fields.append('updated_at')
+    model.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+    model.objects.bulk_update(to_update, update_fields, batch_size=BATCH_SIZE)
+    _record(incident_id, model, {obj.pk: version for obj, version in applied})
+    return len(to_create), len(to_update), len(rows) - len(applied)
+
+
+def _apply_points(incident_id, metrics):
+    """Agrega los puntos que no estén; devuelve (agregados, repetidos, rango de ids nuevo o None)."""
+    new, total = [], 0
+    for metric, series in metrics.items():
+        points = _decode_points(series)
+        if not points:
+            continue
+        total += len(points)
+        # el índice (incident, metric, timestamp) acota la búsqueda a la ventana del paquete
+        known = set(
+            MetricPoint.objects.filter(
+                incident_id=incident_id, metric=metric,
+                timestamp__range=(min(p[0] for p in points), max(p[0] for p in points)),
+            ).values_list('timestamp', 'value')
+        )
+        for ts, value, note in points:
+            if (ts, value) not in known:
+                known.add((ts, value))
+                new.append((ts, metric, value, note))
+    if not new:
+        return 0, total, None
+    before = MetricPoint.objects.aggregate(m=Max('id'))['m'] or 0
+    insert_points(incident_id, new)
+    after = MetricPoint.objects.aggregate(m=Max('id'))['m']
+    # la transacción tiene el lock de escritura: todos los ids del rango son de este lote
+    return len(new), total - len(new), [before + 1, after]
+
+
+def apply(bundle, force=False):
+    """
+    Importa un paquete en una transacción. Con force=True se acepta aunque
+    empiece después de lo último importado de ese nodo (faltaría un paquete).
+    """
+    payload = unpack(bundle)
+    source = payload['node']
+    if source == node_id():
+        raise SyncError("el paquete fue generado por este mismo nodo")
+    try:
+        with transaction.atomic():
+            incident, summary_applied = _apply_incident(payload)
+            state, _ = SyncPeer.objects.get_or_create(node=source, incident=incident)
+            if _behind(state.received, payload['since']) and not force:
+                raise SyncError(
+                    f"falta un paquete de {source}: este empieza en {payload['since']} y lo último importado "
+                    f"es {state.received}"
+                )
+            result = {
+                "incident": incident.pk,
+                "node": source,
+                "summary": summary_applied,
+                "resources": {
+                    key: _apply_resources(incident.pk, key, data) for key, data in payload['resources'].items()
+                },
+            }
+            added, repeated, echo = _apply_points(incident.pk, payload['metrics'])
+            result["points"] = {"added": added, "repeated": repeated}
+
+            state.received = _later(state.received, payload['cursor'])
+            if payload.get('ack') and payload.get('peer') == node_id():
+                state.acked = payload['ack']
+            acked_metric = changes.parse_cursor(state.acked)[0]
+            state.echo = [r for r in state.echo if r[1] > acked_metric] + ([echo] if echo else [])
+            state.save()
+    except changes.CursorError as exc:
+        raise SyncError(str(exc))
+    except (KeyError, TypeError, OverflowError) as exc:
+        raise SyncError(f"paquete mal formado: {exc!r}")
+    result["cursor"] = state.received
+    return result
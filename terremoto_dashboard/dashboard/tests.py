@@ -1,3 +1,1508 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import io
+import itertools
+import json
+import math
+import os
+import random
+import sqlite3
+import struct
+import tempfile
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connections
+from django.db.models import Q
+from django.test import Client, LiveServerTestCase, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .models import (
+    Bridge, ChangeCheckpoint, Hospital, IncidentSummary, Job, MetricPoint, MetricRollup, ResourceChange, ServiceStatus,
+    Shelter,
+)
+from . import (
+    allocation, benchmarks, changes, clusters, history, incidents, ingest, jobs, loadtest, montecarlo, occupancy, perf,
+    projection, relay, roads, rollups, scenario, serializers, snapshot, spatial, sync, tiles, timeseries,
+)
+from .routers import ReadReplicaRouter
+from .routing import websocket_urlpatterns
+
+# el alias 'dashboard' (versiones de snapshot, incidente actual) en memoria: los
+# tests no escriben en el cache de archivos del proyecto ni leen lo que dejó runserver
+TEST_CACHES = {
+    **settings.CACHES,
+    'dashboard': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'dashboard-tests'},
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class IncidentTestCase(TestCase):
+    """Cada test corre sobre un incidente nuevo, que pasa a ser el actual de las rutas sin id."""
+
+    def setUp(self):
+        # el cache de incidentes es compartido: no debe quedar apuntando a filas revertidas
+        self.addCleanup(incidents.forget)
+        self.incident = IncidentSummary.objects.create()
+
+
+class SummarySnapshotTests(IncidentTestCase):
+    def setUp(self):
+        super().setUp()
+        snapshot.clear_local_snapshot()
+
+    def test_unchanged_poll_returns_304_without_queries(self):
+        first = self.client.get('/api/summary/')
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('ETag', first)
+        self.assertIn('Last-Modified', first)
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/summary/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+
+    def test_saving_a_resource_changes_the_etag(self):
+        first = self.client.get('/api/summary/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Bridge.objects.create(incident=self.incident, name='Puente RP179', lat=-35.02, lng=-69.32)
+        second = self.client.get('/api/summary/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(second.json()['bridges'][0]['name'], 'Puente RP179')
+
+
+class MetricsQueryTests(IncidentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.start = timezone.now() - datetime.timedelta(hours=10)
+        ingest.insert_points(self.incident.pk, [
+            (self.start + datetime.timedelta(minutes=i), metric, i, '')
+            for metric in ('fatalities', 'injured_mild')
+            for i in range(600)
+        ])
+
+    def test_filters_by_metric_and_window(self):
+        response = self.client.get('/api/metrics/', {
+            'metric': 'fatalities',
+            'from': (self.start + datetime.timedelta(minutes=100)).isoformat(),
+            'to': (self.start + datetime.timedelta(minutes=199)).isoformat(),
+        })
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(list(data), ['fatalities'])
+        self.assertEqual(len(data['fatalities']), 100)
+        self.assertEqual(data['fatalities'][0]['value'], 100)
+
+    def test_downsamples_to_target_points(self):
+        lttb = self.client.get('/api/metrics/', {'points': 50}).json()
+        self.assertEqual(len(lttb['fatalities']), 50)
+        self.assertEqual(lttb['fatalities'][-1]['value'], 599)
+        response = self.client.get('/api/metrics/', {'points': 50, 'mode': 'bucket'})
+        self.assertEqual(response['X-Metrics-Source'], 'minute')
+        buckets = response.json()
+        self.assertEqual(len(buckets['injured_mild']), 50)
+        self.assertEqual(sum(p['count'] for p in buckets['injured_mild']), 600)
+        self.assertEqual(buckets['injured_mild'][0]['min'], 0)
+
+    def test_rejects_invalid_parameters(self):
+        self.assertEqual(self.client.get('/api/metrics/', {'points': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/metrics/', {'mode': 'avg'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/metrics/', {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/metrics/', {'until_id': 5, 'points': 10}).status_code, 400)
+        for raw in ('inf', 'nan', '1e20', '-1e20', '2025-13-40T00:00:00'):
+            with self.subTest(raw=raw):
+                self.assertEqual(self.client.get('/api/metrics/', {'from': raw}).status_code, 400)
+
+    def decode_binary(self, body):
+        self.assertEqual(body[:4], serializers.BINARY_MAGIC)
+        flags, count = struct.unpack_from('<B3xI', body, 4)
+        columns = ('t', 'v', *serializers.BUCKET_COLUMNS) if flags & serializers.FLAG_BUCKETS else ('t', 'v')
+        offset, series = 16, {}
+        for _ in range(count):
+            n, length = struct.unpack_from('<II', body, offset)
+            name = body[offset + 8:offset + 8 + length].decode()
+            offset += 8 + -(-length // 8) * 8
+            data = {}
+            for column in columns:
+                data[column] = list(struct.unpack_from(f'<{n}d', body, offset))
+                offset += 8 * n
+            if flags & serializers.FLAG_DELTA:
+                data['t'] = list(itertools.accumulate(data['t']))
+            series[name] = data
+        self.assertEqual(offset, len(body))
+        return series
+
+    def test_columnar_formats_match_json(self):
+        params = {'metric': 'fatalities', 'from': self.start.isoformat()}
+        points = json.loads(b''.join(self.client.get('/api/metrics/', params).streaming_content))['fatalities']
+        expected = {
+            't': [round(datetime.datetime.fromisoformat(p['timestamp']).timestamp() * 1000) for p in points],
+            'v': [p['value'] for p in points],
+        }
+        columnar = self.client.get('/api/metrics/', {**params, 'format': 'columnar', 'delta': 1})
+        self.assertEqual(columnar['Content-Type'], serializers.SERIES_FORMATS['columnar'])
+        data = columnar.json()
+        self.assertTrue(data['delta'])
+        self.assertEqual(list(itertools.accumulate(data['series']['fatalities']['t'])), expected['t'])
+        self.assertEqual(data['series']['fatalities']['v'], expected['v'])
+        binary = self.client.get('/api/metrics/', params, HTTP_ACCEPT=serializers.SERIES_FORMATS['binary'])
+        self.assertEqual(self.decode_binary(binary.content)['fatalities'], expected)
+        buckets = self.client.get('/api/metrics/', {'points': 50, 'mode': 'bucket', 'format': 'binary'})
+        decoded = self.decode_binary(buckets.content)
+        self.assertEqual(sum(decoded['injured_mild']['count']), 600)
+
+    def test_reduced_columns_match_json(self):
+        for mode in timeseries.MODES:
+            with self.subTest(mode=mode):
+                params = {'points': 40, 'mode': mode}
+                points = self.client.get('/api/metrics/', params).json()
+                columns = self.client.get('/api/metrics/', {**params, 'format': 'columnar'}).json()['series']
+                self.assertEqual(set(columns), set(points))
+                for metric, series in points.items():
+                    self.assertEqual(columns[metric]['t'], [
+                        round(datetime.datetime.fromisoformat(p['timestamp']).timestamp() * 1000) for p in series
+                    ])
+                    for name in ('v', *(serializers.BUCKET_COLUMNS if mode == 'bucket' else ())):
+                        key = 'value' if name == 'v' else name
+                        self.assertEqual(columns[metric][name], [p[key] for p in series])
+
+    def test_until_id_limits_full_series(self):
+        last = MetricPoint.objects.filter(metric='fatalities').order_by('id')[99]
+        data = self.client.get('/api/metrics/', {'metric': 'fatalities', 'until_id': last.id, 'format': 'columnar'}).json()
+        self.assertEqual(len(data['series']['fatalities']['v']), 100)
+
+    def test_compresses_when_accepted(self):
+        response = self.client.get('/api/metrics/', {'format': 'columnar'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content))['format'], 'columnar')
+        streamed = self.client.get('/api/metrics/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        body = json.loads(gzip.decompress(b''.join(streamed.streaming_content)))
+        self.assertEqual(len(body['fatalities']), 600)
+
+    def test_every_negotiated_response_varies_on_accept(self):
+        for params in ({}, {'points': 50}, {'format': 'binary'}, {'format': 'xml'}, {'points': 'x'}):
+            response = self.client.get('/api/metrics/', params)
+            self.assertIn('Accept', [h.strip() for h in response['Vary'].split(',')], params)
+
+
+class SerializerTests(IncidentTestCase):
+    def setUp(self):
+        super().setUp()
+        incident = self.incident
+        Bridge.objects.create(incident=incident, name='Puente', lat=-35.0, lng=-69.3, status='ok', notes='n')
+        Hospital.objects.create(incident=incident, name='Hospital', lat=-35.1, lng=-69.2, total_beds=30, available_beds=7)
+        Hospital.objects.create(incident=incident, name='Sin camas', lat=-35.1, lng=-69.2, total_beds=0, available_beds=0)
+        Shelter.objects.create(incident=incident, name='Escuela', lat=-35.2, lng=-69.1, capacity=120, occupants=45)
+        ServiceStatus.objects.create(incident=incident, name='Agua', status='Parcial', note='')
+
+    def test_rows_match_to_dict(self):
+        for model in serializers.FIELDS:
+            with self.subTest(model=model.__name__):
+                expected = [obj.to_dict() for obj in model.objects.order_by('id')]
+                self.assertEqual(serializers.rows(model.objects.order_by('id')), expected)
+
+    def test_stream_matches_plain_encoding(self):
+        start = timezone.now().replace(microsecond=0) - datetime.timedelta(hours=1)
+        ingest.insert_points(self.incident.pk, [
+            (start + datetime.timedelta(seconds=i, microseconds=i % 3 * 250), metric, i / 3, '')
+            for metric in ('a', 'b') for i in range(25)
+        ])
+        expected = {
+            metric: [{"timestamp": p.timestamp.isoformat(), "value": p.value}
+                     for p in MetricPoint.objects.filter(metric=metric).order_by('timestamp')]
+            for metric in ('a', 'b')
+        }
+        for backend in (serializers.orjson, None):
+            with self.subTest(orjson=backend is not None), mock.patch.object(serializers, 'orjson', backend):
+                rows = timeseries.raw_rows(MetricPoint.objects.all())
+                body = b''.join(serializers.stream_series(rows, chunk_rows=4))
+                self.assertEqual(json.loads(body), expected)
+        self.assertEqual(b''.join(serializers.stream_series(iter(()))), b'{}')
+
+
+class RollupTests(IncidentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        self.start = self.now - datetime.timedelta(days=20)
+        # un punto cada 10 minutos durante 20 días
+        self.points = [
+            (self.start + datetime.timedelta(minutes=10 * i), 'fatalities', float(i % 97), '')
+            for i in range(20 * 144)
+        ]
+        for offset in range(0, len(self.points), 500):
+            ingest.insert_points(self.incident.pk, self.points[offset:offset + 500])
+
+    def rollup_rows(self):
+        return sorted(MetricRollup.objects.values_list(
+            'resolution', 'bucket', 'count', 'min_value', 'max_value', 'sum_value', 'last_value',
+            'first_timestamp', 'last_timestamp'))
+
+    def test_incremental_matches_rebuild(self):
+        MetricPoint.objects.create(incident=self.incident, timestamp=self.now, metric='fatalities', value=500)
+        incremental = self.rollup_rows()
+        MetricRollup.objects.all().delete()
+        rollups.rebuild()
+        self.assertEqual(self.rollup_rows(), incremental)
+        day = MetricRollup.objects.filter(resolution=rollups.DAY).order_by('-bucket').first()
+        self.assertEqual((day.last_value, day.max_value), (500, 500))
+
+    def test_compact_keeps_chart_answers(self):
+        params = {'metric': 'fatalities', 'points': 20, 'mode': 'bucket'}
+        before = self.client.get('/api/metrics/', params)
+        deleted = rollups.compact(self.now)
+        self.assertGreater(deleted['raw'], 0)
+        self.assertFalse(MetricPoint.objects.filter(timestamp__lt=rollups.cutoff('raw', self.now)).exists())
+        after = self.client.get('/api/metrics/', params)
+        self.assertEqual(after['X-Metrics-Source'], 'hour')
+        self.assertEqual(after.json(), before.json())
+        self.assertEqual(sum(p['count'] for p in after.json()['fatalities']), len(self.points))
+
+    def test_source_follows_window_and_points(self):
+        recent = {'metric': 'fatalities', 'from': (self.now - datetime.timedelta(hours=2)).isoformat()}
+        self.assertEqual(self.client.get('/api/metrics/', {**recent, 'points': 500})['X-Metrics-Source'], 'raw')
+        self.assertEqual(self.client.get('/api/metrics/', {'points': 10})['X-Metrics-Source'], 'day')
+        self.assertEqual(self.client.get('/api/metrics/')['X-Metrics-Source'], 'raw')
+        lttb = self.client.get('/api/metrics/', {'points': 100}).json()['fatalities']
+        self.assertEqual(len(lttb), 100)
+
+    def test_delete_metrics_clears_rollups(self):
+        rollups.delete_metrics(Q(incident=self.incident, metric='fatalities'))
+        self.assertFalse(MetricRollup.objects.exists())
+        self.assertEqual(rollups.bounds(self.incident.pk), (None, None))
+
+    def test_full_series_keeps_compacted_history(self):
+        params = {'metric': 'fatalities', 'format': 'columnar'}
+        before = self.client.get('/api/metrics/', params).json()['series']['fatalities']
+        rollups.compact(self.now)
+        self.assertTrue(MetricPoint.objects.exists())
+        # un punto por cubeta de minuto: el promedio es el valor original
+        after = self.client.get('/api/metrics/', params).json()['series']['fatalities']
+        self.assertEqual(after['v'], before['v'])
+        self.assertEqual(len(after['t']), len(self.points))
+        self.assertEqual(after['t'], sorted(after['t']))
+        response = self.client.get('/api/metrics/', {'metric': 'fatalities'})
+        rows = json.loads(b''.join(response.streaming_content))['fatalities']
+        self.assertEqual([p['value'] for p in rows], before['v'])
+        first = datetime.datetime.fromisoformat(rows[0]['timestamp'])
+        self.assertEqual(first, self.start.replace(second=0, microsecond=0))
+
+
+class DeltaFeedTests(IncidentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.shelter = Shelter.objects.create(incident=self.incident, name='Polideportivo', lat=-35.02, lng=-69.32,
+                                              capacity=350)
+        MetricPoint.objects.create(incident=self.incident, metric='fatalities', value=80)
+
+    def test_full_state_then_only_changes(self):
+        full = self.client.get('/api/delta/').json()
+        self.assertTrue(full['reset'])
+        self.assertEqual(len(full['shelters']), 1)
+        self.assertEqual(len(full['metrics']['fatalities']), 1)
+        without_metrics = self.client.get('/api/delta/', {'metrics': 0}).json()
+        self.assertNotIn('metrics', without_metrics)
+        self.assertEqual(without_metrics['cursor'], full['cursor'])
+
+        with self.assertNumQueries(2):
+            empty = self.client.get('/api/delta/', {'since': full['cursor']}).json()
+        self.assertEqual(set(empty), {'reset', 'cursor'})
+        self.assertEqual(empty['cursor'], full['cursor'])
+
+        self.shelter.occupants = 120
+        self.shelter.save()
+        bridge = Bridge.objects.create(incident=self.incident, name='Puente RP175', lat=-35.018, lng=-69.32)
+        bridge_id = bridge.id
+        bridge.delete()
+        MetricPoint.objects.create(incident=self.incident, metric='fatalities', value=84)
+
+        delta = self.client.get('/api/delta/', {'since': full['cursor']}).json()
+        self.assertEqual(delta['shelters'][0]['occupants'], 120)
+        self.assertEqual(delta['deleted'], {'bridges': [bridge_id]})
+        self.assertEqual([p['value'] for p in delta['metrics']['fatalities']], [84])
+        self.assertNotIn('hospitals', delta)
+        self.assertNotEqual(delta['cursor'], full['cursor'])
+
+    def test_rejects_malformed_cursor(self):
+        self.assertEqual(self.client.get('/api/delta/', {'since': 'abc'}).status_code, 400)
+
+    def test_deleted_points_reset_their_series(self):
+        MetricPoint.objects.create(incident=self.incident, metric='injured_mild', value=3)
+        cursor = self.client.get('/api/delta/', {'metrics': 0}).json()['cursor']
+        rollups.delete_metrics(Q(incident=self.incident, metric='injured_mild'))
+        delta = self.client.get('/api/delta/', {'since': cursor}).json()
+        self.assertEqual(delta['reset_metrics'], ['injured_mild'])
+        self.assertNotEqual(delta['cursor'], cursor)
+
+        old = timezone.now() - datetime.timedelta(days=30)
+        MetricPoint.objects.create(incident=self.incident, metric='fatalities', value=1, timestamp=old)
+        rollups.compact()
+        delta = self.client.get('/api/delta/', {'since': delta['cursor']}).json()
+        self.assertEqual(delta['reset_metrics'], ['fatalities'])
+        # la historia de recursos no cambia con los avisos de borrado
+        self.assertEqual(self.client.get('/api/summary/', {'as_of': timezone.now().isoformat()}).status_code, 200)
+
+
+class HistoryTests(IncidentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.shelter = Shelter.objects.create(incident=self.incident, name='Polideportivo', lat=-35.02, lng=-69.32,
+                                              capacity=350, occupants=10)
+        self.bridge = Bridge.objects.create(incident=self.incident, name='Puente RP179', lat=-35.02, lng=-69.32)
+
+    def as_of(self, path, at, **params):
+        return self.client.get(path, {'as_of': at.isoformat(), **params})
+
+    def test_as_of_rebuilds_past_states(self):
+        created = timezone.now()
+        changes.checkpoint(self.incident.pk)
+        self.shelter.occupants = 120
+        self.shelter.save()
+        occupancy.apply(self.incident.pk, [('checkin', self.shelter.pk, 5)])
+        middle = timezone.now()
+        self.bridge.status = 'ok'
+        self.bridge.save()
+        bridge_id = self.bridge.pk
+        self.bridge.delete()
+
+        past = self.as_of('/api/summary/', created).json()
+        self.assertEqual([s['occupants'] for s in past['shelters']], [10])
+        self.assertEqual([b['status'] for b in past['bridges']], ['derribado'])
+        self.assertEqual(past['name'], self.incident.name)
+        self.assertEqual(self.as_of('/api/summary/', middle).json()['shelters'][0]['occupants'], 125)
+        now = self.as_of('/api/summary/', timezone.now()).json()
+        self.assertEqual(now['bridges'], [])
+        current = self.client.get('/api/summary/').json()
+        self.assertEqual({k: v for k, v in now.items() if k != 'as_of'}, current)
+
+        resources = self.as_of('/api/resources/', created, bbox='-69.4,-35.1,-69.2,-34.9').json()
+        self.assertEqual([b['id'] for b in resources['bridges']], [bridge_id])
+        self.assertEqual(resources['shelters'][0]['occupancy_pct'], 2.9)
+
+    def test_replay_is_bounded_by_periodic_checkpoints(self):
+        moments = []
+        with override_settings(DASHBOARD_HISTORY_CHECKPOINT_EVERY=5, DASHBOARD_JOB_WORKERS=0):
+            for occupants in range(30):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.shelter.occupants = occupants
+                    self.shelter.save()
+                moments.append(timezone.now())
+        taken = list(ChangeCheckpoint.objects.filter(incident=self.incident).values_list('change_id', flat=True))
+        self.assertGreaterEqual(len(taken), 5)
+        # los checkpoints los guardan tareas, no el request que registró el cambio
+        self.assertEqual(Job.objects.filter(kind='checkpoint', status=Job.DONE).count(), len(taken))
+        self.assertTrue(all(b - a <= 5 for a, b in zip(taken, taken[1:])))
+        for occupants in (0, 13, 29):
+            with self.assertNumQueries(3):
+                state = history.state_as_of(self.incident.pk, moments[occupants])
+            self.assertEqual(history.rows(state, 'shelters')[0]['occupants'], occupants)
+
+    def test_rejects_times_without_history(self):
+        self.assertEqual(self.client.get('/api/summary/', {'as_of': 'ayer'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/summary/', {'as_of': '1e20'}).status_code, 400)
+        before = self.as_of('/api/summary/', self.incident.created_at - datetime.timedelta(hours=1))
+        self.assertEqual(before.status_code, 404)
+        # cambios registrados antes de que guardaran valores
+        ResourceChange.objects.filter(incident=self.incident).update(data=None)
+        self.assertEqual(self.as_of('/api/summary/', timezone.now()).status_code, 404)
+
+
+class IncidentScopingTests(IncidentTestCase):
+    def setUp(self):
+        super().setUp()
+        snapshot.clear_local_snapshot()
+        self.other = self.incident
+        self.incident = IncidentSummary.objects.create(name='Réplica')
+        for incident, name in ((self.other, 'Viejo'), (self.incident, 'Nuevo')):
+            Shelter.objects.create(incident=incident, name=name, lat=-35.02, lng=-69.32, capacity=10)
+            MetricPoint.objects.create(incident=incident, metric='fatalities', value=len(name))
+
+    def scoped(self, incident, route, params=None):
+        return self.client.get(f'/api/incidents/{incident.pk}/{route}', params)
+
+    def test_scoped_routes_only_see_their_incident(self):
+        bbox = {'bbox': '-69.4,-35.1,-69.3,-35.0', 'types': 'shelters'}
+        self.assertEqual([s['name'] for s in self.scoped(self.other, 'resources/', bbox).json()['shelters']], ['Viejo'])
+        self.assertEqual([s['name'] for s in self.scoped(self.other, 'summary/').json()['shelters']], ['Viejo'])
+        series = self.scoped(self.other, 'metrics/', {'format': 'columnar'}).json()['series']
+        self.assertEqual(series['fatalities']['v'], [5])
+        # las rutas sin id son las del incidente más reciente
+        self.assertEqual(self.client.get('/api/summary/').json()['id'], self.incident.pk)
+        self.assertEqual([s['name'] for s in self.client.get('/api/delta/').json()['shelters']], ['Nuevo'])
+        listed = self.client.get('/api/incidents/').json()
+        self.assertEqual(listed['current'], self.incident.pk)
+        self.assertEqual([i['id'] for i in listed['incidents']], [self.incident.pk, self.other.pk])
+
+    def test_changes_and_etags_are_per_incident(self):
+        cursors = {i.pk: self.scoped(i, 'delta/').json()['cursor'] for i in (self.incident, self.other)}
+        etags = {i.pk: self.scoped(i, 'summary/')['ETag'] for i in (self.incident, self.other)}
+        with self.captureOnCommitCallbacks(execute=True):
+            Bridge.objects.create(incident=self.other, name='Puente', lat=-35.02, lng=-69.32)
+        delta = self.scoped(self.other, 'delta/', {'since': cursors[self.other.pk]}).json()
+        self.assertEqual([b['name'] for b in delta['bridges']], ['Puente'])
+        untouched = self.scoped(self.incident, 'delta/', {'since': cursors[self.incident.pk]}).json()
+        self.assertNotIn('bridges', untouched)
+        self.assertEqual(self.client.get(f'/api/incidents/{self.incident.pk}/summary/',
+                                         HTTP_IF_NONE_MATCH=etags[self.incident.pk]).status_code, 304)
+        self.assertEqual(self.client.get(f'/api/incidents/{self.other.pk}/summary/',
+                                         HTTP_IF_NONE_MATCH=etags[self.other.pk]).status_code, 200)
+
+    def test_unknown_incident_is_404(self):
+        missing = self.incident.pk + 100
+        for route in ('summary/', 'delta/', 'metrics/', 'resources/?bbox=0,0,1,1'):
+            with self.subTest(route=route):
+                self.assertEqual(self.client.get(f'/api/incidents/{missing}/{route}').status_code, 404)
+        self.assertEqual(self.client.get(f'/incidents/{missing}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/incidents/{self.other.pk}/').status_code, 200)
+
+    def test_resolution_is_cached(self):
+        self.assertEqual(incidents.resolve(), self.incident.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(incidents.resolve(), self.incident.pk)
+            self.assertEqual(incidents.resolve(self.incident.pk), self.incident.pk)
+        newest = IncidentSummary.objects.create()
+        self.assertEqual(incidents.resolve(), newest.pk)
+        newest.delete()
+        self.assertEqual(incidents.resolve(), self.incident.pk)
+
+    def test_queries_use_incident_indexes(self):
+        def plan(qs):
+            sql, params = qs.query.sql_with_params()
+            with connections['default'].cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                return ' '.join(row[-1] for row in cursor.fetchall())
+
+        points = timeseries.filtered_points(self.incident.pk, ['fatalities'])
+        self.assertIn('metricpoint_incident_ts_idx', plan(points))
+        shelters = spatial.filter_bbox(Shelter.objects.filter(incident_id=self.incident.pk), -35.1, -69.4, -35.0, -69.3)
+        self.assertIn('shelter_incident_cell_idx', plan(shelters))
+
+
+class IncidentSocketTests(SimpleTestCase):
+    def test_merge_delta_coalesces_consecutive_changes(self):
+        older = {"since": "1.1", "cursor": "2.2", "metrics": {"fatalities": [{"value": 80}]},
+                 "shelters": [{"id": 1, "occupants": 10}], "bridges": [{"id": 7, "status": "ok"}]}
+        newer = {"since": "2.2", "cursor": "3.4", "metrics": {"fatalities": [{"value": 84}]},
+                 "shelters": [{"id": 1, "occupants": 25}], "deleted": {"bridges": [7]}}
+        merged = relay.merge_delta(older, newer)
+        self.assertEqual((merged["since"], merged["cursor"]), ("1.1", "3.4"))
+        self.assertEqual([p["value"] for p in merged["metrics"]["fatalities"]], [80, 84])
+        self.assertEqual(merged["shelters"], [{"id": 1, "occupants": 25}])
+        self.assertNotIn("bridges", merged)
+        self.assertEqual(merged["deleted"], {"bridges": [7]})
+
+    def test_merge_delta_keeps_metric_resets(self):
+        older = {"since": "1.1", "cursor": "2.2", "more": True,
+                 "metrics": {"fatalities": [{"value": 80}], "injured_mild": [{"value": 5}]}}
+        newer = {"since": "2.2", "cursor": "2.5", "reset_metrics": ["fatalities"]}
+        merged = relay.merge_delta(older, newer)
+        self.assertEqual(merged["reset_metrics"], ["fatalities"])
+        self.assertEqual(merged["metrics"], {"injured_mild": [{"value": 5}]})
+        self.assertNotIn("more", merged)
+        merged = relay.merge_delta(merged, {"since": "2.5", "cursor": "3.5", "more": True,
+                                            "reset_metrics": ["injured_mild"]})
+        self.assertEqual(merged["reset_metrics"], ["fatalities", "injured_mild"])
+        self.assertNotIn("metrics", merged)
+        self.assertTrue(merged["more"])
+
+    @override_settings(DASHBOARD_WS_RELAY=False)
+    @mock.patch.object(incidents, 'resolve', return_value=3)
+    async def test_subscribers_receive_incident_deltas(self, resolve):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/incidents/3/')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())["type"], "hello")
+        delta = {"since": "0.0", "cursor": "1.0", "metrics": {"fatalities": [{"value": 80}]}}
+        await get_channel_layer().group_send(relay.group_name(3), {"type": "incident.delta", "delta": delta})
+        message = await communicator.receive_json_from()
+        self.assertEqual(message["type"], "delta")
+        self.assertEqual(message["cursor"], "1.0")
+        await communicator.disconnect()
+
+    @mock.patch.object(incidents, 'resolve', side_effect=incidents.IncidentNotFound)
+    async def test_unknown_incident_is_rejected(self, resolve):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/incidents/99/')
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+
+class MetricIngestTests(IncidentTestCase):
+    def test_ndjson_batches_report_accepted_and_rejected_rows(self):
+        body = '\n'.join([
+            '{"timestamp": "2025-09-16T04:17:00+00:00", "metric": "fatalities", "value": 80}',
+            '{"timestamp": 1758000000, "metric": "injured_mild", "value": "850", "note": "censo"}',
+            '{"timestamp": "ayer", "metric": "fatalities", "value": 81}',
+            'no es json',
+            '{"timestamp": "2025-09-16T05:17:00", "metric": "fatalities", "value": 82}',
+        ])
+        response = self.client.post('/api/metrics/ingest/?batch_size=2', body, content_type='application/x-ndjson')
+        data = response.json()
+        self.assertEqual((data['accepted'], data['rejected']), (3, 2))
+        self.assertEqual([b['accepted'] for b in data['batches']], [2, 0, 1])
+        self.assertEqual([e['row'] for b in data['batches'] for e in b['errors']], [3, 4])
+        self.assertEqual(MetricPoint.objects.count(), 3)
+        self.assertEqual(MetricPoint.objects.get(metric='injured_mild').note, 'censo')
+
+    def test_out_of_range_timestamps_are_rejected_rows(self):
+        body = '\n'.join(
+            f'{{"timestamp": {raw}, "metric": "fatalities", "value": 1}}'
+            for raw in ('1e20', 'Infinity', 'NaN', '"1e20"', '"inf"', '1758000000')
+        )
+        data = self.client.post('/api/metrics/ingest/', body, content_type='application/x-ndjson').json()
+        self.assertEqual((data['accepted'], data['rejected']), (1, 5))
+        self.assertIn('timestamp inválido', data['batches'][0]['errors'][0]['error'])
+
+    def test_csv_upload(self):
+        body = 'timestamp,metric,value\n2025-09-16T04:17:00Z,fatalities,80\n2025-09-16T05:17:00Z,fatalities,x\n'
+        data = self.client.post('/api/metrics/ingest/', body, content_type='text/csv').json()
+        self.assertEqual((data['accepted'], data['rejected']), (1, 1))
+        self.assertEqual(MetricPoint.objects.get().value, 80)
+
+    def test_csv_without_required_columns_is_rejected(self):
+        response = self.client.post('/api/metrics/ingest/', 'metric,value\nfatalities,1\n', content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+
+    def test_cross_site_form_content_types_are_refused(self):
+        body = '{"timestamp": 1758000000, "metric": "fatalities", "value": 1}'
+        for content_type in ('text/plain', 'application/x-www-form-urlencoded'):
+            response = self.client.post('/api/metrics/ingest/?format=ndjson', body, content_type=content_type)
+            self.assertEqual(response.status_code, 415)
+        self.assertFalse(MetricPoint.objects.exists())
+
+    def test_command_reports_undecodable_input(self):
+        with tempfile.NamedTemporaryFile(suffix='.ndjson') as fh:
+            fh.write(b'\xff\xfe{"metric": "fatalities"}\n')
+            fh.flush()
+            with self.assertRaises(CommandError):
+                call_command('ingest_metrics', fh.name, stdout=io.StringIO())
+
+
+class ScenarioLoadTests(IncidentTestCase):
+    def test_enunciado_is_idempotent(self):
+        call_command('create_incident_from_enunciado', stdout=io.StringIO())
+        call_command('create_incident_from_enunciado', stdout=io.StringIO())
+        self.assertEqual(IncidentSummary.objects.count(), 1)
+        self.assertEqual(Bridge.objects.count(), 2)
+        self.assertEqual(Shelter.objects.count(), 3)
+        self.assertEqual(MetricPoint.objects.filter(metric='fatalities').count(), 5)
+        self.assertEqual(ServiceStatus.objects.get(name='Clima (noches)').status, 'Frío -3°C nocturno')
+
+    def test_generated_scenario_is_reproducible(self):
+        sizes = dict(shelters=40, hospitals=10, bridges=20, metric_points=400)
+        first = scenario.load(scenario.generate(seed=7, **sizes))
+        self.assertEqual(first['shelters'], (40, 0))
+        self.assertEqual(first['metrics'], 400)
+        again = scenario.load(scenario.generate(seed=7, **sizes))
+        self.assertEqual(again['shelters'], (0, 0))
+        self.assertEqual(MetricPoint.objects.count(), 400)
+        # los cambios masivos también quedan en el feed de deltas
+        self.assertEqual(ResourceChange.objects.filter(model='shelters').count(), 40)
+
+    def test_generates_the_exact_number_of_points(self):
+        for total in (0, 1, 6, 401):
+            with self.subTest(total=total):
+                points = list(scenario.generate(seed=1, shelters=0, hospitals=0, bridges=0, metric_points=total)['metrics'])
+                self.assertEqual(len(points), total)
+
+    def test_reload_keeps_observed_points(self):
+        sizes = dict(shelters=5, hospitals=2, bridges=2, metric_points=40)
+        incident_id = scenario.load(scenario.generate(seed=7, **sizes))['incident']
+        observed = timezone.now() - datetime.timedelta(hours=1)
+        ingest.insert_points(incident_id, [(observed, 'fatalities', 999.0, 'parte del hospital')])
+        scenario.load(scenario.generate(seed=8, **sizes))
+        self.assertEqual(MetricPoint.objects.filter(incident_id=incident_id).count(), 41)
+        self.assertEqual(scenario.scenario_points(incident_id).count(), 40)
+        self.assertTrue(MetricPoint.objects.filter(value=999.0, note='parte del hospital').exists())
+        # los agregados se rehicieron con lo que quedó
+        day = MetricRollup.objects.filter(incident_id=incident_id, metric='fatalities', resolution=rollups.DAY)
+        self.assertEqual(sum(day.values_list('count', flat=True)), 11)
+        self.assertEqual(max(day.values_list('max_value', flat=True)), 999.0)
+
+
+class SpatialQueryTests(IncidentTestCase):
+    def setUp(self):
+        super().setUp()
+        Shelter.objects.create(incident=self.incident, name='Cerca', lat=-35.0200, lng=-69.3230, capacity=10)
+        Shelter.objects.create(incident=self.incident, name='Medio', lat=-35.0300, lng=-69.3230, capacity=10)
+        Shelter.objects.create(incident=self.incident, name='Lejos', lat=-34.6000, lng=-68.3000, capacity=10)
+
+    def test_bbox_uses_cells(self):
+        shelter = Shelter.objects.get(name='Cerca')
+        self.assertEqual(shelter.cell, spatial.cell_for(shelter.lat, shelter.lng))
+        data = self.client.get('/api/resources/', {'bbox': '-69.4,-35.1,-69.3,-35.0', 'types': 'shelters'}).json()
+        self.assertEqual(sorted(s['name'] for s in data['shelters']), ['Cerca', 'Medio'])
+        self.assertNotIn('bridges', data)
+
+    def test_near_sorted_by_distance(self):
+        data = self.client.get('/api/resources/', {'near': '-35.0195,-69.3230', 'radius': 2000}).json()
+        self.assertEqual([s['name'] for s in data['shelters']], ['Cerca', 'Medio'])
+        self.assertLess(data['shelters'][0]['distance_m'], data['shelters'][1]['distance_m'])
+
+    def test_invalid_params(self):
+        self.assertEqual(self.client.get('/api/resources/').status_code, 400)
+        self.assertEqual(self.client.get('/api/resources/', {'bbox': '10,0,0,0'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/resources/', {'bbox': '0,0,1,1', 'types': 'x'}).status_code, 400)
+        for limit in (0, -5):
+            self.assertEqual(self.client.get('/api/resources/', {'bbox': '0,0,1,1', 'limit': limit}).status_code, 400)
+        for radius in ('nan', 'inf', '-1'):
+            params = {'near': '-35.0195,-69.3230', 'radius': radius}
+            self.assertEqual(self.client.get('/api/resources/', params).status_code, 400)
+
+
+class AllocationTests(IncidentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.near = Shelter.objects.create(incident=self.incident, name='Cerca', lat=-35.0200, lng=-69.3230,
+                                           capacity=100, occupants=70)
+        self.far = Shelter.objects.create(incident=self.incident, name='Lejos', lat=-35.0600, lng=-69.3230,
+                                          capacity=50, occupants=0)
+
+    def allocate(self, demand, **extra):
+        body = dict(kind='shelters', demand=demand, detail=True, **extra)
+        return self.client.post('/api/allocation/', json.dumps(body), content_type='application/json')
+
+    def test_nearest_first_then_overflow(self):
+        data = self.allocate([{"lat": -35.0201, "lng": -69.3231, "people": 100}]).json()
+        used = {f['id']: f['assigned'] for f in data['facilities']}
+        self.assertEqual(used, {self.near.id: 30, self.far.id: 50})
+        self.assertEqual((data['assigned'], data['unmet']), (80, 20))
+        self.assertEqual(data['assignments'][0]['facility'], self.near.id)
+
+    def test_numpy_fallback_matches(self):
+        demand = [[-35.02 + i * 0.001, -69.32, 7] for i in range(40)]
+        expected = self.allocate(demand).json()
+        with mock.patch.object(allocation, 'cKDTree', None):
+            fallback = self.allocate(demand).json()
+        self.assertEqual(fallback['engine'], 'numpy')
+        self.assertEqual(fallback['facilities'], expected['facilities'])
+        self.assertEqual(fallback['assignments'], expected['assignments'])
+
+    def test_hospitals_and_default_demand(self):
+        Hospital.objects.create(incident=self.incident, name='Cerrado', lat=-35.02, lng=-69.32, total_beds=50,
+                                available_beds=50, operational=False)
+        open_ = Hospital.objects.create(incident=self.incident, name='Abierto', lat=-35.05, lng=-69.32, total_beds=50,
+                                        available_beds=10)
+        data = self.client.get('/api/allocation/', {'kind': 'hospitals', 'clusters': 5}).json()
+        self.assertEqual(data['demand_points'], 5)
+        self.assertEqual([f['id'] for f in data['facilities']], [open_.id])
+        self.assertEqual(data['assigned'], 10)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get('/api/allocation/', {'kind': 'x'}).status_code, 400)
+        self.assertEqual(self.allocate([{"lat": 100, "lng": 0, "people": 1}]).status_code, 400)
+        self.assertEqual(self.allocate([]).status_code, 400)
+        for clusters in (0, allocation.MAX_CLUSTERS + 1):
+            self.assertEqual(self.client.get('/api/allocation/', {'clusters': clusters}).status_code, 400)
+
+
+ROADS_CSV = """from_id,from_lat,from_lng,to_id,to_lat,to_lng,length_m,speed_kmh,oneway,bridge
+A,-35.02,-69.33,B,-35.02,-69.32,,40,,Puente RP179
+A,-35.02,-69.33,C,-35.03,-69.325,,40,,
+C,-35.03,-69.325,B,-35.02,-69.32,,40,,
+"""
+
+
+class RoadRoutingTests(IncidentTestCase):
+    def setUp(self):
+        super().setUp()
+        handle, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w') as fh:
+            fh.write(ROADS_CSV)
+        self.addCleanup(os.remove, self.path)
+        override = override_settings(DASHBOARD_ROAD_NETWORK=self.path)
+        override.enable()
+        self.addCleanup(override.disable)
+        roads.reset()
+        self.addCleanup(roads.reset)
+        self.bridge = Bridge.objects.create(incident=self.incident, name='Puente RP179', lat=-35.02, lng=-69.325,
+                                            status='ok')
+        self.hospital = Hospital.objects.create(incident=self.incident, name='Hospital B', lat=-35.02, lng=-69.32,
+                                                total_beds=10, available_beds=5)
+
+    def test_route_avoids_fallen_bridge(self):
+        params = {'from': '-35.02,-69.33', 'to': '-35.02,-69.32'}
+        direct = self.client.get('/api/routes/', params).json()
+        self.assertEqual(direct['bridges'], ['Puente RP179'])
+        self.assertEqual(len(direct['path']), 2)
+        self.bridge.status = 'derribado'
+        self.bridge.save()
+        detour = self.client.get('/api/routes/', params).json()
+        self.assertEqual((detour['bridges'], len(detour['path'])), ([], 3))
+        self.assertGreater(detour['travel_s'], direct['travel_s'])
+
+    def test_nearest_hospital_tree_is_repaired(self):
+        before = self.client.get('/api/routes/', {'from': '-35.02,-69.33', 'nearest': 'hospitals'}).json()
+        self.assertEqual(before['target']['id'], self.hospital.id)
+        tree = roads.path_tree(self.incident.pk, 'hospitals')
+        self.bridge.status = 'parcialmente'
+        self.bridge.save()
+        after = self.client.get('/api/routes/', {'from': '-35.02,-69.33', 'nearest': 'hospitals'}).json()
+        self.assertIs(roads.path_tree(self.incident.pk, 'hospitals'), tree)
+        self.assertGreater(after['travel_s'], before['travel_s'])
+        self.assertEqual(tree.dist, roads.build_tree(tree.network, self.incident.pk, 'hospitals').dist)
+
+    def test_occupancy_changes_keep_the_tree(self):
+        tree = roads.path_tree(self.incident.pk, 'hospitals')
+        occupancy.apply(self.incident.pk, [('admit', self.hospital.pk, 2)])
+        self.hospital.refresh_from_db()
+        self.hospital.name = 'Hospital Regional'
+        self.hospital.save()
+        self.assertIs(roads.path_tree(self.incident.pk, 'hospitals'), tree)
+        self.hospital.operational = False
+        self.hospital.save()
+        rebuilt = roads.path_tree(self.incident.pk, 'hospitals')
+        self.assertIsNot(rebuilt, tree)
+        self.assertEqual(rebuilt.placements, {})
+        self.hospital.operational = True
+        self.hospital.save()
+        self.assertEqual(roads.path_tree(self.incident.pk, 'hospitals').placements, {self.hospital.pk: (-35.02, -69.32)})
+
+    def test_repair_matches_rebuild(self):
+        rng = random.Random(3)
+        size = 12
+        lat = [-35 + (i // size) * 0.01 for i in range(size * size)]
+        lng = [-69 + (i % size) * 0.01 for i in range(size * size)]
+        edges = [(i, i + 1) for i in range(size * size) if i % size != size - 1]
+        edges += [(i, i + size) for i in range(size * (size - 1))]
+        edges += [(b, a) for a, b in edges]
+        costs = [rng.uniform(10, 100) for _ in edges]
+        network = roads.RoadNetwork(lat, lng, [a for a, _ in edges], [b for _, b in edges], costs, costs,
+                                    [f'P{i % 20}' if i % 3 == 0 else '' for i in range(len(edges))])
+        tree = roads.PathTree(network, {0: 'a', size * size - 1: 'b'})
+        statuses = ('ok', 'parcialmente', 'derribado')
+        for _ in range(10):
+            changed = network.apply_bridge_status({f'P{i}': rng.choice(statuses) for i in range(20)})
+            tree.repair(changed)
+            fresh = roads.PathTree(network, {0: 'a', size * size - 1: 'b'})
+            self.assertEqual([round(d, 6) for d in tree.dist], [round(d, 6) for d in fresh.dist])
+            self.assertEqual(tree.target, fresh.target)
+
+    def test_errors(self):
+        self.assertEqual(self.client.get('/api/routes/', {'from': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/routes/', {'from': '0,0', 'to': '-35.02,-69.32'}).status_code, 400)
+        with override_settings(DASHBOARD_ROAD_NETWORK=None):
+            self.assertEqual(self.client.get('/api/routes/', {'from': '-35.02,-69.33'}).status_code, 503)
+
+
+@override_settings(DASHBOARD_JOB_WORKERS=0)
+class ProjectionTests(IncidentTestCase):
+    def test_simulate_stores_percentile_bands(self):
+        response = self.client.post('/api/simulate/?scenarios=2000&hours=24&seed=5')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['result']
+        bands = data['projection']['bands']['fatalities']
+        self.assertEqual(len(bands['p50']), 25)
+        self.assertTrue(all(a <= b <= c for a, b, c in zip(bands['p10'], bands['p50'], bands['p90'])))
+        # la base del rango de fallecidos no se reemplaza por la mediana
+        self.assertEqual(data['fatalities'], self.incident.fatalities)
+        per_run = MetricPoint.objects.filter(metric__startswith=projection.PREFIX).count()
+        self.assertEqual(per_run, 6 * 3 * 25)
+        again = self.client.post('/api/simulate/?scenarios=2000&hours=24&seed=5').json()['result']
+        self.assertEqual(again['fatalities'], self.incident.fatalities)
+        self.assertEqual(again['projection']['bands']['fatalities']['p90'][-1], bands['p90'][-1])
+        # las bandas se reemplazan; las series observadas avanzan un punto por llamada
+        self.assertEqual(MetricPoint.objects.filter(metric__startswith=projection.PREFIX).count(), per_run)
+        self.assertEqual(MetricPoint.objects.filter(metric='fatalities').count(), 2)
+        self.assertEqual(self.client.post('/api/simulate/?scenarios=0').status_code, 400)
+        too_many = self.client.post(f'/api/simulate/?scenarios={projection.MAX_SCENARIOS}&hours={projection.MAX_HOURS}')
+        self.assertEqual(too_many.status_code, 400)
+        self.assertFalse(Job.objects.filter(status='queued').exists())
+
+    def test_chunked_bands_approximate_exact(self):
+        params = {'x': (10.0, 50.0, 150.0), 'y': (None, 0.0, 1.0)}
+        exact = montecarlo.bands(params, 6000, 48, seed=2)
+        with mock.patch.object(montecarlo, 'CHUNK_SCENARIOS', 1500):
+            chunked = montecarlo.bands(params, 6000, 48, seed=2, workers=2)
+        for metric in params:
+            self.assertEqual(chunked[metric].shape, (3, 49))
+            self.assertLess(abs(chunked[metric] - exact[metric]).max(), 0.05 * exact[metric].max())
+
+    def test_workers_never_exceed_available_cpus(self):
+        with override_settings(DASHBOARD_PROJECTION_WORKERS=10_000):
+            self.assertLessEqual(projection.workers(), os.cpu_count())
+        with override_settings(DASHBOARD_PROJECTION_WORKERS=1):
+            self.assertEqual(projection.workers(), 1)
+
+
+class JobTests(IncidentTestCase):
+    def submit(self, kind, params):
+        return self.client.post('/api/jobs/', json.dumps({"kind": kind, "params": params}), content_type='application/json')
+
+    def test_identical_requests_are_deduplicated(self):
+        first = self.submit('simulate', {"scenarios": 500, "seed": 1})
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(first['Location'], f"/api/jobs/{first.json()['id']}/")
+        # los parámetros se normalizan antes de calcular la clave
+        again = self.submit('simulate', {"scenarios": "500", "seed": 1, "hours": 72}).json()
+        self.assertEqual((again['id'], again['deduplicated']), (first.json()['id'], True))
+        self.assertNotEqual(self.submit('simulate', {"scenarios": 501, "seed": 1}).json()['id'], again['id'])
+
+    def test_cancel_queued_job_and_resubmit(self):
+        job = self.submit('allocation', {"kind": "hospitals"}).json()
+        cancelled = self.client.post(f"/api/jobs/{job['id']}/cancel/").json()
+        self.assertEqual(cancelled['status'], 'cancelled')
+        self.assertNotEqual(self.submit('allocation', {"kind": "hospitals"}).json()['id'], job['id'])
+        with override_settings(DASHBOARD_JOB_WORKERS=0):
+            jobs.execute(job['id'])  # una tarea cancelada no se ejecuta
+        self.assertEqual(Job.objects.get(pk=job['id']).status, 'cancelled')
+
+    @override_settings(DASHBOARD_JOB_WORKERS=0)
+    def test_progress_cancel_and_failures(self):
+        done = self.submit('allocation', {"kind": "shelters", "clusters": 3}).json()
+        self.assertEqual((done['status'], done['progress']), ('done', 1.0))
+        self.assertEqual(self.client.get(done['url']).json()['result']['demand_points'], 3)
+
+        calls = []
+
+        def slow(params, report):
+            calls.append(1)
+            Job.objects.filter(status='running').update(cancel_requested=True)
+            report(0.5)
+            calls.append(2)
+
+        with mock.patch.dict(jobs.KINDS, {'slow': (slow, None), 'boom': (lambda p, r: 1 / 0, None)}):
+            self.assertEqual(self.submit('slow', {}).json()['status'], 'cancelled')
+            with self.assertLogs('dashboard.jobs', 'ERROR'):
+                failed = self.submit('boom', {}).json()
+        self.assertEqual(calls, [1])
+        self.assertEqual(failed['status'], 'failed')
+        self.assertIn('ZeroDivisionError', failed['error'])
+        self.assertEqual(self.submit('nope', {}).status_code, 400)
+        self.assertEqual(self.submit('simulate', {"scenarios": -1}).status_code, 400)
+        self.assertEqual(self.submit('allocation', {"clusters": allocation.MAX_CLUSTERS + 1}).status_code, 400)
+
+    def test_submit_and_cancel_require_json_and_csrf(self):
+        body = json.dumps({"kind": "simulate", "params": {"scenarios": 1_000_000, "hours": 720}})
+        self.assertEqual(self.client.post('/api/jobs/', body, content_type='text/plain').status_code, 415)
+        self.assertEqual(self.client.post('/api/jobs/', body, content_type='application/json').status_code, 400)
+        job = self.submit('allocation', {"kind": "hospitals"}).json()
+        browser = Client(enforce_csrf_checks=True)
+        self.assertEqual(browser.post('/api/jobs/', body, content_type='text/plain').status_code, 403)
+        self.assertEqual(browser.post(f"/api/jobs/{job['id']}/cancel/").status_code, 403)
+        self.assertFalse(Job.objects.exclude(pk=job['id']).exists())
+
+
+class DatabaseProfileTests(TestCase):
+    databases = {'default', 'replica'}
+
+    def pragma(self, alias, name):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_connections_apply_profile(self):
+        self.assertEqual(self.pragma('default', 'busy_timeout'), 20_000)
+        self.assertEqual(self.pragma('default', 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('default', 'query_only'), 0)
+        self.assertEqual(self.pragma('replica', 'query_only'), 1)
+        self.assertEqual(connections['default'].transaction_mode, 'IMMEDIATE')
+
+    def test_reads_use_replica_outside_transactions(self):
+        router = ReadReplicaRouter()
+        # TestCase corre cada test dentro de una transacción de 'default'
+        self.assertEqual(router.db_for_read(Bridge), 'default')
+        with mock.patch.object(connections['default'], 'in_atomic_block', False):
+            self.assertEqual(router.db_for_read(Bridge), 'replica')
+            with override_settings(DASHBOARD_READ_ALIAS='missing'):
+                self.assertEqual(router.db_for_read(Bridge), 'default')
+        self.assertEqual(router.db_for_write(Bridge), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'dashboard'))
+
+
+@override_settings(DASHBOARD_NODE_ID='a', DASHBOARD_SYNC_KEYS=dict.fromkeys('abyz0', 'clave-compartida'))
+class SyncTests(IncidentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.shelter = Shelter.objects.create(incident=self.incident, name='Escuela', lat=-35.02, lng=-69.32,
+                                              capacity=100, occupants=10)
+        Hospital.objects.create(incident=self.incident, name='Hospital', lat=-35.03, lng=-69.31, total_beds=40)
+        start = timezone.now() - datetime.timedelta(hours=2)
+        ingest.insert_points(self.incident.pk, [
+            (start + datetime.timedelta(minutes=i, microseconds=i), 'fatalities', float(i), 'censo' if i == 3 else '')
+            for i in range(60)
+        ])
+
+    def points(self, incident):
+        return sorted(MetricPoint.objects.filter(incident=incident).values_list('metric', 'timestamp', 'value', 'note'))
+
+    def from_node(self, bundle, node, **changes):
+        """El mismo paquete, como si lo hubiera generado `node`."""
+        payload = sync.unpack(bundle)
+        payload.update(node=node, **changes)
+        return sync.pack(payload, sync.shared_key(node))
+
+    def test_full_bundle_recreates_the_incident_on_another_node(self):
+        bundle, info = sync.export(self.incident.pk, peer='b')
+        self.assertEqual((info['resources'], info['points']), (2, 60))
+        expected, uid = self.points(self.incident), self.incident.uid
+        self.incident.delete()
+        with override_settings(DASHBOARD_NODE_ID='b'):
+            result = sync.apply(bundle)
+        copy = IncidentSummary.objects.get(uid=uid)
+        self.assertEqual(result['points'], {"added": 60, "repeated": 0})
+        self.assertEqual(self.points(copy), expected)
+        self.assertEqual(Shelter.objects.get(incident=copy).occupants, 10)
+        self.assertEqual(ResourceChange.objects.filter(incident=copy, model='shelters').get().origin, 'a')
+
+    def test_incremental_bundle_is_small_and_idempotent(self):
+        _, full = sync.export(self.incident.pk, peer='b')
+        self.shelter.occupants = 40
+        self.shelter.save()
+        ingest.insert_points(self.incident.pk, [(timezone.now(), 'fatalities', 99.0, '')])
+        bundle, info = sync.export(self.incident.pk, peer='b', since=full['cursor'])
+        self.assertEqual((info['resources'], info['points']), (1, 1))
+        self.assertLess(len(bundle), 1024)
+        # este nodo ya tiene todo: reimportarlo no cambia nada
+        result = sync.apply(self.from_node(bundle, 'b'), force=True)
+        self.assertEqual(result['points'], {"added": 0, "repeated": 1})
+        self.assertEqual(result['resources']['shelters'], (0, 0, 1))
+
+    def test_newest_version_wins_and_ties_go_to_the_greater_node(self):
+        payload = sync.unpack(self.from_node(sync.export(self.incident.pk, peer='b')[0], 'b'))
+        row = payload['resources']['shelters']['rows'][0]
+        occupants = payload['resources']['shelters']['fields'].index('occupants') + 3
+        local_at = row[0]
+        payload['resources'] = {'shelters': payload['resources']['shelters']}
+        for at, node, value, applied in ((local_at - 10**6, 'z', 1, False), (local_at, '0', 2, False),
+                                         (local_at, 'z', 3, True), (local_at + 10**6, 'b', 4, True)):
+            with self.subTest(at=at - local_at, node=node):
+                row[:2], row[occupants] = [at, node], value
+                sync.apply(sync.pack({**payload, "node": node}, sync.shared_key(node)), force=True)
+                self.shelter.refresh_from_db()
+                self.assertEqual(self.shelter.occupants == value, applied)
+        # una edición local posterior gana aunque el reloj del otro nodo adelante
+        self.shelter.occupants = 5
+        self.shelter.save()
+        at, node = sync._versions(self.incident.pk, 'shelters', [self.shelter.pk])[self.shelter.pk]
+        self.assertGreater((at, node), (local_at + 10**6, 'b'))
+
+    def test_gaps_echo_and_corruption_are_detected(self):
+        bundle, _ = sync.export(self.incident.pk, peer='y')
+        with self.assertRaisesMessage(sync.SyncError, 'falta un paquete'):
+            sync.apply(self.from_node(bundle, 'y', since='5.5'))
+        payload = sync.unpack(self.from_node(bundle, 'z'))
+        payload.update(resources={}, metrics={'fatalities': {"t": [sync._to_us(timezone.now())], "v": [7.0]}})
+        self.assertEqual(sync.apply(sync.pack(payload, sync.shared_key('z')))['points']['added'], 1)
+        # lo que vino de z no vuelve a z
+        self.assertEqual(sync.export(self.incident.pk, peer='z')[1]['points'], 60)
+        self.assertEqual(sync.export(self.incident.pk, peer='y')[1]['points'], 61)
+        damaged = self.from_node(bundle, 'y')
+        damaged = damaged[:-1] + bytes([damaged[-1] ^ 1])
+        with self.assertRaisesMessage(sync.SyncError, 'firma inválida'):
+            sync.apply(damaged)
+
+    def test_bundles_must_be_signed_by_the_source_node(self):
+        payload = sync.unpack(self.from_node(sync.export(self.incident.pk, peer='b')[0], 'b'))
+        future = timezone.now() + datetime.timedelta(days=365)
+        payload.update(incident={"uid": str(uuid.uuid4()), "created_at": sync._to_us(future)}, since='0.0')
+        with self.assertRaisesMessage(sync.SyncError, 'firma inválida'):
+            sync.apply(sync.pack(payload, b'otra clave'))
+        with self.assertRaisesMessage(sync.SyncError, 'no hay clave'):
+            sync.apply(sync.pack({**payload, "node": 'x'}, b'clave-compartida'))
+        # firmado por b, pero el contenido dice venir de y
+        body = sync.pack({**payload, "node": 'y'}, b'')[len(sync.MAGIC) + 67:]
+        with self.assertRaisesMessage(sync.SyncError, 'no coincide'):
+            sync.apply(sync.MAGIC + b'b\n' + sync._signature(sync.shared_key('b'), b'b', body) + b'\n' + body)
+        with self.assertRaisesMessage(sync.SyncError, 'destino'):
+            sync.export(self.incident.pk)
+        forged = sync.pack(payload, b'otra clave')
+        response = self.client.post('/api/sync/import/', forged, content_type='text/plain')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(IncidentSummary.objects.count(), 1)
+        # firmado: se importa, pero un created_at futuro no lo vuelve el incidente actual
+        imported = sync.apply(sync.pack(payload, sync.shared_key('b')))['incident']
+        self.assertLessEqual(IncidentSummary.objects.get(pk=imported).created_at, timezone.now())
+        local = IncidentSummary.objects.create()
+        self.assertEqual(incidents.current_id(), local.pk)
+
+    def test_decompressed_size_is_bounded(self):
+        payload = sync.unpack(self.from_node(sync.export(self.incident.pk, peer='b')[0], 'b'))
+        bomb = sync.pack({**payload, "padding": "0" * 100_000}, sync.shared_key('b'))
+        self.assertLess(len(bomb), 10_000)
+        with mock.patch.object(sync, 'MAX_PAYLOAD_BYTES', 50_000):
+            with self.assertRaisesMessage(sync.SyncError, 'supera'):
+                sync.apply(bomb)
+
+    def test_http_export_and_import(self):
+        response = self.client.get(f'/api/incidents/{self.incident.pk}/sync/', {'node': 'b'})
+        self.assertEqual(response['Content-Type'], sync.CONTENT_TYPE)
+        self.assertEqual(response['X-Sync-Cursor'], sync.unpack(response.content)['cursor'])
+        own = self.client.post('/api/sync/import/', response.content, content_type=sync.CONTENT_TYPE)
+        self.assertEqual(own.status_code, 400)
+        imported = self.client.post('/api/sync/import/', self.from_node(response.content, 'b', ack='0.0', peer='a'),
+                                    content_type=sync.CONTENT_TYPE)
+        self.assertEqual(imported.json()['points'], {"added": 0, "repeated": 60})
+        self.assertEqual(self.client.get('/api/sync/', {'node': 'b', 'since': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/sync/').status_code, 400)
+
+
+class PerfTests(IncidentTestCase):
+    def setUp(self):
+        super().setUp()
+        perf.registry.reset()
+        Bridge.objects.create(incident=self.incident, name="Puente", lat=-34.6, lng=-58.4, status="open")
+
+    def test_server_timing_and_per_view_histograms(self):
+        for _ in range(3):
+            response = self.client.get('/api/resources/', {'bbox': '-180,-90,180,90'})
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ consultas", serialize;dur=')
+        data = self.client.get('/api/_perf/').json()
+        view = data['views']['api_resources']
+        self.assertEqual(view['wall_ms']['count'], 3)
+        self.assertGreaterEqual(view['queries']['p50'], 1)
+        self.assertEqual(view['bytes']['max'], len(response.content))
+        self.assertLessEqual(view['wall_ms']['p50'], view['wall_ms']['p99'])
+
+    def test_streaming_response_is_measured_when_consumed(self):
+        ingest.insert_points(self.incident.pk, [(timezone.now(), 'm', float(i), '') for i in range(10)])
+        perf.registry.reset()
+        response = self.client.get('/api/metrics/')
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content)
+        view = perf.registry.snapshot()['api_metrics']
+        self.assertEqual(view['bytes']['max'], len(body))
+        self.assertGreaterEqual(view['queries']['max'], 1)
+
+    def test_prometheus_export(self):
+        self.client.get('/api/resources/', {'bbox': '-180,-90,180,90'})
+        text = self.client.get('/api/_perf/', {'format': 'prometheus'}).content.decode()
+        self.assertIn('# TYPE dashboard_request_seconds summary', text)
+        self.assertIn('dashboard_request_seconds{view="api_resources",quantile="0.99"}', text)
+        self.assertIn('dashboard_request_queries_count{view="api_resources"} 1', text)
+
+    @override_settings(DASHBOARD_PERF_SLOW_MS=0)
+    def test_slow_requests_are_logged_with_sql(self):
+        with self.assertLogs('dashboard.perf', 'WARNING') as logs:
+            self.client.get('/api/resources/', {'bbox': '-180,-90,180,90'})
+            # el SQL de los lentos no se expone a usuarios anónimos sin DEBUG
+            slow = self.client.get('/api/_perf/').json()['slow']
+        self.assertIn('api_resources', logs.output[0])
+        self.assertIn('dashboard_bridge', logs.output[0])
+        self.assertEqual(slow[-1]['view'], 'api_resources')
+        self.assertEqual(slow[-1]['sql'], [])
+
+    def test_keeps_the_slowest_queries(self):
+        stats = perf.RequestStats('v')
+        for i, elapsed in enumerate([3.0, 1.0, 9.0, 2.0, 7.0, 8.0, 0.5, 6.0] * 10):
+            stats.add_query(elapsed + i / 1000, 'default', f'q{i}')
+        self.assertEqual(stats.queries, 80)
+        self.assertEqual([round(ms) for ms, _, _ in sorted(stats.sql, reverse=True)], [9, 9, 9, 9, 9])
+        self.assertEqual(max(stats.sql)[2], 'q74')
+
+    def test_histogram_quantiles_are_within_bucket_error(self):
+        hist = perf.Histogram(0.05)
+        for value in range(1, 1001):
+            hist.add(float(value))
+        self.assertAlmostEqual(hist.quantile(0.5), 500, delta=500 * 0.2)
+        self.assertAlmostEqual(hist.quantile(0.99), 990, delta=990 * 0.2)
+        self.assertEqual(hist.quantile(1.0), 1000)
+
+
+class OccupancyTests(IncidentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.shelter = Shelter.objects.create(incident=self.incident, name='Escuela', lat=-35.02, lng=-69.32,
+                                              capacity=10, occupants=8)
+        self.hospital = Hospital.objects.create(incident=self.incident, name='Hospital', lat=-35.03, lng=-69.31,
+                                                total_beds=5, available_beds=1)
+
+    def post(self, path, body=None):
+        return self.client.post(path, json.dumps(body or {}), content_type='application/json')
+
+    def test_checkin_enforces_capacity_and_returns_new_value(self):
+        url = f'/api/shelters/{self.shelter.pk}/checkin/'
+        response = self.post(url, {'count': 2})
+        self.assertEqual((response.status_code, response.json()['occupants']), (200, 10))
+        rejected = self.post(url)
+        self.assertEqual(rejected.status_code, 409)
+        self.assertEqual((rejected.json()['occupants'], rejected.json()['capacity']), (10, 10))
+        self.assertEqual(self.post(f'/api/shelters/{self.shelter.pk}/checkout/', {'count': 11}).status_code, 409)
+        self.assertEqual(self.post(f'/api/shelters/{self.shelter.pk}/checkout/', {'count': 10}).json()['occupants'], 0)
+        self.shelter.refresh_from_db()
+        self.assertEqual(self.shelter.occupants, 0)
+        self.assertEqual(self.post(url, {'count': 0}).status_code, 400)
+        form = self.client.post(url, '{"count": 1}', content_type='text/plain')
+        self.assertEqual(form.status_code, 415)
+        self.assertEqual(Shelter.objects.get(pk=self.shelter.pk).occupants, 0)
+
+    def test_hospital_admit_and_discharge_move_available_beds(self):
+        self.assertEqual(self.post(f'/api/hospitals/{self.hospital.pk}/admit/').json()['available_beds'], 0)
+        self.assertEqual(self.post(f'/api/hospitals/{self.hospital.pk}/admit/').status_code, 409)
+        self.assertEqual(self.post(f'/api/hospitals/{self.hospital.pk}/discharge/', {'count': 5}).json()['available_beds'], 5)
+        self.assertEqual(self.post(f'/api/hospitals/{self.hospital.pk}/discharge/').status_code, 409)
+
+    def test_other_incidents_resources_are_not_found(self):
+        other = IncidentSummary.objects.create()
+        self.assertEqual(self.post(f'/api/incidents/{other.pk}/shelters/{self.shelter.pk}/checkin/').status_code, 404)
+        self.assertEqual(self.post(f'/api/incidents/{self.incident.pk}/shelters/{self.shelter.pk}/checkin/').status_code, 200)
+
+    def test_updates_are_recorded_in_the_change_feed(self):
+        cursor = self.client.get('/api/delta/').json()['cursor']
+        self.post('/api/occupancy/', {'ops': [
+            {'action': 'checkin', 'id': self.shelter.pk}, {'action': 'checkin', 'id': self.shelter.pk},
+            {'action': 'admit', 'id': self.hospital.pk},
+        ]})
+        delta = self.client.get('/api/delta/', {'since': cursor}).json()
+        self.assertEqual([s['occupants'] for s in delta['shelters']], [10])
+        self.assertEqual([h['available_beds'] for h in delta['hospitals']], [0])
+
+    def test_batches_apply_each_op_or_nothing_when_atomic(self):
+        ops = [{'action': 'checkin', 'id': self.shelter.pk, 'count': 2},
+               {'action': 'admit', 'id': self.hospital.pk, 'count': 2},
+               {'action': 'admit', 'id': self.hospital.pk}]
+        atomic = self.post('/api/occupancy/', {'ops': ops, 'atomic': True})
+        self.assertEqual(atomic.status_code, 409)
+        self.assertEqual([r['ok'] for r in atomic.json()['results']], [True, False])
+        self.shelter.refresh_from_db()
+        self.assertEqual(self.shelter.occupants, 8)
+        partial = self.post('/api/occupancy/', {'ops': ops}).json()
+        self.assertEqual((partial['applied'], [r['ok'] for r in partial['results']]), (2, [True, False, True]))
+        self.assertEqual(partial['results'][2]['available_beds'], 0)
+        self.assertEqual(self.post('/api/occupancy/', {'ops': [{'action': 'checkin', 'id': 'x'}]}).status_code, 400)
+
+    def test_fallback_without_returning(self):
+        with mock.patch('dashboard.occupancy._returning', return_value=False):
+            results = occupancy.apply(self.incident.pk, [('checkin', self.shelter.pk, 2), ('checkin', self.shelter.pk, 1)])
+        self.assertEqual([(r['ok'], r['occupants']) for r in results], [(True, 10), (False, 10)])
+
+
+class ClusterTests(IncidentTestCase):
+    def setUp(self):
+        super().setUp()
+        clusters.reset()
+        self.addCleanup(clusters.reset)
+        self.bridges = [
+            Bridge.objects.create(incident=self.incident, name=f'Puente {i}', lat=-35.02 + i * 0.001, lng=-69.32,
+                                  status=status)
+            for i, status in enumerate(['ok', 'parcialmente', 'derribado'])
+        ]
+        self.hospital = Hospital.objects.create(incident=self.incident, name='Hospital', lat=-35.03, lng=-69.31,
+                                                total_beds=40, available_beds=10)
+        Hospital.objects.create(incident=self.incident, name='Puesto', lat=-35.031, lng=-69.311, total_beds=10,
+                                available_beds=5, operational=False)
+        Shelter.objects.create(incident=self.incident, name='Escuela', lat=-35.0, lng=-69.3, capacity=100,
+                               occupants=60)
+
+    def get_tile(self, z, lat=-35.02, lng=-69.32, headers=None, **params):
+        x, y = clusters.tile_for(lat, lng, z)
+        return self.client.get(f'/api/clusters/{z}/{x}/{y}/', params, headers=headers)
+
+    def by_type(self, response):
+        return {f['type']: f for f in response.json()['features']}
+
+    def test_low_zoom_groups_sum_and_worst_status(self):
+        features = self.by_type(self.get_tile(8))
+        self.assertEqual(features['bridges']['count'], 3)
+        self.assertEqual(features['bridges']['status'], 'derribado')
+        self.assertEqual(features['bridges']['statuses'], {'ok': 1, 'parcialmente': 1, 'derribado': 1})
+        hospitals = features['hospitals']
+        self.assertEqual((hospitals['count'], hospitals['total_beds'], hospitals['available_beds'],
+                          hospitals['operational']), (2, 50, 15, 1))
+        self.assertAlmostEqual(hospitals['lat'], -35.0305)
+        # un grupo de un solo recurso trae sus campos completos
+        self.assertEqual(features['shelters']['name'], 'Escuela')
+        self.assertEqual(features['shelters']['occupancy_pct'], 60.0)
+
+    def test_high_zoom_returns_single_resources_of_the_tile(self):
+        response = self.get_tile(19, lat=self.hospital.lat, lng=self.hospital.lng, types='hospitals')
+        self.assertEqual([(f['id'], f['count']) for f in response.json()['features']], [(self.hospital.id, 1)])
+        self.assertEqual(self.get_tile(8, types='hospitals,bogus').status_code, 400)
+        self.assertEqual(self.client.get('/api/clusters/3/9/0/').status_code, 400)
+
+    def test_changes_are_applied_incrementally(self):
+        self.get_tile(8)
+        rng = random.Random(7)
+        for bridge in self.bridges[:2]:
+            bridge.lat, bridge.status = bridge.lat + rng.uniform(-0.5, 0.5), 'derribado'
+            bridge.save()
+        self.hospital.delete()
+        for i in range(20):
+            Shelter.objects.create(incident=self.incident, name=f'R{i}', lat=-35 + rng.uniform(-1, 1),
+                                   lng=-69.3 + rng.uniform(-1, 1), capacity=10, occupants=i)
+        with self.assertNumQueries(3):
+            # feed de cambios + releer puentes y refugios tocados; el hospital borrado no se relee
+            self.get_tile(8)
+        cached = clusters.pyramid(self.incident.pk)
+        rebuilt = clusters.Pyramid.build(self.incident.pk, cached.cursor)
+        for z in (0, 6, 10, clusters.MAX_ZOOM):
+            self.assertEqual(set(cached.levels[z]), set(rebuilt.levels[z]))
+            for key, agg in rebuilt.levels[z].items():
+                self.assertEqual([round(v, 9) if isinstance(v, float) else v for v in cached.levels[z][key]],
+                                 [round(v, 9) if isinstance(v, float) else v for v in agg])
+
+    def test_etag_and_vector_tile(self):
+        first = self.get_tile(8)
+        self.assertEqual(self.get_tile(8, headers={'If-None-Match': first['ETag']}).status_code, 304)
+        mvt = self.get_tile(8, format='mvt')
+        self.assertEqual(mvt['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        layers = {}
+        for _, body in self.protobuf_fields(mvt.content):
+            fields = dict(self.protobuf_fields(body))
+            layers[fields[1].decode()] = sum(1 for number, _ in self.protobuf_fields(body) if number == 2)
+        self.assertEqual(layers, {'bridges': 1, 'hospitals': 1, 'shelters': 1})
+        self.bridges[0].delete()
+        self.assertEqual(self.get_tile(8, headers={'If-None-Match': first['ETag']}).status_code, 200)
+
+    @staticmethod
+    def protobuf_fields(data):
+        """(número de campo, bytes) de los campos de largo variable de un mensaje protobuf."""
+        def varint(i):
+            value = shift = 0
+            while True:
+                byte = data[i]
+                value |= (byte & 0x7F) << shift
+                i, shift = i + 1, shift + 7
+                if not byte & 0x80:
+                    return value, i
+        i = 0
+        while i < len(data):
+            key, i = varint(i)
+            wire = key & 7
+            if wire == 0:
+                _, i = varint(i)
+            elif wire == 1:
+                i += 8
+            else:
+                length, i = varint(i)
+                yield key >> 3, data[i:i + length]
+                i += length
+
+
+class TileTests(IncidentTestCase):
+    BBOX = (-35.05, -69.35, -35.0, -69.3)
+
+    def setUp(self):
+        super().setUp()
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.path = os.path.join(workdir.name, 'tiles.mbtiles')
+        override = override_settings(DASHBOARD_TILES=self.path)
+        override.enable()
+        self.addCleanup(override.disable)
+        tiles.reset()
+        self.addCleanup(tiles.reset)
+        # los tests cambian el archivo y esperan verlo enseguida
+        patcher = mock.patch.object(tiles, 'CHECK_SECONDS', 0.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def fake_png(z, x, y):
+        return b'\x89PNG' + f'{z}/{x}/{y}'.encode() * 40
+
+    def seed(self, fetch=None, **kwargs):
+        return tiles.seed(self.path, fetch or self.fake_png, self.BBOX, 10, 12, **kwargs)
+
+    def test_seed_stores_tms_rows_and_skips_existing(self):
+        stats = self.seed()
+        self.assertEqual(stats['added'], tiles.count(self.BBOX, 10, 12))
+        x0, y0, _, _ = tiles.tile_range(*self.BBOX, 12)
+        with sqlite3.connect(self.path) as conn:
+            (data,), = conn.execute(tiles.SELECT_TILE, (12, x0, (1 << 12) - 1 - y0))
+            metadata = dict(conn.execute('SELECT name, value FROM metadata'))
+        self.assertEqual(bytes(data), self.fake_png(12, x0, y0))
+        self.assertEqual((metadata['minzoom'], metadata['maxzoom'], metadata['format']), ('10', '12', 'png'))
+        again = self.seed(fetch=mock.Mock(side_effect=AssertionError))
+        self.assertEqual((again['added'], again['kept']), (0, stats['added']))
+
+    def test_tile_view_headers_and_revalidation(self):
+        self.seed()
+        x0, y0, _, _ = tiles.tile_range(*self.BBOX, 12)
+        url = f'/tiles/12/{x0}/{y0}.png'
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response.content, self.fake_png(12, x0, y0))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn(f'max-age={tiles.MAX_AGE}', response['Cache-Control'])
+        cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+        self.assertEqual(self.client.get('/tiles/12/0/0.png').status_code, 404)
+        self.assertEqual(self.client.get('/tiles/3/8/0.png').status_code, 404)
+
+    def test_lru_serves_hits_and_is_dropped_when_the_file_changes(self):
+        self.seed()
+        x0, y0, _, _ = tiles.tile_range(*self.BBOX, 11)
+        first = tiles.get(11, x0, y0)
+        cache = tiles.tileset().cache
+        with mock.patch.object(tiles.Tileset, '_query', side_effect=AssertionError):
+            self.assertEqual(tiles.get(11, x0, y0), first)
+        self.assertEqual(cache.hits, 1)
+        self.seed(fetch=lambda z, x, y: b'\x89PNG nueva' * 20, force=True)
+        # el mtime tiene resolución gruesa en algunos sistemas de archivos
+        os.utime(self.path, ns=(0, os.stat(self.path).st_mtime_ns + 10 ** 9))
+        second = tiles.get(11, x0, y0)
+        self.assertNotEqual(second[1], first[1])
+        self.assertEqual(second[0], b'\x89PNG nueva' * 20)
+
+    def test_lru_is_bounded_by_bytes(self):
+        cache = tiles.LRUCache(100)
+        for key in range(5):
+            cache.put(key, key, 30)
+        self.assertEqual((len(cache), cache.bytes), (3, 90))
+        self.assertIsNone(cache.get(0))
+        cache.get(2)
+        cache.put(5, 5, 30)
+        self.assertIsNone(cache.get(3))
+        self.assertEqual(cache.get(2), 2)
+
+    @override_settings(DASHBOARD_TILE_SOURCE='https://tiles.example/{z}/{x}/{y}.png')
+    def test_missing_file_is_503_and_dashboard_uses_the_source(self):
+        self.assertEqual(self.client.get('/tiles/1/0/0.png').status_code, 503)
+        self.assertEqual(tiles.layer()['url'], 'https://tiles.example/{z}/{x}/{y}.png')
+        self.seed()
+        layer = tiles.layer()
+        self.assertEqual((layer['url'], layer['maxNativeZoom']), ('/tiles/{z}/{x}/{y}.png', 12))
+        self.assertContains(self.client.get('/'), '/tiles/{z}/{x}/{y}.png')
+
+    def test_seed_command_copies_incident_area_from_mbtiles(self):
+        Hospital.objects.create(incident=self.incident, name='Hospital', lat=-35.1, lng=-69.4)
+        source = self.path + '.region'
+        tiles.seed(source, self.fake_png, (-36.0, -70.0, -34.0, -68.0), 8, 11)
+        out = io.StringIO()
+        call_command('seed_tiles', source=source, min_zoom=8, max_zoom=11, margin_km=1, stdout=out)
+        south, west, north, east = tiles.incident_bbox(self.incident.pk, 1)
+        self.assertLess(south, -35.1)
+        self.assertGreater(east, -69.33)
+        expected = tiles.count((south, west, north, east), 8, 11)
+        self.assertIn(f'{expected:,} teselas nuevas', out.getvalue())
+        x, y = tiles.tile_range(south, west, north, east, 11)[:2]
+        self.assertEqual(tiles.get(11, x, y)[0], self.fake_png(11, x, y))
+        with self.assertRaises(CommandError):
+            call_command('seed_tiles', source=source, max_zoom=18, stdout=io.StringIO())
+
+    @override_settings(DASHBOARD_TILE_SOURCE='https://tile.openstreetmap.org/{z}/{x}/{y}.png')
+    def test_seed_command_refuses_bulk_downloads_from_openstreetmap(self):
+        for source in (None, 'https://a.tile.openstreetmap.org/{z}/{x}/{y}.png'):
+            with self.subTest(source=source), mock.patch.object(tiles, 'seed') as seed:
+                with self.assertRaisesMessage(CommandError, 'no permite descargas masivas'):
+                    call_command('seed_tiles', source=source, min_zoom=10, max_zoom=12, stdout=io.StringIO())
+                seed.assert_not_called()
+        with mock.patch.object(tiles, 'seed', return_value=dict.fromkeys(('added', 'kept', 'missing', 'bytes'), 0)):
+            call_command('seed_tiles', min_zoom=12, max_zoom=12, stdout=io.StringIO())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AsgiViewTests(TransactionTestCase):
+    """Vistas servidas por ASGI: las consultas van a otros hilos, que solo ven filas confirmadas."""
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.addCleanup(incidents.forget)
+        self.addCleanup(snapshot.clear_local_snapshot)
+        perf.registry.reset()
+        self.incident = IncidentSummary.objects.create()
+        Bridge.objects.create(incident=self.incident, name="Puente", lat=-34.6, lng=-58.4, status="open")
+        Shelter.objects.create(incident=self.incident, name="Refugio", lat=-34.61, lng=-58.41, capacity=10)
+        incidents.resolve()
+
+    async def test_summary_gathers_queries_in_the_pool(self):
+        response = await self.async_client.get('/api/summary/')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual([row['name'] for row in data['bridges']], ["Puente"])
+        self.assertEqual([row['name'] for row in data['shelters']], ["Refugio"])
+        self.assertEqual(data['hospitals'], [])
+        # las cinco consultas corrieron en hilos del pool y igual se cuentan (ver perf.py)
+        self.assertIn('desc="5 consultas"', response['Server-Timing'])
+        again = await self.async_client.get('/api/summary/', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again['ETag'], response['ETag'])
+
+    async def test_raw_metrics_stream_asynchronously_and_compressed(self):
+        await asyncio.to_thread(
+            ingest.insert_points, self.incident.pk, [(timezone.now(), 'm', float(i), '') for i in range(50)]
+        )
+        response = await self.async_client.get('/api/metrics/', headers={'Accept-Encoding': 'gzip'})
+        self.assertTrue(response.is_async)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual([point['value'] for point in json.loads(gzip.decompress(body))['m']], list(map(float, range(50))))
+        view = perf.registry.snapshot()['api_metrics']
+        self.assertEqual(view['bytes']['max'], len(body))
+        self.assertGreaterEqual(view['queries']['max'], 1)
+
+    async def test_dashboard_and_missing_incident(self):
+        response = await self.async_client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f'/api/incidents/{self.incident.pk}/')
+        missing = await self.async_client.get(f'/api/incidents/{self.incident.pk + 1}/summary/')
+        self.assertEqual(missing.status_code, 404)
+
+
+@override_settings(DASHBOARD_JOB_WORKERS=0, CACHES=TEST_CACHES)
+class LoadTestTests(LiveServerTestCase):
+    """Clientes de load_test contra un servidor real (el WSGI de LiveServerTestCase)."""
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.addCleanup(incidents.forget)
+        self.addCleanup(snapshot.clear_local_snapshot)
+        self.incident = IncidentSummary.objects.create()
+        Shelter.objects.create(incident=self.incident, name="Refugio", lat=-35.02, lng=-69.32, capacity=10)
+
+    def test_clients_load_the_dashboard_poll_and_post_with_csrf(self):
+        # un solo cliente: los hilos del servidor de prueba comparten la conexión SQLite
+        # en memoria y el simulate de un cliente se mezclaría con los pedidos del otro
+        report = asyncio.run(loadtest.run(self.live_server_url, [(1, 1.5)], poll=0.2, simulate_every=0.2))
+        stage = report['stages'][0]
+        self.assertLessEqual({'page', 'delta', 'metrics', 'clusters', 'simulate'}, set(stage['endpoints']))
+        self.assertEqual(stage['total']['errors'], 0, stage)
+        self.assertGreater(stage['endpoints']['delta']['requests'], 2)
+        self.assertEqual(stage['endpoints']['clusters']['requests'], len(loadtest.viewport_tiles(-35.02, -69.32)))
+        self.assertTrue(Job.objects.filter(kind='simulate').exists())
+
+    def test_knee_is_the_last_stage_that_still_added_throughput(self):
+        def stage(clients, rps, error_rate=0.0):
+            return {"clients": clients, "total": {"rps": rps, "p95_ms": 10.0, "error_rate": error_rate}}
+
+        self.assertEqual(loadtest.parse_profile('10:30,20:5.5'), [(10, 30.0), (20, 5.5)])
+        with self.assertRaises(loadtest.LoadTestError):
+            loadtest.parse_profile('10')
+        stages = [stage(10, 100), stage(20, 190), stage(40, 200), stage(80, 150)]
+        self.assertEqual(loadtest.knee(stages), {"clients": 20, "rps": 190, "p95_ms": 10.0, "saturated": True})
+        self.assertFalse(loadtest.knee(stages[:2])['saturated'])
+        self.assertEqual(loadtest.knee([stage(10, 100), stage(20, 300, error_rate=0.2)])['clients'], 10)
+
+
+@override_settings(DASHBOARD_JOB_WORKERS=0, CACHES=TEST_CACHES)
+class QueryCountTests(TestCase):
+    """La cantidad de consultas por endpoint no debe crecer con los datos."""
+
+    MAX_QUERIES = {
+        ('dashboard_view', 'default'): 1,
+        ('api_summary', 'cold'): 5,
+        ('api_summary', 'not_modified'): 0,
+        ('api_summary', 'as_of'): 3,
+        ('api_metrics', 'full'): 2,
+        ('api_metrics', 'points=500'): 2,
+        ('api_metrics', 'binary'): 2,
+        ('api_clusters', 'z8'): 1,
+        ('api_clusters', 'z8 mvt'): 1,
+        ('api_allocation', 'shelters'): 2,
+        ('api_delta', 'idle'): 2,
+        ('api_simulate', 'default'): 29,
+    }
+
+    def test_query_count_is_independent_of_data_size(self):
+        self.addCleanup(incidents.forget)
+        counts = {}
+        for sizes in (benchmarks.SCALES['tiny'], dict(shelters=60, hospitals=15, bridges=30, metric_points=800)):
+            benchmarks.seed(sizes)
+            for case in benchmarks.CASES:
+                counts.setdefault(case, []).append(benchmarks.measure(case, repeat=1)['queries'])
+        self.assertEqual(set(counts), set(self.MAX_QUERIES))
+        for case, (small, large) in counts.items():
+            with self.subTest(case=case):
+                self.assertEqual(small, large)
+                self.assertLessEqual(large, self.MAX_QUERIES[case])
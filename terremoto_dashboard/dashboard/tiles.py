@@ -0,0 +1,438 @@
+"""
+Teselas del mapa desde un archivo MBTiles local.
+
+El mapa tiene que andar sin conexión: /tiles/{z}/{x}/{y}.png sirve las teselas
+de un MBTiles (SQLite, filas en esquema TMS) configurado en DASHBOARD_TILES,
+que se llena de antemano con seed_tiles para la zona del incidente (desde un
+servidor de teselas o desde un MBTiles regional más grande).
+
+Las lecturas usan un pool de conexiones de solo lectura y pasan por un LRU en
+memoria acotado por bytes (DASHBOARD_TILE_CACHE_MB): un acierto no toca la
+base. Las teselas que faltan también se cachean. Si el archivo cambia (p. ej.
+seed_tiles agregó teselas) el LRU, el pool y los metadatos se descartan; se
+revisa a lo sumo cada CHECK_SECONDS.
+"""
+import hashlib
+import math
+import queue
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from pathlib import Path
+
+from django.conf import settings
+from django.urls import reverse
+
+from .models import EPICENTER, Bridge, Hospital, Shelter
+
+MAX_ZOOM = 22
+# las teselas no cambian salvo que se vuelva a sembrar con --force: el ETag cubre ese caso
+MAX_AGE = 7 * 86400
+MISSING_MAX_AGE = 3600
+CHECK_SECONDS = 2.0
+POOL_SIZE = 8
+DEFAULT_CACHE_MB = 64
+# lo que cuenta en el LRU una tesela que no está en el archivo
+MISSING_BYTES = 64
+CONTENT_TYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+DEFAULT_ATTRIBUTION = '&copy; colaboradores de OpenStreetMap'
+USER_AGENT = 'terremoto-dashboard seed_tiles'
+SEED_BATCH = 500
+# servidores cuya política de uso prohíbe las descargas masivas: seed() desde
+# ellos solo para un nivel (ver check_seed_source)
+NO_BULK_HOSTS = ('openstreetmap.org',)
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS name ON metadata (name)",
+    "CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)",
+)
+SELECT_TILE = "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?"
+
+
+class TilesUnavailable(RuntimeError):
+    """No hay MBTiles configurado o no se pudo leer."""
+
+
+class TileError(ValueError):
+    """Parámetros de siembra inválidos (bbox, zooms, origen)."""
+
+
+def _tms_row(z, y):
+    return (1 << z) - 1 - y
+
+
+def tile_etag(data):
+    return '"%s"' % hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+class LRUCache:
+    """Cache (clave -> valor) acotado por la suma de los tamaños declarados en put()."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._items[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, dropped) = self._items.popitem(last=False)
+                self.bytes -= dropped
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+
+class Tileset:
+    """Un archivo MBTiles abierto en solo lectura, con su LRU."""
+
+    def __init__(self, path, cache_bytes, pool_size=POOL_SIZE):
+        self.path = Path(path)
+        self.cache = LRUCache(cache_bytes)
+        self.pool_size = pool_size
+        self._pool = queue.LifoQueue()
+        self._signature = None
+        self._metadata = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        try:
+            # mode=ro: nunca escribe ni crea el archivo si falta
+            return sqlite3.connect(f'{self.path.resolve().as_uri()}?mode=ro', uri=True, check_same_thread=False)
+        except sqlite3.Error as exc:
+            raise TilesUnavailable(f"no se pudo abrir {self.path}: {exc}")
+
+    def _query(self, sql, params=()):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        except sqlite3.Error as exc:
+            conn.close()
+            raise TilesUnavailable(f"no se pudo leer {self.path}: {exc}")
+        if self._pool.qsize() < self.pool_size:
+            self._pool.put(conn)
+        else:
+            conn.close()
+        return rows
+
+    def _drain(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _check(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        with self._lock:
+            if now < self._next_check:
+                return
+            try:
+                stat = self.path.stat()
+                signature = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                signature = None
+            if signature != self._signature:
+                self.cache.clear()
+                self._drain()
+                self._metadata = None
+                self._signature = signature
+            self._next_check = now + CHECK_SECONDS
+
+    def available(self):
+        self._check()
+        return self._signature is not None
+
+    def get(self, z, x, y):
+        """(datos, etag) de la tesela XYZ, o None si no está en el archivo."""
+        self._check()
+        key = (z, x, y)
+        entry = self.cache.get(key)
+        if entry is None:
+            if self._signature is None:
+                raise TilesUnavailable(f"no existe el archivo de teselas {self.path}")
+            rows = self._query(SELECT_TILE, (z, x, _tms_row(z, y)))
+            data = bytes(rows[0][0]) if rows else None
+            entry = (data, tile_etag(data)) if data else (None, None)
+            self.cache.put(key, entry, len(data) if data else MISSING_BYTES)
+        return entry if entry[0] is not None else None
+
+    def metadata(self):
+        self._check()
+        if self._metadata is None:
+            if self._signature is None:
+                raise TilesUnavailable(f"no existe el archivo de teselas {self.path}")
+            self._metadata = dict(self._query("SELECT name, value FROM metadata"))
+        return self._metadata
+
+    def content_type(self):
+        return CONTENT_TYPES.get(self.metadata().get('format', 'png'), 'application/octet-stream')
+
+    def close(self):
+        self._drain()
+        self.cache.clear()
+
+
+# un Tileset por proceso, rehecho si cambia DASHBOARD_TILES
+_lock = threading.Lock()
+_state = {"path": None, "tileset": None}
+
+
+def reset():
+    with _lock:
+        if _state['tileset'] is not None:
+            _state['tileset'].close()
+        _state.update(path=None, tileset=None)
+
+
+def tileset():
+    path = getattr(settings, 'DASHBOARD_TILES', None)
+    if not path:
+        raise TilesUnavailable("no hay archivo de teselas configurado (DASHBOARD_TILES)")
+    current = _state['tileset']
+    if current is not None and _state['path'] == str(path):
+        return current
+    with _lock:
+        if _state['tileset'] is None or _state['path'] != str(path):
+            if _state['tileset'] is not None:
+                _state['tileset'].close()
+            megabytes = getattr(settings, 'DASHBOARD_TILE_CACHE_MB', DEFAULT_CACHE_MB)
+            _state.update(path=str(path), tileset=Tileset(path, int(megabytes * 1024 * 1024)))
+        return _state['tileset']
+
+
+def get(z, x, y):
+    """(datos, etag) o None; también None si z/x/y están fuera de la grilla."""
+    if not (0 <= z <= MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        return None
+    return tileset().get(z, x, y)
+
+
+def layer():
+    """Opciones de L.tileLayer del dashboard: el MBTiles local si existe, si no DASHBOARD_TILE_SOURCE."""
+    local = reverse('tile', args=[0, 0, 0]).replace('/0/0/0.png', '/{z}/{x}/{y}.png')
+    options = {"url": local, "maxZoom": 19, "attribution": DEFAULT_ATTRIBUTION}
+    try:
+        tiles = tileset()
+        if tiles.available():
+            metadata = tiles.metadata()
+            options['attribution'] = metadata.get('attribution', DEFAULT_ATTRIBUTION)
+            if metadata.get('maxzoom'):
+                # más allá del último nivel sembrado Leaflet amplía esas teselas
+                options['maxNativeZoom'] = int(metadata['maxzoom'])
+            return options
+    except TilesUnavailable:
+        pass
+    source = getattr(settings, 'DASHBOARD_TILE_SOURCE', None)
+    if source and '{z}' in str(source):
+        options['url'] = str(source)
+    return options
+
+
+# --- siembra -------------------------------------------------------------
+
+
+def tile_range(south, west, north, east, z):
+    """(x0, y0, x1, y1) XYZ que cubren el bbox en el zoom z (Web Mercator)."""
+    n = 1 << z
+
+    def column(lng):
+        return min(n - 1, max(0, int((lng + 180.0) / 360.0 * n)))
+
+    def row(lat):
+        lat = max(min(lat, 85.0511), -85.0511)
+        rad = math.radians(lat)
+        return min(n - 1, max(0, int((1.0 - math.asinh(math.tan(rad)) / math.pi) / 2.0 * n)))
+
+    return column(west), row(north), column(east), row(south)
+
+
+def _check_zooms(min_zoom, max_zoom):
+    if not 0 <= min_zoom <= max_zoom <= MAX_ZOOM:
+        raise TileError(f"los zooms deben cumplir 0 <= mínimo <= máximo <= {MAX_ZOOM}")
+
+
+def pyramid(bbox, min_zoom, max_zoom):
+    """Teselas (z, x, y) de todos los niveles entre min_zoom y max_zoom sobre el bbox (sur, oeste, norte, este)."""
+    _check_zooms(min_zoom, max_zoom)
+    for z in range(min_zoom, max_zoom + 1):
+        x0, y0, x1, y1 = tile_range(*bbox, z)
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                yield z, x, y
+
+
+def count(bbox, min_zoom, max_zoom):
+    _check_zooms(min_zoom, max_zoom)
+    total = 0
+    for z in range(min_zoom, max_zoom + 1):
+        x0, y0, x1, y1 = tile_range(*bbox, z)
+        total += (x1 - x0 + 1) * (y1 - y0 + 1)
+    return total
+
+
+def incident_bbox(incident_id, margin_km=5.0):
+    """(sur, oeste, norte, este) de los recursos del incidente y el epicentro, con un margen."""
+    lats, lngs = [EPICENTER['lat']], [EPICENTER['lng']]
+    for model in (Bridge, Hospital, Shelter):
+        for lat, lng in model.objects.filter(incident_id=incident_id).values_list('lat', 'lng'):
+            lats.append(lat)
+            lngs.append(lng)
+    dlat = margin_km / 111.32
+    dlng = margin_km / (111.32 * max(math.cos(math.radians(sum(lats) / len(lats))), 0.01))
+    return (max(min(lats) - dlat, -85.0), max(min(lngs) - dlng, -180.0),
+            min(max(lats) + dlat, 85.0), min(max(lngs) + dlng, 180.0))
+
+
+def check_seed_source(spec, min_zoom, max_zoom):
+    """TileError si `spec` es un servidor de NO_BULK_HOSTS y se piden varios niveles."""
+    if '{z}' not in str(spec) or min_zoom == max_zoom:
+        return
+    host = (urllib.parse.urlsplit(str(spec)).hostname or '').lower()
+    if any(host == domain or host.endswith('.' + domain) for domain in NO_BULK_HOSTS):
+        raise TileError(
+            f"{host} no permite descargas masivas: sembrar desde un servidor propio o un MBTiles "
+            "regional (--source), o de a un nivel (--min-zoom igual a --max-zoom)"
+        )
+
+
+def url_source(template, timeout=20):
+    """fetch(z, x, y) desde un servidor de teselas ('https://.../{z}/{x}/{y}.png')."""
+    if '{z}' not in template:
+        raise TileError("la URL de origen tiene que tener {z}, {x} e {y}")
+
+    def fetch(z, x, y):
+        request = urllib.request.Request(template.format(z=z, x=x, y=y, s='a'), headers={'User-Agent': USER_AGENT})
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as exc:
+            if exc.code in (204, 404):
+                return None
+            raise
+    return fetch
+
+
+def mbtiles_source(path):
+    """fetch(z, x, y) desde otro MBTiles (p. ej. un extracto regional)."""
+    if not Path(path).exists():
+        raise TileError(f"no existe {path}")
+    source = Tileset(path, 0, pool_size=1)
+
+    def fetch(z, x, y):
+        found = source.get(z, x, y)
+        return found[0] if found else None
+    fetch.metadata = source.metadata
+    return fetch
+
+
+def source_for(spec):
+    return mbtiles_source(spec) if '{z}' not in str(spec) else url_source(str(spec))
+
+
+def create(path):
+    """Abre (o crea) el MBTiles de `path` para escritura."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    return conn
+
+
+def _merge_metadata(conn, bbox, min_zoom, max_zoom, extra):
+    current = dict(conn.execute("SELECT name, value FROM metadata"))
+    if current.get('bounds'):
+        west, south, east, north = (float(v) for v in current['bounds'].split(','))
+        bbox = (min(bbox[0], south), min(bbox[1], west), max(bbox[2], north), max(bbox[3], east))
+    if current.get('minzoom'):
+        min_zoom = min(min_zoom, int(current['minzoom']))
+    if current.get('maxzoom'):
+        max_zoom = max(max_zoom, int(current['maxzoom']))
+    south, west, north, east = bbox
+    values = {
+        'name': 'terremoto-dashboard', 'type': 'baselayer', 'version': '1', 'format': 'png',
+        **{k: v for k, v in extra.items() if v},
+        'bounds': f'{west:.6f},{south:.6f},{east:.6f},{north:.6f}',
+        'center': f'{(west + east) / 2:.6f},{(south + north) / 2:.6f},{min_zoom}',
+        'minzoom': str(min_zoom), 'maxzoom': str(max_zoom),
+    }
+    conn.executemany("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)", values.items())
+
+
+def seed(path, fetch, bbox, min_zoom, max_zoom, force=False, delay=0.0, metadata=None, progress=None):
+    """
+    Completa en `path` la pirámide del bbox con las teselas de `fetch(z, x, y)`
+    (bytes o None). Sin `force` no vuelve a pedir las que ya están. Devuelve
+    {"added", "kept", "missing", "bytes"}.
+    """
+    stats = {"added": 0, "kept": 0, "missing": 0, "bytes": 0}
+    conn = create(path)
+    try:
+        pending = 0
+        for z, x, y in pyramid(bbox, min_zoom, max_zoom):
+            row = _tms_row(z, y)
+            if not force and conn.execute(
+                "SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", (z, x, row)
+            ).fetchone():
+                stats['kept'] += 1
+                continue
+            data = fetch(z, x, y)
+            if delay:
+                time.sleep(delay)
+            if not data:
+                stats['missing'] += 1
+                continue
+            conn.execute(
+                "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+                (z, x, row, sqlite3.Binary(data)),
+            )
+            stats['added'] += 1
+            stats['bytes'] += len(data)
+            pending += 1
+            if pending >= SEED_BATCH:
+                conn.commit()
+                pending = 0
+                if progress:
+                    progress(stats)
+        _merge_metadata(conn, bbox, min_zoom, max_zoom, metadata or {})
+    finally:
+        # si el origen falla a mitad de camino, lo descargado queda guardado
+        conn.commit()
+        conn.close()
+    return stats
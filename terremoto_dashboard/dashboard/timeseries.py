@@ -0,0 +1,425 @@
+"""
+Consultas de series temporales sobre MetricPoint: filtro por incidente,
+métricas y ventana de tiempo, y reducción a una cantidad objetivo de puntos
+para los gráficos.
+
+Modos de reducción:
+  - 'bucket': cubetas de tiempo fijas agregadas en SQL (min/max/avg).
+  - 'lttb':   Largest-Triangle-Three-Buckets, conserva la forma de la serie.
+
+Con `points`, si la ventana es lo bastante ancha se lee de los agregados de
+rollups.py (minuto/hora/día) en lugar de los puntos crudos; query_series
+devuelve también de qué fuente salió la respuesta. Sin `points`, lo anterior
+al primer punto crudo de cada métrica (ya compactado) sale de los agregados.
+"""
+import datetime
+import math
+from array import array
+
+import numpy as np
+from django.db.models import CharField, Count, F, FloatField, Func, Max, Min, Q, Sum
+from django.db.models.functions import Floor
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import rollups
+from .models import MetricPoint, MetricRollup
+
+MODES = ('lttb', 'bucket')
+MAX_POINTS = 10000
+SOURCES = {0: 'raw', **{resolution: level for level, resolution in rollups.RESOLUTIONS.items()}}
+
+
+class QueryError(ValueError):
+    """Parámetros inválidos en la consulta de métricas."""
+
+
+class EpochSeconds(Func):
+    """Segundos desde epoch de una columna DateTimeField."""
+    output_field = FloatField()
+    template = 'EXTRACT(EPOCH FROM %(expressions)s)'
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='((julianday(%(expressions)s) - 2440587.5) * 86400.0)',
+            **extra_context,
+        )
+
+
+class IsoTimestamp(Func):
+    """
+    Columna DateTimeField (UTC) como texto ISO 8601, igual a datetime.isoformat():
+    evita convertir a datetime y volver a formatear cada fila.
+    """
+    output_field = CharField()
+    template = (
+        "to_char(%(expressions)s AT TIME ZONE 'UTC', 'YYYY-MM-DD\"T\"HH24:MI:SS.US\"+00:00\"')"
+    )
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # SQLite guarda 'YYYY-MM-DD HH:MM:SS[.ffffff]' en UTC
+        return self.as_sql(
+            compiler, connection,
+            template="(REPLACE(%(expressions)s, ' ', 'T') || '+00:00')",
+            **extra_context,
+        )
+
+
+def parse_time(raw, name):
+    if not raw:
+        return None
+    try:
+        value = parse_datetime(raw)
+        if value is None:
+            seconds = float(raw)
+            # inf/nan y epochs fuera del rango de datetime (1e20) también son errores del cliente
+            if not math.isfinite(seconds):
+                raise ValueError(raw)
+            value = _from_epoch(seconds)
+    except (ValueError, OverflowError, OSError):
+        raise QueryError(f"'{name}' debe ser una fecha ISO 8601 o segundos desde epoch")
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, datetime.timezone.utc)
+    return value
+
+
+def _from_epoch(seconds):
+    return datetime.datetime.fromtimestamp(seconds, tz=datetime.timezone.utc)
+
+
+def parse_query(params):
+    """Valida los parámetros GET de /api/metrics/ y devuelve un dict normalizado."""
+    names = []
+    for raw in params.getlist('metric'):
+        names.extend(n.strip() for n in raw.split(',') if n.strip())
+    start = parse_time(params.get('from'), 'from')
+    end = parse_time(params.get('to'), 'to')
+    if start and end and start > end:
+        raise QueryError("'from' debe ser anterior a 'to'")
+    points = params.get('points')
+    if points is not None:
+        try:
+            points = int(points)
+        except ValueError:
+            raise QueryError("'points' debe ser un entero")
+        if not 2 <= points <= MAX_POINTS:
+            raise QueryError(f"'points' debe estar entre 2 y {MAX_POINTS}")
+    mode = params.get('mode', 'lttb')
+    if mode not in MODES:
+        raise QueryError(f"'mode' debe ser uno de: {', '.join(MODES)}")
+    until_id = params.get('until_id')
+    if until_id is not None:
+        # id de MetricPoint del cursor de /api/delta/: la serie completa hasta ese cursor
+        if points is not None:
+            raise QueryError("'until_id' solo se admite sin 'points'")
+        try:
+            until_id = int(until_id)
+        except ValueError:
+            raise QueryError("'until_id' debe ser un entero")
+    return {"metrics": names, "start": start, "end": end, "points": points, "mode": mode, "until_id": until_id}
+
+
+def filtered_points(incident_id, metrics=None, start=None, end=None, until_id=None):
+    # (incident, metric, timestamp) es el índice de MetricPoint
+    qs = MetricPoint.objects.filter(incident_id=incident_id)
+    if until_id is not None:
+        qs = qs.filter(id__lte=until_id)
+    if metrics:
+        qs = qs.filter(metric__in=metrics)
+    if start:
+        qs = qs.filter(timestamp__gte=start)
+    if end:
+        qs = qs.filter(timestamp__lte=end)
+    return qs
+
+
+def filtered_rollups(incident_id, resolution, metrics=None, start=None, end=None):
+    qs = MetricRollup.objects.filter(incident_id=incident_id, resolution=resolution)
+    if metrics:
+        qs = qs.filter(metric__in=metrics)
+    if start:
+        # la cubeta que contiene `start` también cuenta
+        qs = qs.filter(bucket__gt=start - datetime.timedelta(seconds=resolution))
+    if end:
+        qs = qs.filter(bucket__lte=end)
+    return qs
+
+
+def full_series(incident_id, metrics=None, start=None, end=None, until_id=None, now=None):
+    """
+    (puntos crudos, agregados) para la serie completa. Los agregados cubren lo
+    que la compactación ya borró, cada tramo con la resolución más fina que lo
+    conserva (rollups.compacted_ranges()); None si los crudos no se compactan.
+    """
+    qs = filtered_points(incident_id, metrics, start, end, until_id)
+    ranges = rollups.compacted_ranges(now)
+    if not ranges:
+        return qs, None
+    covered = Q()
+    for resolution, since, until in ranges:
+        part = Q(resolution=resolution, bucket__lt=until)
+        if since is not None:
+            part &= Q(bucket__gte=since)
+        if start:
+            part &= Q(bucket__gt=start - datetime.timedelta(seconds=resolution))
+        covered |= part
+    history = MetricRollup.objects.filter(covered, incident_id=incident_id)
+    if metrics:
+        history = history.filter(metric__in=metrics)
+    if end:
+        history = history.filter(bucket__lte=end)
+    return qs, history
+
+
+def _history(history):
+    """{metric: [(epoch, resolución, promedio), ...]} de los agregados, en orden de tiempo."""
+    rows = (
+        history.order_by('metric', 'bucket')
+        .annotate(epoch=EpochSeconds('bucket'), y=F('sum_value') / F('count'))
+        .values_list('metric', 'epoch', 'resolution', 'y')
+    )
+    groups = {}
+    for metric, epoch, resolution, value in rows:
+        # las cubetas empiezan en el segundo: se quita el error de julianday()
+        groups.setdefault(metric, []).append((round(epoch, 3), resolution, value))
+    return groups
+
+
+def _before(points, first):
+    # solo las cubetas que terminan antes del primer punto crudo: no se solapan con él
+    return [(epoch, value) for epoch, resolution, value in points if first is None or epoch + resolution <= first]
+
+
+def lttb(xs, ys, threshold):
+    """
+    Largest-Triangle-Three-Buckets. Devuelve los índices de los puntos elegidos
+    (siempre incluye el primero y el último).
+    """
+    n = len(xs)
+    if threshold >= n:
+        return list(range(n))
+    if threshold < 3:
+        return [0, n - 1]
+    selected = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # promedio de la cubeta siguiente
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        span = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / span
+        avg_y = sum(ys[avg_start:avg_end]) / span
+        # punto de la cubeta actual que forma el triángulo de mayor área
+        ax, ay = xs[a], ys[a]
+        best_area = -1.0
+        best = range_start = int(i * every) + 1
+        for j in range(range_start, int((i + 1) * every) + 1):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
+
+
+def raw_rows(qs, history=None):
+    """
+    (metric, timestamp ISO 8601, value) ordenados por métrica y tiempo, leídos
+    por bloques. Con `history` (ver full_series()), cada métrica empieza por
+    los agregados anteriores a su primer punto crudo.
+    """
+    rows = (
+        qs.order_by('metric', 'timestamp')
+        .annotate(iso=IsoTimestamp('timestamp'))
+        .values_list('metric', 'iso', 'value')
+    ).iterator(chunk_size=5000)
+    return rows if history is None else _merged_rows(rows, history)
+
+
+def _merged_rows(rows, history):
+    # el orden de las métricas puede variar entre la base y Python (collation):
+    # los agregados se agrupan por métrica en lugar de recorrer ambos en paralelo
+    pending = _history(history)
+    current = None
+    for metric, ts, value in rows:
+        if metric != current:
+            current = metric
+            first = datetime.datetime.fromisoformat(ts).timestamp()
+            for epoch, y in _before(pending.pop(metric, ()), first):
+                yield metric, _from_epoch(epoch).isoformat(), y
+        yield metric, ts, value
+    for metric, points in pending.items():
+        for epoch, y in _before(points, None):
+            yield metric, _from_epoch(epoch).isoformat(), y
+
+
+def raw_columns(qs, history=None):
+    """
+    Serie completa en columnas: {metric: {"t": ms desde epoch, "v": valores}},
+    cada columna un array float64 de NumPy. `history` como en raw_rows().
+    """
+    rows = (
+        qs.order_by('metric', 'timestamp')
+        .annotate(epoch=EpochSeconds('timestamp'))
+        .values_list('metric', 'epoch', 'value')
+    )
+    columns = {}
+    current = ts = values = None
+    for metric, epoch, value in rows.iterator(chunk_size=5000):
+        if metric != current:
+            current, ts, values = metric, array('d'), array('d')
+            columns[metric] = (ts, values)
+        ts.append(epoch)
+        values.append(value)
+    if history is not None:
+        for metric, points in _history(history).items():
+            ts, values = columns.get(metric, (array('d'), array('d')))
+            older = _before(points, ts[0] if ts else None)
+            if older:
+                columns[metric] = (array('d', (epoch for epoch, _ in older)) + ts,
+                                   array('d', (value for _, value in older)) + values)
+    return {metric: {"t": _time_column(np.frombuffer(ts)), "v": np.frombuffer(values)}
+            for metric, (ts, values) in columns.items()}
+
+
+def _time_column(epochs):
+    # julianday() trae ~50 µs de error: se redondea al milisegundo
+    return np.round(np.asarray(epochs, dtype=float) * 1000)
+
+
+def lttb_series(qs, points, time_field='timestamp', value=F('value'), columnar=False):
+    """
+    {metric: [{timestamp, value}, ...]} con ~`points` puntos por métrica; con
+    `columnar`, {metric: {"t": ms desde epoch, "v": valores}} como raw_columns().
+    """
+    # los timestamps llegan ya como segundos desde epoch: evita parsear un
+    # datetime por fila y solo se formatean los puntos elegidos
+    rows = (
+        qs.order_by('metric', time_field)
+        .annotate(epoch=EpochSeconds(time_field), y=value)
+        .values_list('metric', 'epoch', 'y')
+    )
+    series = {}
+    for metric, epoch, value in rows.iterator(chunk_size=5000):
+        xs, ys = series.setdefault(metric, ([], []))
+        xs.append(epoch)
+        ys.append(value)
+    groups = {}
+    for metric, (xs, ys) in series.items():
+        chosen = lttb(xs, ys, points)
+        if columnar:
+            groups[metric] = {"t": _time_column([xs[i] for i in chosen]),
+                              "v": np.array([ys[i] for i in chosen], dtype=float)}
+        else:
+            groups[metric] = [{"timestamp": _from_epoch(xs[i]).isoformat(), "value": ys[i]} for i in chosen]
+    return groups
+
+
+# agregados por cubeta según la fuente: (suma, cantidad, mínimo, máximo)
+RAW_AGGREGATES = dict(total=Sum('value'), count=Count('id'), min=Min('value'), max=Max('value'))
+ROLLUP_AGGREGATES = dict(total=Sum('sum_value'), count=Sum('count'), min=Min('min_value'), max=Max('max_value'))
+
+
+def bucket_series(qs, points, start=None, end=None, time_field='timestamp', aggregates=RAW_AGGREGATES,
+                  columnar=False):
+    """
+    Cubetas de ancho fijo entre start y end, agregadas por la base de datos.
+    Con `columnar`, columnas t, v, min, max y count como en lttb_series().
+    """
+    if start is None or end is None:
+        bounds = qs.aggregate(first=Min('timestamp'), last=Max('timestamp'))
+        start = start or bounds['first']
+        end = end or bounds['last']
+        if start is None:
+            return {}
+    origin = start.timestamp()
+    width = max((end.timestamp() - origin) / points, 1e-3)
+    rows = (
+        qs.annotate(slot=Floor((EpochSeconds(time_field) - origin) / width))
+        .values('metric', 'slot')
+        .annotate(**aggregates)
+        .order_by('metric', 'slot')
+    )
+    groups = {}
+    for row in rows:
+        # el último punto cae exactamente en `end` y julianday() redondea al
+        # milisegundo: los extremos se suman a la primera/última cubeta
+        # (con agregados, el inicio de la cubeta de minuto/hora puede quedar antes de `start`)
+        bucket = min(max(int(row['slot']), 0), points - 1)
+        series = groups.setdefault(row['metric'], [])
+        if series and series[-1][0] == bucket:
+            prev = series[-1]
+            prev[1] += row['total']
+            prev[2] = min(prev[2], row['min'])
+            prev[3] = max(prev[3], row['max'])
+            prev[4] += row['count']
+            continue
+        series.append([bucket, row['total'], row['min'], row['max'], row['count']])
+    if columnar:
+        columns = {}
+        for metric, series in groups.items():
+            bucket, total, low, high, count = np.array(series, dtype=float).T
+            columns[metric] = {"t": _time_column(origin + bucket * width), "v": total / count,
+                               "min": low, "max": high, "count": count}
+        return columns
+    return {
+        metric: [
+            {"timestamp": _from_epoch(origin + bucket * width).isoformat(), "min": low, "max": high,
+             "count": count, "value": total / count}
+            for bucket, total, low, high, count in series
+        ]
+        for metric, series in groups.items()
+    }
+
+
+def choose_source(incident_id, metrics, start, end, points):
+    """
+    Resolución a leer (0 = puntos crudos) y la ventana efectiva. Sin `from` o
+    `to` los extremos salen de los agregados diarios.
+    """
+    if start is None or end is None:
+        first, last = rollups.bounds(incident_id, metrics)
+        if first is None:
+            # sin agregados (p. ej. datos cargados con bulk_create): crudos
+            return 0, start, end
+        start, end = start or first, end or last
+    if end <= start:
+        return 0, start, end
+    return rollups.choose_resolution(start, end, points), start, end
+
+
+def query_series(incident_id, metrics=None, start=None, end=None, points=None, mode='lttb', until_id=None,
+                 columnar=False):
+    """
+    Series del incidente agrupadas por métrica y la fuente usada ('raw', 'minute', 'hour' o 'day'):
+    ({"fatalities": [{timestamp, value}, ...], ...}, fuente)
+    En modo 'bucket' cada punto incluye además min, max y count. Desde los
+    agregados, el valor de cada cubeta de minuto/hora/día es su promedio.
+    Sin `points`, la serie completa incluye lo compactado (ver full_series()).
+    Con `columnar`, las series vienen en columnas como las de raw_columns().
+    """
+    if points is None:
+        qs, history = full_series(incident_id, metrics, start, end, until_id)
+        if columnar:
+            return raw_columns(qs, history), SOURCES[0]
+        groups = {}
+        for metric, ts, value in raw_rows(qs, history):
+            groups.setdefault(metric, []).append({"timestamp": ts, "value": value})
+        return groups, SOURCES[0]
+    resolution, window_start, window_end = choose_source(incident_id, metrics, start, end, points)
+    if resolution == 0:
+        qs = filtered_points(incident_id, metrics, start, end)
+        if mode == 'bucket':
+            return bucket_series(qs, points, start, end, columnar=columnar), SOURCES[0]
+        return lttb_series(qs, points, columnar=columnar), SOURCES[0]
+    qs = filtered_rollups(incident_id, resolution, metrics, start, end)
+    if mode == 'bucket':
+        series = bucket_series(qs, points, window_start, window_end, time_field='bucket',
+                               aggregates=ROLLUP_AGGREGATES, columnar=columnar)
+    else:
+        series = lttb_series(qs, points, time_field='bucket', value=F('sum_value') / F('count'), columnar=columnar)
+    return series, SOURCES[resolution]
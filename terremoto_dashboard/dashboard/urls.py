@@ -1,9 +1,51 @@
-from django.urls import path
+from django.urls import include, path
 from . import views
 
+# mismas vistas, sobre un incidente puntual: /api/incidents/<id>/summary/, ...
+incident_patterns = [
+    path('', views.api_incident, name='incident_api'),
+    path('summary/', views.api_summary, name='incident_api_summary'),
+    path('metrics/', views.api_metrics, name='incident_api_metrics'),
+    path('metrics/ingest/', views.api_ingest_metrics, name='incident_api_ingest_metrics'),
+    path('resources/', views.api_resources, name='incident_api_resources'),
+    path('clusters/<int:z>/<int:x>/<int:y>/', views.api_clusters, name='incident_api_clusters'),
+    path('routes/', views.api_routes, name='incident_api_routes'),
+    path('allocation/', views.api_allocation, name='incident_api_allocation'),
+    path('delta/', views.api_delta, name='incident_api_delta'),
+    path('occupancy/', views.api_occupancy, name='incident_api_occupancy'),
+    path('shelters/<int:pk>/checkin/', views.api_occupancy, {'action': 'checkin'}, name='incident_api_checkin'),
+    path('shelters/<int:pk>/checkout/', views.api_occupancy, {'action': 'checkout'}, name='incident_api_checkout'),
+    path('hospitals/<int:pk>/admit/', views.api_occupancy, {'action': 'admit'}, name='incident_api_admit'),
+    path('hospitals/<int:pk>/discharge/', views.api_occupancy, {'action': 'discharge'}, name='incident_api_discharge'),
+    path('simulate/', views.api_simulate, name='incident_api_simulate'),
+    path('sync/', views.api_sync_export, name='incident_api_sync'),
+]
+
 urlpatterns = [
     path('', views.dashboard_view, name='dashboard'),
+    path('incidents/<int:incident_id>/', views.dashboard_view, name='incident_dashboard'),
+    # rutas sin id: trabajan sobre el incidente actual (ver incidents.py)
     path('api/summary/', views.api_summary, name='api_summary'),
     path('api/metrics/', views.api_metrics, name='api_metrics'),
+    path('api/metrics/ingest/', views.api_ingest_metrics, name='api_ingest_metrics'),
+    path('api/resources/', views.api_resources, name='api_resources'),
+    path('api/clusters/<int:z>/<int:x>/<int:y>/', views.api_clusters, name='api_clusters'),
+    path('api/routes/', views.api_routes, name='api_routes'),
+    path('api/allocation/', views.api_allocation, name='api_allocation'),
+    path('api/delta/', views.api_delta, name='api_delta'),
+    path('api/occupancy/', views.api_occupancy, name='api_occupancy'),
+    path('api/shelters/<int:pk>/checkin/', views.api_occupancy, {'action': 'checkin'}, name='api_checkin'),
+    path('api/shelters/<int:pk>/checkout/', views.api_occupancy, {'action': 'checkout'}, name='api_checkout'),
+    path('api/hospitals/<int:pk>/admit/', views.api_occupancy, {'action': 'admit'}, name='api_admit'),
+    path('api/hospitals/<int:pk>/discharge/', views.api_occupancy, {'action': 'discharge'}, name='api_discharge'),
     path('api/simulate/', views.api_simulate, name='api_simulate'),
+    path('api/sync/', views.api_sync_export, name='api_sync'),
+    path('api/sync/import/', views.api_sync_import, name='api_sync_import'),
+    path('api/incidents/', views.api_incidents, name='api_incidents'),
+    path('api/incidents/<int:incident_id>/', include(incident_patterns)),
+    path('api/jobs/', views.api_jobs, name='api_jobs'),
+    path('api/jobs/<int:job_id>/', views.api_job, name='api_job'),
+    path('api/jobs/<int:job_id>/cancel/', views.api_job_cancel, name='api_job_cancel'),
+    path('api/_perf/', views.api_perf, name='api_perf'),
+    path('tiles/<int:z>/<int:x>/<int:y>.png', views.tile, name='tile'),
 ]
@@ -1,66 +1,559 @@
-from django.shortcuts import render
-from django.http import JsonResponse
-from .models import IncidentSummary, Bridge, Hospital, Shelter, ServiceStatus, MetricPoint
-from django.views.decorators.http import require_POST
-from django.utils import timezone
-
-def dashboard_view(request):
-    summary = IncidentSummary.objects.order_by('-created_at').first()
-    if not summary:
-        summary = IncidentSummary.objects.create()
-    # Enviamos datos iniciales (el template pedirá datos via /api/)
-    context = {"summary": summary}
+import json
+from functools import partial
+
+from django.conf import settings
+from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.http import Http404, HttpResponse, JsonResponse
+from .models import EPICENTER, IncidentSummary, Bridge, Hospital, Shelter, ServiceStatus, Job
+from . import (
+    aio, allocation, changes, clusters, history, incidents, ingest, jobs, occupancy, perf, roads, serializers, snapshot,
+    spatial, sync, tiles, timeseries,
+)
+from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
+from django.views.decorators.http import require_http_methods, require_POST
+
+# Cada vista de incidente recibe `incident_id` de /api/incidents/<id>/...; en
+# las rutas sin id es None y se usa el incidente actual (ver incidents.py).
+
+def _incident(incident_id):
+    try:
+        return incidents.get(incident_id)
+    except incidents.IncidentNotFound as exc:
+        raise Http404(str(exc))
+
+@ensure_csrf_cookie  # el token para los POST del panel (p. ej. /api/simulate/)
+def dashboard_view(request, incident_id=None):
+    summary = _incident(incident_id)
+    # Enviamos datos iniciales (el template pedirá datos via /api/incidents/<id>/)
+    context = {
+        "summary": summary,
+        "api_base": reverse('incident_api', args=[summary.id]),
+        "tile_layer": tiles.layer(),
+    }
     return render(request, 'dashboard/dashboard.html', context)
 
-def api_summary(request):
-    summary = IncidentSummary.objects.order_by('-created_at').first()
-    if not summary:
-        summary = IncidentSummary.objects.create()
+SUMMARY_RESOURCES = {'bridges': Bridge, 'hospitals': Hospital, 'shelters': Shelter, 'services': ServiceStatus}
+
+def _summary_data(summary, rows):
     data = summary.to_dict()
     # añadir recursos persistidos
-    data.update({
-        "coords": {"lat": -35.020694, "lng": -69.323999},
-        "bridges": [b.to_dict() for b in Bridge.objects.all()],
-        "hospitals": [h.to_dict() for h in Hospital.objects.all()],
-        "shelters": [s.to_dict() for s in Shelter.objects.all()],
-        "services": [sv.to_dict() for sv in ServiceStatus.objects.all()],
+    data.update({"coords": EPICENTER, **dict(zip(SUMMARY_RESOURCES, rows))})
+    return data
+
+def _resource_rows(model, incident_id):
+    return serializers.rows(model.objects.filter(incident_id=incident_id))
+
+async def build_summary(request, incident_id):
+    """Payload de /api/summary/: el incidente y sus cuatro tipos de recurso, leídos a la vez."""
+    summary, *rows = await aio.gather(
+        request,
+        partial(_incident, incident_id),
+        *(partial(_resource_rows, model, incident_id) for model in SUMMARY_RESOURCES.values()),
+    )
+    return await aio.run(request, serializers.dumps, _summary_data(summary, rows))
+
+def api_incidents(request):
+    """Incidentes cargados, del más reciente al más viejo; "current" es el que usan las rutas sin id."""
+    rows = IncidentSummary.objects.order_by('-created_at').values('id', 'name', 'created_at')
+    return serializers.json_response({
+        "current": incidents.current_id(create=False),
+        "incidents": [
+            {**row, "url": reverse('incident_api_summary', args=[row['id']])} for row in rows
+        ],
     })
-    return JsonResponse(data)
 
-def api_metrics(request):
+def api_incident(request, incident_id):
+    """Datos del incidente; sus recursos y series cuelgan de esta misma ruta."""
+    incident = _incident(incident_id)
+    return serializers.json_response({**incident.to_dict(), "created_at": incident.created_at})
+
+def _state_as_of(request, incident_id):
+    """(momento, estado del incidente en ese momento, None) para ?as_of= (ver history.py), o (None, None, error)."""
+    try:
+        at = history.parse_as_of(request.GET['as_of'])
+        return at, history.state_as_of(incident_id, at), None
+    except ValueError as exc:
+        return None, None, JsonResponse({"error": str(exc)}, status=400)
+    except history.HistoryUnavailable as exc:
+        return None, None, JsonResponse({"error": str(exc)}, status=404)
+
+def _summary_as_of(request, incident_id):
+    incident_id = incidents.resolve_or_404(incident_id)
+    at, state, error = _state_as_of(request, incident_id)
+    if error is not None:
+        return error
+    summary = history.instance(state, 'summary', incident_id)
+    if summary is None:
+        return JsonResponse({"error": "el incidente todavía no existía"}, status=404)
+    data = _summary_data(summary, [history.rows(state, key) for key in SUMMARY_RESOURCES])
+    data["as_of"] = at
+    return serializers.json_response(data)
+
+# api_summary y api_metrics son asíncronas: bajo ASGI (malvinas/asgi.py) no
+# ocupan un hilo mientras esperan a la base y las consultas independientes del
+# resumen corren a la vez (ver aio.py). Bajo WSGI Django las adapta solo.
+
+async def api_summary(request, incident_id=None):
+    """
+    Resumen del incidente con sus recursos. ?as_of=<ISO 8601 | epoch> lo
+    devuelve como estaba en ese momento (ver history.py), sin validadores.
+    """
+    if request.GET.get('as_of'):
+        return await aio.run(request, _summary_as_of, request, incident_id)
+    # el snapshot solo se reconstruye cuando cambió la version (ver signals.py);
+    # los polls con If-None-Match/If-Modified-Since vigentes reciben 304
+    incident_id, version = await aio.run(request, snapshot.resolve_version, incident_id)
+    etag, last_modified = snapshot.validators(incident_id, version)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        version, payload = await snapshot.aget_summary_snapshot(incident_id, version, partial(build_summary, request))
+        response = HttpResponse(payload, content_type='application/json')
+        response['Cache-Control'] = 'no-cache'
+    if request.method in ('GET', 'HEAD'):
+        response.headers.setdefault('ETag', etag)
+        response.headers.setdefault('Last-Modified', http_date(last_modified))
+    return response
+
+def _metrics_response(request, incident_id):
+    incident_id = incidents.resolve_or_404(incident_id)
+    try:
+        query = timeseries.parse_query(request.GET)
+        fmt = serializers.negotiate(request)
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    delta = request.GET.get('delta') == '1'
+    if query['points'] is None:
+        qs, history = timeseries.full_series(
+            incident_id, query['metrics'], query['start'], query['end'], query['until_id'],
+        )
+        if fmt == 'json':
+            response = serializers.streaming_series_response(timeseries.raw_rows(qs, history))
+            response.streaming_content = aio.streaming(request, response.streaming_content)
+        else:
+            response = serializers.series_response(timeseries.raw_columns(qs, history), fmt, delta)
+        response['X-Metrics-Source'] = timeseries.SOURCES[0]
+        return response
+    series, source = timeseries.query_series(incident_id, columnar=fmt != 'json', **query)
+    if fmt == 'json':
+        response = serializers.json_response(series)
+    else:
+        response = serializers.series_response(series, fmt, delta)
+    response['X-Metrics-Source'] = source
+    return response
+
+async def api_metrics(request, incident_id=None):
     """
-    Devuelve series temporales agrupadas por metric.
+    Devuelve las series temporales del incidente agrupadas por metric.
     {
       "fatalities": [{timestamp, value}, ...],
       "hospital_capacity": [...]
     }
+    Parámetros opcionales:
+      metric=fatalities,injured_mild   (también repetible)
+      from=<ISO 8601 | epoch>  to=<ISO 8601 | epoch>
+      points=<n>  mode=lttb|bucket     (reducción a ~n puntos por métrica)
+      until_id=<id>                    (sin points: hasta ese MetricPoint, p. ej. el del cursor de /api/delta/)
+      format=json|columnar|binary      (o por Accept; ver serializers.py)  delta=1 (t en deltas)
+    La cabecera X-Metrics-Source indica si se leyeron puntos crudos o
+    agregados (raw, minute, hour, day). Sin `points` la serie completa se
+    envía por bloques (StreamingHttpResponse) y lo ya compactado sale del
+    promedio de los agregados (ver timeseries.full_series()).
     """
-    qs = MetricPoint.objects.order_by('timestamp')
-    groups = {}
-    for m in qs:
-        groups.setdefault(m.metric, []).append({"timestamp": m.timestamp.isoformat(), "value": m.value})
-    return JsonResponse(groups)
+    # cada consulta depende de la anterior (la fuente sale de los agregados): un solo paso por el pool
+    response = await aio.run(request, _metrics_response, request, incident_id)
+    # JSON, columnar o MSR1 según el Accept: todas las respuestas (también los
+    # errores) lo declaran, para que un cache compartido no mezcle formatos
+    patch_vary_headers(response, ('Accept',))
+    return response
 
+RESOURCE_MODELS = {'bridges': Bridge, 'hospitals': Hospital, 'shelters': Shelter}
+MAX_RESOURCES = 5000
+
+def api_resources(request, incident_id=None):
+    """
+    Recursos del incidente dentro de un área, usando el índice (incident, cell):
+      ?bbox=oeste,sur,este,norte            (viewport de Leaflet)
+      ?near=lat,lng&radius=<metros>         (ordenados por distancia)
+      &types=bridges,hospitals,shelters     (opcional)  &limit=<n>
+      &as_of=<ISO 8601 | epoch>             (como estaban en ese momento, ver history.py)
+    """
+    incident_id = incidents.resolve_or_404(incident_id)
+    types = [t for t in request.GET.get('types', ','.join(RESOURCE_MODELS)).split(',') if t]
+    unknown = [t for t in types if t not in RESOURCE_MODELS]
+    if unknown:
+        return JsonResponse({"error": f"types desconocidos: {', '.join(unknown)}"}, status=400)
+    try:
+        limit = min(int(request.GET.get('limit', MAX_RESOURCES)), MAX_RESOURCES)
+        if limit < 1:
+            return JsonResponse({"error": "limit debe ser un entero positivo"}, status=400)
+        if request.GET.get('bbox'):
+            center = None
+            bbox = spatial.parse_bbox(request.GET['bbox'])
+        elif request.GET.get('near'):
+            center = spatial.parse_near(request.GET['near'], request.GET.get('radius'))
+            bbox = spatial.bbox_around(*center)
+        else:
+            return JsonResponse({"error": "se requiere bbox o near+radius"}, status=400)
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+
+    state = None
+    if request.GET.get('as_of'):
+        _, state, error = _state_as_of(request, incident_id)
+        if error is not None:
+            return error
+
+    data = {"truncated": False}
+    for key in types:
+        if state is not None:
+            found = history.rows_in_bbox(state, key, *bbox)
+        else:
+            qs = spatial.filter_bbox(RESOURCE_MODELS[key].objects.filter(incident_id=incident_id), *bbox)
+            found = serializers.rows(qs[:limit + 1] if center is None else qs)
+        if center is None:
+            rows = found
+        else:
+            # el bbox es una cota; el radio exacto se filtra acá
+            lat, lng, radius = center
+            rows = []
+            for row in found:
+                distance = spatial.haversine_m(lat, lng, row["lat"], row["lng"])
+                if distance <= radius:
+                    row["distance_m"] = round(distance, 1)
+                    rows.append(row)
+            rows.sort(key=lambda row: row["distance_m"])
+        if len(rows) > limit:
+            rows = rows[:limit]
+            data["truncated"] = True
+        data[key] = rows
+    return serializers.json_response(data)
+
+def api_clusters(request, z, x, y, incident_id=None):
+    """
+    Recursos de la tesela z/x/y agrupados por cercanía (ver clusters.py): por
+    grupo la cantidad, el centro y las sumas de camas/capacidad/ocupantes o el
+    peor estado de puente; los grupos de un solo recurso y, pasado el zoom
+    máximo de agrupamiento, todos los recursos, van con sus campos completos.
+      &types=bridges,hospitals,shelters   (opcional)
+      format=json|mvt                     (o por Accept: Mapbox Vector Tile)
+    """
+    incident_id = incidents.resolve_or_404(incident_id)
+    types = [t for t in request.GET.get('types', ','.join(clusters.MODELS)).split(',') if t]
+    unknown = [t for t in types if t not in clusters.MODELS]
+    if unknown:
+        return JsonResponse({"error": f"types desconocidos: {', '.join(unknown)}"}, status=400)
+    try:
+        fmt = clusters.negotiate(request)
+        features, cursor = clusters.tile(incident_id, z, x, y, types)
+    except clusters.ClusterError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    # cambia solo con los recursos del incidente: los paneos repetidos reciben 304
+    etag = f'"{incident_id}-{cursor}-{fmt}-{"+".join(types)}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if fmt == 'mvt':
+            response = HttpResponse(clusters.encode_mvt(features, z, x, y), content_type=clusters.FORMATS['mvt'])
+        else:
+            response = serializers.json_response({"z": z, "x": x, "y": y, "features": features})
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+def api_routes(request, incident_id=None):
+    """
+    Ruteo sobre la red vial, según el estado actual de los puentes del incidente (ver roads.py):
+      ?from=lat,lng&to=lat,lng                   ruta más rápida entre dos puntos
+      ?from=lat,lng&nearest=hospitals|shelters   ruta al más cercano alcanzable
+    """
+    incident_id = incidents.resolve_or_404(incident_id)
+    try:
+        lat, lng = spatial.parse_point(request.GET.get('from'))
+        if request.GET.get('to'):
+            result = roads.route(incident_id, lat, lng, *spatial.parse_point(request.GET['to']))
+        else:
+            result = roads.nearest_facility(incident_id, lat, lng, request.GET.get('nearest', 'hospitals'))
+    except roads.NetworkUnavailable as exc:
+        return JsonResponse({"error": str(exc)}, status=503)
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return JsonResponse(result)
+
+@csrf_exempt  # solo calcula, no escribe: lo usan también herramientas de planificación externas
+@require_http_methods(['GET', 'POST'])
+def api_allocation(request, incident_id=None):
+    """
+    Asignación de demanda a refugios u hospitales del incidente (ver allocation.py).
+      GET  ?kind=shelters|hospitals&clusters=50&k=8&detail=1
+           demanda estimada desde el resumen, repartida alrededor del epicentro
+      POST {"kind": ..., "demand": [{"lat", "lng", "people"}, ...], "k": 8, "detail": true}
+    """
+    incident_id = incidents.resolve_or_404(incident_id)
+    try:
+        if request.method == 'POST':
+            try:
+                body = json.loads(request.body or b'{}')
+            except ValueError:
+                return JsonResponse({"error": "el cuerpo debe ser JSON"}, status=400)
+            if not isinstance(body, dict):
+                return JsonResponse({"error": "el cuerpo debe ser un objeto JSON"}, status=400)
+            params = body
+            demand = allocation.parse_demand(body.get('demand'))
+        else:
+            params = request.GET
+            demand = None
+        kind = params.get('kind', 'shelters')
+        try:
+            k = int(params.get('k', allocation.DEFAULT_K))
+            clusters = int(params.get('clusters', allocation.DEFAULT_CLUSTERS))
+        except (TypeError, ValueError):
+            return JsonResponse({"error": "k y clusters deben ser enteros"}, status=400)
+        detail = params.get('detail') in (True, '1', 'true')
+        summary = _incident(incident_id) if demand is None else None
+        result = allocation.run(incident_id, kind, demand, k=k, clusters=clusters, detail=detail, summary=summary)
+    except allocation.AllocationError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return JsonResponse(result)
+
+@csrf_exempt  # feeds de campo: clientes sin sesión ni cookie CSRF; por eso solo ndjson o csv
 @require_POST
-def api_simulate(request):
-    # simular cambios y guardar metric points
-    summary = IncidentSummary.objects.order_by('-created_at').first()
-    if not summary:
-        summary = IncidentSummary.objects.create()
-    # cambios simples
-    summary.fatalities = int(summary.fatalities * 1.05)
-    summary.injured_severe_min = int(summary.injured_severe_min * 1.05)
-    summary.injured_severe_max = int(summary.injured_severe_max * 1.10)
-    summary.injured_mild_min = int(summary.injured_mild_min * 1.02)
-    summary.injured_mild_max = int(summary.injured_mild_max * 1.05)
-    summary.hospital_operational_pct = max(0.05, summary.hospital_operational_pct - 0.08)
-    summary.save()
-
-    # crear metric points (timestamp ahora)
-    now = timezone.now()
-    MetricPoint.objects.create(timestamp=now, metric='fatalities', value=summary.fatalities)
-    MetricPoint.objects.create(timestamp=now, metric='injured_severe', value=summary.avg_injured_severe())
-    MetricPoint.objects.create(timestamp=now, metric='injured_mild', value=summary.avg_injured_mild())
-    MetricPoint.objects.create(timestamp=now, metric='hospital_operational_pct', value=summary.hospital_operational_pct * 100)
-
-    return JsonResponse(summary.to_dict())
+def api_ingest_metrics(request, incident_id=None):
+    """
+    Ingesta masiva de MetricPoint del incidente. El cuerpo se procesa como stream, en lotes:
+      POST /api/metrics/ingest/?format=ndjson|csv&batch_size=5000
+    El Content-Type debe ser application/x-ndjson o text/csv (415 si no); si no
+    se indica format se deduce de él.
+    """
+    if request.content_type not in ingest.CONTENT_TYPES:
+        return JsonResponse(
+            {"error": f"el cuerpo debe ser {' o '.join(ingest.CONTENT_TYPES)}"}, status=415
+        )
+    incident_id = incidents.resolve_or_404(incident_id)
+    fmt = request.GET.get('format') or ingest.CONTENT_TYPES[request.content_type]
+    if fmt not in ingest.FORMATS:
+        return JsonResponse({"error": f"format debe ser uno de: {', '.join(ingest.FORMATS)}"}, status=400)
+    try:
+        batch_size = int(request.GET.get('batch_size', ingest.DEFAULT_BATCH_SIZE))
+    except ValueError:
+        return JsonResponse({"error": "batch_size debe ser un entero"}, status=400)
+    if not 1 <= batch_size <= 50000:
+        return JsonResponse({"error": "batch_size debe estar entre 1 y 50000"}, status=400)
+    batches = []
+    try:
+        for result in ingest.ingest(incident_id, request, fmt, batch_size):
+            batches.append(result)
+    except (ingest.RowError, UnicodeDecodeError) as exc:
+        # los lotes anteriores ya quedaron guardados y se informan igual
+        return JsonResponse({"error": str(exc), "batches": batches}, status=400)
+    return JsonResponse({
+        "accepted": sum(b["accepted"] for b in batches),
+        "rejected": sum(b["rejected"] for b in batches),
+        "batches": batches,
+    })
+
+def _not_json(request):
+    # un formulario de otro sitio no puede mandar application/json sin preflight CORS
+    if request.content_type != 'application/json':
+        return JsonResponse({"error": "el cuerpo debe ser application/json"}, status=415)
+    return None
+
+def _json_body(request):
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError:
+        raise occupancy.OccupancyError("el cuerpo debe ser JSON")
+
+@csrf_exempt  # mesas de ingreso: clientes sin sesión ni cookie CSRF; por eso solo application/json
+@require_POST
+def api_occupancy(request, pk=None, action=None, incident_id=None):
+    """
+    Ingresos y egresos atómicos (ver occupancy.py):
+      POST /api/shelters/<id>/checkin/ | checkout/    {"count": n}  (por defecto 1)
+      POST /api/hospitals/<id>/admit/ | discharge/    {"count": n}
+      POST /api/occupancy/  {"ops": [{"action", "id", "count"}, ...], "atomic": false}
+    El cuerpo tiene que ser application/json (415 si no). Devuelve el valor
+    nuevo del contador; 409 si una operación dejaría el contador fuera de
+    [0, capacidad] (o, en un lote atómico, si alguna lo haría).
+    """
+    incident_id = incidents.resolve_or_404(incident_id)
+    unsupported = _not_json(request)
+    if unsupported is not None:
+        return unsupported
+    try:
+        body = _json_body(request)
+        if action is None:
+            ops, atomic = occupancy.parse_batch(body), body.get('atomic') is True
+        else:
+            ops, atomic = [occupancy.parse_op(body, action, pk)], True
+        results = occupancy.apply(incident_id, ops, atomic=atomic)
+    except occupancy.OccupancyError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    except occupancy.BatchRejected as exc:
+        failed = exc.results[-1]
+        status = 404 if failed['error'] == 'no existe' else 409
+        if action is not None:
+            return JsonResponse(failed, status=status)
+        return JsonResponse({"applied": 0, "results": exc.results}, status=409)
+    if action is not None:
+        return JsonResponse(results[0])
+    return JsonResponse({"applied": sum(r['ok'] for r in results), "results": results})
+
+def api_delta(request, incident_id=None):
+    """
+    Feed incremental del incidente. Sin `since` devuelve el estado completo ("reset": true);
+    con `since=<cursor>` solo los MetricPoint nuevos y los recursos modificados
+    o borrados desde ese cursor. Siempre incluye el cursor a usar en el próximo pedido.
+    """
+    incident_id = incidents.resolve_or_404(incident_id)
+    since = request.GET.get('since')
+    if not since:
+        # metrics=0: el cliente trae las series aparte (p. ej. /api/metrics/?format=binary&until_id=...)
+        include_metrics = request.GET.get('metrics') != '0'
+        return serializers.json_response(changes.full_state(incident_id, include_metrics=include_metrics))
+    try:
+        metric_id, change_id = changes.parse_cursor(since)
+    except changes.CursorError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return serializers.json_response(changes.delta_since(incident_id, metric_id, change_id))
+
+def _job_response(job, created=True):
+    data = job.to_dict()
+    data["deduplicated"] = not created
+    data["url"] = reverse('api_job', args=[job.id])
+    status = 200 if job.status not in Job.ACTIVE else 202
+    response = JsonResponse(data, status=status)
+    if status == 202:
+        response['Location'] = data["url"]
+    return response
+
+@require_POST
+def api_simulate(request, incident_id=None):
+    """
+    Proyección Monte Carlo desde los rangos del resumen del incidente (ver projection.py):
+      POST /api/simulate/?scenarios=10000&hours=72&seed=<n>
+    Corre como tarea en segundo plano (ver jobs.py): responde 202 con el Job a
+    consultar en /api/jobs/<id>/. Al terminar, las bandas p10/p50/p90 quedan
+    como series proj_*, las series observadas avanzan una hora con la mediana
+    y el resultado trae el resumen actualizado con la proyección.
+    """
+    params = {**request.GET.dict(), "incident": incidents.resolve_or_404(incident_id)}
+    try:
+        job, created = jobs.submit('simulate', params)
+    except jobs.JobError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return _job_response(job, created)
+
+@require_http_methods(['GET', 'POST'])
+def api_jobs(request):
+    """
+    GET  últimas tareas (?status=queued|running|done|failed|cancelled)
+    POST {"kind": "simulate"|"allocation"|"checkpoint", "params": {...}} encola una tarea;
+         si hay una idéntica en curso se devuelve esa ("deduplicated": true).
+         Requiere application/json y el token CSRF, como /api/simulate/;
+         los límites de cada tipo son los mismos que en su endpoint.
+    """
+    if request.method == 'GET':
+        qs = Job.objects.order_by('-id')
+        if request.GET.get('status'):
+            qs = qs.filter(status=request.GET['status'])
+        return JsonResponse({"jobs": [job.to_dict(include_result=False) for job in qs[:50]]})
+    unsupported = _not_json(request)
+    if unsupported is not None:
+        return unsupported
+    try:
+        body = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({"error": "el cuerpo debe ser JSON"}, status=400)
+    if not isinstance(body, dict):
+        return JsonResponse({"error": "el cuerpo debe ser un objeto JSON"}, status=400)
+    try:
+        job, created = jobs.submit(body.get('kind'), body.get('params'))
+    except jobs.JobError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return _job_response(job, created)
+
+def api_job(request, job_id):
+    """Estado, progreso y (al terminar) resultado de una tarea."""
+    job = get_object_or_404(Job, pk=job_id)
+    return _job_response(job)
+
+@require_POST
+def api_job_cancel(request, job_id):
+    job = jobs.cancel(get_object_or_404(Job, pk=job_id))
+    return _job_response(job)
+
+def api_sync_export(request, incident_id=None):
+    """
+    Paquete de sincronización del incidente para otro nodo (ver sync.py).
+    ?node=<nodo destino> (obligatorio: el paquete se firma con su clave) arranca
+    desde lo que ese nodo confirmó haber importado; ?since=<cursor> lo fija a
+    mano (p. ej. para un enlace de un solo sentido).
+    """
+    incident_id = incidents.resolve_or_404(incident_id)
+    try:
+        bundle, info = sync.export(incident_id, peer=request.GET.get('node') or None,
+                                   since=request.GET.get('since') or None)
+    except (changes.CursorError, sync.SyncError) as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    response = HttpResponse(bundle, content_type=sync.CONTENT_TYPE)
+    response['Content-Disposition'] = f'attachment; filename="incidente-{incident_id}-{info["cursor"]}.tdsync"'
+    response['X-Sync-Cursor'] = info['cursor']
+    response['Cache-Control'] = 'no-store'
+    return response
+
+@csrf_exempt  # lo usan otros nodos, sin sesión ni cookie CSRF: se autentican con la firma del paquete
+@require_POST
+def api_sync_import(request):
+    """
+    Importa un paquete de otro nodo (cuerpo binario; ?force=1 acepta paquetes
+    salteados). Solo se aplican paquetes firmados con la clave compartida con
+    el nodo de origen (DASHBOARD_SYNC_KEYS).
+    """
+    try:
+        # read(): un paquete completo puede superar DATA_UPLOAD_MAX_MEMORY_SIZE
+        result = sync.apply(request.read(), force=request.GET.get('force') == '1')
+    except sync.SyncError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return JsonResponse(result)
+
+def tile(request, z, x, y):
+    """Tesela del MBTiles local (ver tiles.py); los clientes la revalidan con If-None-Match."""
+    try:
+        found = tiles.get(z, x, y)
+    except tiles.TilesUnavailable as exc:
+        return JsonResponse({"error": str(exc)}, status=503)
+    if found is None:
+        response = HttpResponse(status=404)
+        # puede aparecer con una nueva siembra
+        response['Cache-Control'] = f'public, max-age={tiles.MISSING_MAX_AGE}'
+        return response
+    data, etag = found
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(data, content_type=tiles.tileset().content_type())
+    response['ETag'] = etag
+    response['Cache-Control'] = f'public, max-age={tiles.MAX_AGE}'
+    return response
+
+def api_perf(request):
+    """
+    Tiempos por vista desde que arrancó el proceso (p50/p95/p99 de tiempo
+    total, base, serialización, consultas y bytes) y los últimos requests
+    lentos. El SQL de los lentos solo se muestra con DEBUG o a usuarios staff.
+    ?format=prometheus devuelve lo mismo en formato de texto de Prometheus.
+    """
+    if request.GET.get('format') == 'prometheus':
+        return HttpResponse(perf.prometheus_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    show_sql = settings.DEBUG or request.user.is_staff
+    slow = [entry if show_sql else {**entry, "sql": []} for entry in perf.registry.slow]
+    response = serializers.json_response({
+        "enabled": perf.enabled(),
+        "slow_ms": perf.slow_ms(),
+        "views": perf.registry.snapshot(),
+        "slow": slow[::-1],
+    })
+    response['Cache-Control'] = 'no-store'
+    return response
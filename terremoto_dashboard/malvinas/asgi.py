@@ -2,6 +2,8 @@
 ASGI config for terremoto_dashboard project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP va a Django; los WebSockets de /ws/incidents/<id>/ a dashboard.routing.
+Servir con un servidor ASGI, p. ej. ``daphne malvinas.asgi:application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -11,6 +13,17 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'terremoto_dashboard.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'malvinas.settings')
 
-application = get_asgi_application()
+# inicializar Django antes de importar consumers/modelos
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.security.websocket import AllowedHostsOriginValidator  # noqa: E402
+
+from dashboard.routing import websocket_urlpatterns  # noqa: E402
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': AllowedHostsOriginValidator(URLRouter(websocket_urlpatterns)),
+})
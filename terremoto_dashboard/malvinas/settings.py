@@ -31,6 +31,8 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
+    # servidor ASGI para runserver (WebSockets de channels)
+    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -48,7 +50,11 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    # tiempos por vista, Server-Timing y /api/_perf/ (ver dashboard/perf.py)
+    'dashboard.middleware.PerfMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # gzip/brotli según Accept-Encoding (ver dashboard/middleware.py)
+    'dashboard.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -77,16 +83,115 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'malvinas.wsgi.application'
+ASGI_APPLICATION = 'malvinas.asgi.application'
+
+
+# Channels
+# Capa en memoria por defecto: alcanza para un único proceso ASGI. Los cambios
+# hechos desde otros procesos (comandos, otros workers) los detecta el relay
+# leyendo el feed de cambios (ver dashboard/relay.py).
+
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
+
+# cada cuánto el relay revisa el feed de cambios
+DASHBOARD_WS_POLL_SECONDS = 0.5
+# puntos pendientes por socket antes de pedirle al cliente un resync
+DASHBOARD_WS_MAX_PENDING_POINTS = 5000
+
+# Red vial para ruteo: CSV de tramos (ver dashboard/roads.py). Sin archivo,
+# /api/routes/ responde 503.
+DASHBOARD_ROAD_NETWORK = BASE_DIR / 'data' / 'roads.csv'
+
+# Teselas del mapa: MBTiles local que sirve /tiles/{z}/{x}/{y}.png (ver
+# dashboard/tiles.py), sembrado con seed_tiles. Sin archivo el mapa pide las
+# teselas directo a DASHBOARD_TILE_SOURCE (requiere conexión).
+DASHBOARD_TILES = BASE_DIR / 'data' / 'tiles.mbtiles'
+# origen por defecto de seed_tiles: URL {z}/{x}/{y} o un MBTiles regional. La
+# política de uso de tile.openstreetmap.org no permite descargas masivas:
+# seed_tiles se niega a sembrar varios niveles desde *.openstreetmap.org; usar
+# un servidor propio o un extracto.
+DASHBOARD_TILE_SOURCE = 'https://tile.openstreetmap.org/{z}/{x}/{y}.png'
+# tamaño del cache de teselas en memoria, por proceso (MB)
+DASHBOARD_TILE_CACHE_MB = 64
+
+# procesos para proyecciones Monte Carlo grandes (None: uno por CPU disponible;
+# nunca más que las CPU que puede usar el proceso)
+DASHBOARD_PROJECTION_WORKERS = None
+
+# hilos que ejecutan las tareas en segundo plano (0: en línea, dentro del request)
+DASHBOARD_JOB_WORKERS = 2
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Perfil para acceso concurrente (servidor ASGI, hilos de tareas y comandos):
+#   - WAL: los lectores no bloquean al escritor ni al revés.
+#   - synchronous=NORMAL: con WAL no pierde consistencia, solo las últimas
+#     transacciones ante un corte de energía.
+#   - timeout: segundos que una conexión espera un lock antes de fallar con
+#     "database is locked" (busy timeout).
+#   - IMMEDIATE: las transacciones toman el lock de escritura al empezar, así
+#     dos escritores nunca quedan trabados al pasar de lectura a escritura.
+#   - 'replica' es la misma base por otra conexión con query_only; el router
+#     manda ahí las lecturas (ver dashboard/routers.py y stress_database).
+# journal_mode=WAL queda guardado en el archivo (bytes 18-19 de la cabecera):
+# el db.sqlite3 de desarrollo del repositorio ya se versiona convertido, así
+# que abrirlo no lo modifica. Los -wal/-shm que deja al lado no se versionan.
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -32000',       # KiB (32 MB por conexión)
+    'PRAGMA mmap_size = 268435456',     # 256 MB
+    'PRAGMA temp_store = MEMORY',
+]
+SQLITE_TIMEOUT = 20
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': SQLITE_TIMEOUT,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': '; '.join(SQLITE_PRAGMAS),
+        },
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': SQLITE_TIMEOUT,
+            'init_command': '; '.join([*SQLITE_PRAGMAS[1:], 'PRAGMA query_only = ON']),
+        },
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+DATABASE_ROUTERS = ['dashboard.routers.ReadReplicaRouter']
+# alias al que el router manda las lecturas (si no existe, 'default')
+DASHBOARD_READ_ALIAS = 'replica'
+
+
+# Cache
+# El alias 'dashboard' se comparte entre procesos (servidor y comandos de
+# manage.py) porque guarda la version del snapshot de /api/summary/.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'dashboard': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'dashboard',
+    },
 }
 
 
@@ -136,3 +241,24 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Archivos estáticos
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / "static"]
+
+# días que se conservan los puntos crudos y cada nivel de agregados de
+# métricas (None: sin límite); ver dashboard/rollups.py y compact_metrics
+DASHBOARD_METRIC_RETENTION = {'raw': 7, 'minute': 30, 'hour': 365, 'day': None}
+
+# id de este nodo en los paquetes de sincronización (None: el nombre del host);
+# tiene que ser único entre los nodos que intercambian paquetes
+DASHBOARD_NODE_ID = None
+# clave compartida con cada nodo, {id del otro nodo: clave}: firma los paquetes
+# que se le mandan y verifica los que manda; sin clave no se intercambia nada
+DASHBOARD_SYNC_KEYS = {}
+
+# cada cuántos ids del registro de cambios se encola una tarea 'checkpoint'
+# de los incidentes que cambiaron (ver dashboard/history.py y jobs.py): acota
+# lo que reproduce una consulta ?as_of= (0: solo con el comando checkpoint_changes)
+DASHBOARD_HISTORY_CHECKPOINT_EVERY = 1000
+
+# instrumentación de requests (Server-Timing, histogramas de /api/_perf/)
+DASHBOARD_PERF = True
+# requests más lentos que esto (ms) se registran con sus consultas en el logger 'dashboard.perf'
+DASHBOARD_PERF_SLOW_MS = 500